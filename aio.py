@@ -0,0 +1,461 @@
+# Serial tool (srltool) - A tool to communicate with a Micropython-based STM32 device
+# Author: Amin Haghighatbin
+# Copyright 2022 - MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+
+
+import os
+import sys
+import json
+import struct
+import asyncio
+from time import monotonic
+from contextlib import asynccontextmanager
+import serial
+from src import SerialOperations, Telemetry, DeviceError, in_phase, DeviceTimeout, BAUDRATE, HANDSHAKE_TIMEOUT, RAW_REPL_PROMPT, REPLY, REPLY_SYNC, REPLY_HEADER, REPLY_JSON, REPLY_INTS, REPLY_MAX
+
+
+class AsyncSerialTool(SerialOperations):
+    """asyncio counterpart of SerialTool: the same operations as coroutines, so that a single event loop can talk to
+    several devices at once (one AsyncSerialTool per device).
+
+    Example:
+    async with AsyncSerialTool('/dev/ttyACM0') as tool:
+        await tool.sendfile('main.py')
+        print(await tool.memstat())
+    """
+    def __init__(self, port: str=None, serial_number: str=None, timeout: float=None):
+        super().__init__(port, serial_number, timeout)
+        self.buffer = bytearray()
+        self.waiter = None
+        self.error = None
+        self.fd = None
+        self.lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    @in_phase('connect')
+    async def connect(self) -> None:
+        """Opens the serial connection, to [port] if one was given and to the discovered device otherwise,
+        and starts watching it for incoming data."""
+        if self.port:
+            port, name = self.port, 'device'
+        else:
+            port, name = self.discover()
+        try:
+            self.connection = serial.Serial(port, baudrate=BAUDRATE, timeout=0)
+        except PermissionError:
+            sys.exit("Permission denied; please run the script in sudo mode.")
+        except Exception as e:
+            sys.exit(f"{e}; are you sure you're running the script in sudo mode?")
+        self.port = port
+        self.fd = self.connection.fileno()
+        os.set_blocking(self.fd, False)
+        self.error = None
+        asyncio.get_running_loop().add_reader(self.fd, self.on_readable)
+        print(f"Connection with the [{name}] established on {port}\n", file=self.stdout)
+
+    async def close(self) -> None:
+        """Closes the serial connection, if it was opened."""
+        if self.connection is None:
+            return
+        if self.in_raw_repl and self.error is None:
+            await self.exit_raw_repl()
+        asyncio.get_running_loop().remove_reader(self.fd)
+        self.connection.close()
+        self.connection = None
+        self.buffer.clear()
+
+    def on_readable(self) -> None:
+        """Moves the bytes waiting on the port into the buffer and wakes up the pending read, if any."""
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            data, self.error = b'', e
+        self.metrics.bytes_read += len(data)
+        if not data:
+            self.error = self.error or ConnectionError(f'The connection with {self.port} was lost.')
+            asyncio.get_running_loop().remove_reader(self.fd)
+        self.buffer += data
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def wait_readable(self) -> None:
+        """Waits until more data has been buffered."""
+        if self.connection is None:
+            await self.connect()
+            return
+        if self.error is not None:
+            raise self.error
+        self.waiter = asyncio.get_running_loop().create_future()
+        start = monotonic()
+        try:
+            await self.waiter
+        finally:
+            self.waiter = None
+            self.metrics.idle += monotonic() - start
+
+    async def write(self, data: bytes) -> None:
+        if self.connection is None:
+            await self.connect()
+        self.metrics.bytes_written += len(data)
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self.fd, view):]
+            except BlockingIOError:
+                pass
+            if view:
+                loop = asyncio.get_running_loop()
+                writable = loop.create_future()
+                loop.add_writer(self.fd, lambda: writable.done() or writable.set_result(None))
+                try:
+                    await writable
+                finally:
+                    loop.remove_writer(self.fd)
+
+    async def drain(self) -> None:
+        """Waits for the written data to leave the port (tcdrain(), off the event loop)."""
+        await asyncio.get_running_loop().run_in_executor(None, self.connection.flush)
+
+    async def take(self, size: int) -> bytes:
+        """Waits for [size] bytes to be buffered and takes them."""
+        while len(self.buffer) < size:
+            await self.wait_readable()
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    async def take_until(self, marker: bytes) -> bytes:
+        """Waits for [marker] to be buffered and takes the data up to and including it."""
+        start = 0
+        while True:
+            i = self.buffer.find(marker, start)
+            if i >= 0:
+                data = bytes(self.buffer[:i + len(marker)])
+                del self.buffer[:i + len(marker)]
+                return data
+            start = max(0, len(self.buffer) - len(marker) + 1)
+            await self.wait_readable()
+
+    async def take_into(self, buffer) -> None:
+        """Waits for len([buffer]) bytes to be buffered and moves them into [buffer]."""
+        size = len(buffer)
+        while len(self.buffer) < size:
+            await self.wait_readable()
+        buffer[:] = self.buffer[:size]
+        del self.buffer[:size]
+
+    async def within(self, aw, what: str, timeout: float=None):
+        """Awaits [aw] and returns its result; a DeviceTimeout naming [what] is raised if it doesn't complete within
+        [timeout] seconds, or before the deadline of the current command if [timeout] is not given.
+        The buffer is left untouched by a read that timed out."""
+        if timeout is None:
+            timeout = self.remaining()
+        if timeout is None:
+            return await aw
+        try:
+            return await asyncio.wait_for(aw, timeout)
+        except asyncio.TimeoutError:
+            # the device is in an unknown state; the next command interrupts it and re-enters the raw-REPL.
+            self.in_raw_repl = False
+            raise DeviceTimeout(f'Timed out waiting for {what} (received {bytes(self.buffer[-40:])}).') from None
+
+    async def read(self, size: int) -> bytes:
+        return await self.within(self.take(size), 'the device')
+
+    async def read_until(self, marker: bytes) -> bytes:
+        return await self.within(self.take_until(marker), 'the device')
+
+    async def readinto(self, buffer) -> None:
+        await self.within(self.take_into(buffer), 'the device')
+
+    async def enter_raw_repl(self) -> None:
+        """Entering the raw-REPL mode; does nothing if the device is already in it.
+        Anything buffered before is discarded and the raw-REPL prompt is awaited (see SerialTool.enter_raw_repl())."""
+        if self.in_raw_repl:
+            return
+        with self.metrics.phase('raw_repl'):
+            await self.write(b'\r\x03\x03')
+            for retry in range(3):
+                self.buffer.clear()
+                await self.write(b'\r\x01')
+                try:
+                    await self.within(self.take_until(RAW_REPL_PROMPT), 'the raw-REPL prompt', HANDSHAKE_TIMEOUT)
+                except DeviceTimeout:
+                    if retry == 2:
+                        raise
+                    self.metrics.retries += 1
+                    await self.write(b'\r\x03\x03')
+                else:
+                    self.in_raw_repl = True
+                    return
+
+    @in_phase('soft_reset')
+    async def soft_reset(self) -> None:
+        """Soft-resets the device, discarding the state left behind by the previous commands."""
+        await self.enter_raw_repl()
+        await self.write(b'\x04')
+        await self.within(self.take_until(RAW_REPL_PROMPT), 'the device to soft-reset', HANDSHAKE_TIMEOUT)
+        if not self.session_depth:
+            await self.exit_raw_repl()
+
+    async def exit_raw_repl(self) -> None:
+        """Exits the raw-REPL mode."""
+        await self.write(b'\r\x02')
+        self.in_raw_repl = False
+
+    @asynccontextmanager
+    async def session(self, reset: bool=False):
+        """Keeps the device in the raw-REPL mode for the duration of the block (see SerialTool.session()).
+
+        Example:
+        async with tool.session():
+            await tool.sendfile('lib/utils.py')
+            await tool.sendfile('main.py')
+        """
+        self.session_depth += 1
+        try:
+            yield self
+        finally:
+            self.session_depth -= 1
+            if not self.session_depth:
+                self.invalidate()
+                if reset:
+                    await self.soft_reset()
+                if self.in_raw_repl:
+                    await self.exit_raw_repl()
+
+    async def raw_paste_write(self, data: bytes) -> None:
+        """Writes the script in raw-paste mode, honouring the window size and the flow-control bytes sent by the device."""
+        window_size = struct.unpack('<H', await self.within(self.take(2), 'the raw-paste window size', HANDSHAKE_TIMEOUT))[0]
+        window_remain = window_size
+        i = 0
+        while i < len(data):
+            while window_remain == 0 or self.buffer:
+                flag = await self.within(self.take(1), 'the raw-paste flow control', HANDSHAKE_TIMEOUT)
+                if flag == b'\x01':
+                    window_remain += window_size
+                elif flag == b'\x04':
+                    # the device aborted the paste; acknowledge and let it report the error.
+                    await self.write(b'\x04')
+                    return
+                else:
+                    raise RuntimeError(f'Unexpected data during raw-paste: {flag}')
+            chunk = data[i:i + window_remain]
+            await self.write(chunk)
+            window_remain -= len(chunk)
+            i += len(chunk)
+        await self.write(b'\x04')
+        await self.within(self.take_until(b'\x04'), 'the end of the raw-paste', HANDSHAKE_TIMEOUT)
+
+    @in_phase('upload')
+    async def execute(self, cmd: str) -> None:
+        """Executes the command (see SerialTool.execute()); its output is left in the buffer to be read by follow()."""
+        await self.enter_raw_repl()
+        self.arm_deadline()
+        data = cmd.encode()
+        if self.use_raw_paste:
+            await self.write(b'\x05A\x01')
+            resp = await self.within(self.take(2), 'the raw-paste reply', HANDSHAKE_TIMEOUT)
+            if resp == b'R\x01':
+                await self.raw_paste_write(data)
+                return
+            if resp != b'R\x00':
+                # firmware without raw-paste support re-enters the raw-REPL on the trailing \x01;
+                # the first two bytes of its banner ('ra') were consumed above.
+                await self.within(self.take_until(RAW_REPL_PROMPT[2:]), 'the raw-REPL prompt', HANDSHAKE_TIMEOUT)
+            self.use_raw_paste = False
+
+        for i in range(0, len(data), 256):
+            await self.write(data[i:i + 256])
+            # without raw-paste there is no flow control; let each chunk leave the port before the next one is written.
+            await self.drain()
+        await self.write(b'\x04')
+        resp = await self.within(self.take(2), 'the device to accept the command', HANDSHAKE_TIMEOUT)
+        if resp != b'OK':
+            raise RuntimeError(f'Could not execute the command: {resp}')
+
+    @in_phase('execution')
+    async def follow(self) -> tuple:
+        """Reads the output of the executed command and returns it as (stdout, stderr)."""
+        out = (await self.within(self.take_until(b'\x04'), 'the output of the command'))[:-1]
+        return out, await self.read_stderr()
+
+    async def read_stderr(self) -> bytes:
+        """Reads the stderr section of the executed command's response up to the raw-REPL prompt and returns it."""
+        err = (await self.within(self.take_until(b'\x04'), 'the end of the command'))[:-1]
+        await self.within(self.take_until(b'>'), 'the raw-REPL prompt')
+        if not self.session_depth:
+            await self.exit_raw_repl()
+        return err
+
+    async def exec_raw(self, cmd: str) -> tuple:
+        """Executes the command and returns its output as (stdout, stderr)."""
+        async with self.serialised():
+            await self.execute(cmd)
+            return await self.follow()
+
+    @in_phase('execution')
+    async def exec_replies(self, cmd: str, prelude: str=REPLY):
+        """Executes the command and yields the decoded reply frames it writes (see SerialTool.exec_replies())."""
+        await self.execute(prelude + cmd)
+        tail = b''
+        while True:
+            byte = await self.within(self.take(1), 'a reply of the device')
+            if byte == b'\x04':
+                break
+            tail = (tail + byte)[-len(REPLY_SYNC):]
+            if tail != REPLY_SYNC:
+                continue
+            tail = b''
+            tag, size = REPLY_HEADER.unpack(await self.within(self.take(REPLY_HEADER.size), 'a reply of the device'))
+            if tag not in (REPLY_JSON, REPLY_INTS) or size > REPLY_MAX:
+                continue
+            if len(self.reply_buffer) < size:
+                self.reply_buffer = bytearray(size)
+            mv = memoryview(self.reply_buffer)[:size]
+            await self.readinto(mv)
+            self.arm_deadline()
+            if tag == REPLY_JSON:
+                yield json.loads(bytes(mv))
+            else:
+                yield list(struct.unpack_from(f'<{size // 4}i', mv))
+        err = await self.read_stderr()
+        if err:
+            raise DeviceError(err.decode().replace('\r', '').strip())
+
+    async def exec_reply(self, cmd: str, prelude: str=REPLY):
+        """Executes the command and returns its first reply frame, or None if it didn't reply."""
+        replies = [reply async for reply in self.exec_replies(cmd, prelude)]
+        return replies[0] if replies else None
+
+    async def run(self, script: str) -> str:
+        """Executes the [script] on the device, prints and returns its output; a DeviceError is raised if it fails."""
+        out, err = await self.exec_raw(script)
+        out = out.decode(errors='replace')
+        if out:
+            print(out.replace('\r', ''), end='' if out.endswith('\n') else '\n', file=self.stdout)
+        if err:
+            raise DeviceError(err.decode().replace('\r', '').strip())
+        return out
+
+    def serialised(self) -> asyncio.Lock:
+        """The lock serialising the operations issued on this tool, created on first use inside the running loop."""
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        return self.lock
+
+    async def drive(self, steps):
+        """Runs an operation written as a generator of I/O requests (see SerialOperations) to completion with coroutines
+        and returns its result; errors raised while serving a request, cancellations and Ctrl-Cs included, are thrown back
+        into the generator."""
+        async with self.serialised():
+            try:
+                request = next(steps)
+                while True:
+                    try:
+                        result = getattr(self, request[0])(*request[1:])
+                        if hasattr(result, '__anext__'):
+                            result = [item async for item in result]
+                        elif asyncio.iscoroutine(result):
+                            result = await result
+                    except BaseException as e:
+                        # a cancelled transfer still stops the loop of the device (see stop_transfer_steps()).
+                        request = steps.throw(e)
+                    else:
+                        request = steps.send(result)
+            except StopIteration as e:
+                return e.value
+
+    async def listdir(self, dir: str='', refresh: bool=False) -> list:
+        """See SerialOperations.listdir_steps()."""
+        return await self.drive(self.listdir_steps(dir, refresh))
+
+    async def stat(self, path: str) -> tuple:
+        """See SerialOperations.stat_steps()."""
+        return await self.drive(self.stat_steps(path))
+
+    async def ls(self, dir: str='', show: bool=True) -> str:
+        """See SerialOperations.ls_steps()."""
+        return await self.drive(self.ls_steps(dir, show))
+
+    async def walk(self, path: str='.', show_hidden: bool=True, dir_only: bool=False) -> list:
+        """See SerialOperations.walk_steps()."""
+        return await self.drive(self.walk_steps(path, show_hidden, dir_only))
+
+    async def tree(self, path: str='.', show_hidden=True, dir_only=False) -> int:
+        """See SerialOperations.tree_steps()."""
+        return await self.drive(self.tree_steps(path, show_hidden, dir_only))
+
+    async def memstat(self) -> str:
+        """See SerialOperations.memstat_steps()."""
+        return await self.drive(self.memstat_steps())
+
+    async def flashstat(self) -> str:
+        """See SerialOperations.flashstat_steps()."""
+        return await self.drive(self.flashstat_steps())
+
+    async def heap(self) -> dict:
+        """See SerialOperations.heap_steps()."""
+        return await self.drive(self.heap_steps())
+
+    async def heap_diff(self, script: str) -> dict:
+        """See SerialOperations.heap_diff_steps()."""
+        async with self.session():
+            return await self.drive(self.heap_diff_steps(script))
+
+    async def monitor(self, rate: float=100, duration: float=None, samples: int=None, history: int=1024, csv_path: str=None, mmap_path: str=None) -> Telemetry:
+        """See SerialOperations.monitor_steps()."""
+        telemetry = Telemetry(history, csv_path, mmap_path)
+        try:
+            async with self.session():
+                return await self.drive(self.monitor_steps(telemetry, rate, duration, samples))
+        finally:
+            telemetry.close()
+
+    async def call(self, function: str, *args, replies: bool=False):
+        """See SerialOperations.call_steps()."""
+        return await self.drive(self.call_steps(function, *args, replies=replies))
+
+    async def sendfile(self, filename_to_send: str, filename_to_save: str=None, forced: bool=False, BUFFER_SIZE: int=None, encoding: str='raw', compress: bool=None, resume: bool=False) -> None:
+        """See SerialOperations.sendfile_steps()."""
+        async with self.session():
+            return await self.drive(self.sendfile_steps(filename_to_send, filename_to_save, forced, BUFFER_SIZE, encoding, compress, resume))
+
+    async def upload_tree(self, entries: list, frame_size: int=None, encoding: str='raw', compress: bool=None, window: int=4, offsets: dict=None) -> None:
+        """See SerialOperations.upload_tree_steps()."""
+        async with self.session():
+            return await self.drive(self.upload_tree_steps(entries, frame_size, encoding, compress, window, offsets))
+
+    async def recvfile(self, filename_to_get: str, filename_to_save: str=None, check_exist: bool=True, BUFFER_SIZE: int=None, compress: bool=None, resume: bool=False) -> None:
+        """See SerialOperations.recvfile_steps()."""
+        async with self.session():
+            return await self.drive(self.recvfile_steps(filename_to_get, filename_to_save, check_exist, BUFFER_SIZE, compress, resume))
+
+    async def download(self, filename_to_get: str, filename_to_save: str, frame_size: int=None, compress: bool=None, offset: int=0) -> None:
+        """See SerialOperations.download_steps()."""
+        async with self.session():
+            return await self.drive(self.download_steps(filename_to_get, filename_to_save, frame_size, compress, offset))
@@ -0,0 +1,309 @@
+# Serial tool (srltool) - A tool to communicate with a Micropython-based STM32 device
+# Author: Amin Haghighatbin
+# Copyright 2022 - MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+from statistics import median
+from datetime import datetime, timezone
+from contextlib import contextmanager, redirect_stdout
+from functools import wraps
+from time import monotonic
+import click
+
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+HERE = os.path.dirname(os.path.abspath(__file__))
+# kept out of the source tree, next to the port cache of srltool.
+HISTORY = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'srltool', 'bench-history.jsonl')
+# remote directory the device benchmarks work in; removed afterwards.
+REMOTE = 'srltool-bench'
+# number of previous runs (with the same target) whose median is the baseline of a new run.
+BASELINE_RUNS = 5
+# latency changes below this many milliseconds are scheduling noise, not regressions.
+NOISE_MS = 2.0
+
+
+def measure(args: list, runs: int) -> float:
+    """Runs the command [runs] times and returns the best wall-clock time in seconds."""
+    best = None
+    for _ in range(runs):
+        start = monotonic()
+        subprocess.run(args, cwd=HERE, stdout=subprocess.DEVNULL, check=True)
+        elapsed = monotonic() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def quiet(operation, *args, **kwargs):
+    """Runs the operation with its output (progress lines included) discarded and returns its result."""
+    with redirect_stdout(io.StringIO()):
+        return operation(*args, **kwargs)
+
+
+def parse_size(size: str) -> int:
+    """'512', '64K' or '1M' in bytes."""
+    units = {'K': 1024, 'M': 1024 * 1024}
+    size = size.strip().upper()
+    if size[-1:] in units:
+        return int(size[:-1]) * units[size[-1]]
+    return int(size)
+
+
+def make_tree(path: str, files: int, size: int) -> None:
+    """Creates [files] random files of [size] bytes in total under [path], spread over two subdirectories."""
+    for i in range(files):
+        name = os.path.join(path, f'd{i % 2}', f'f{i}.bin')
+        os.makedirs(os.path.dirname(name), exist_ok=True)
+        with open(name, 'wb') as f:
+            f.write(os.urandom(size // files))
+
+
+@contextmanager
+def device(port: str, baudrate: int, latency: float):
+    """Yields a SerialTool connected to the device on [port], or to a simulated device (see sim.py) emulating
+    a link of [baudrate] and [latency] if no port is given. The benchmarks work in the REMOTE directory."""
+    from src import SerialTool
+    simulated = root = None
+    if port is None:
+        from sim import Device
+        root = tempfile.mkdtemp(prefix='srltool-bench-')
+        simulated = Device(root, baudrate=baudrate, latency=latency)
+        port = simulated.port
+    tool = SerialTool(port=port)
+    try:
+        quiet(tool.connect)
+        quiet(tool.mkdir, REMOTE)
+        yield tool
+    finally:
+        try:
+            quiet(tool.rmdir, REMOTE, recursive=True)
+        finally:
+            quiet(tool.close)
+            if simulated is not None:
+                simulated.close()
+                shutil.rmtree(root, ignore_errors=True)
+
+
+def timed(tool, operation, runs: int) -> list:
+    """Times [runs] executions of operation(tool), each in its own raw-REPL session as a command of the CLI would be,
+    and returns the elapsed times in seconds."""
+    times = []
+    for _ in range(runs):
+        start = monotonic()
+        with tool.session():
+            quiet(operation, tool)
+        times.append(monotonic() - start)
+    return times
+
+
+def commit() -> str:
+    """The current git commit of the tool, or None outside of a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(benchmark: str, target: dict, results: dict, history: str, tolerance: float, record: bool) -> bool:
+    """Prints the [results] ({name: (value, unit, higher_is_better)}) against the baseline of the previous runs of the
+    [benchmark] on the same [target] kept in the [history] file, appends them to it if [record] is set and returns
+    whether any of them regressed by more than [tolerance] (a fraction of the baseline)."""
+    previous = []
+    if history and os.path.exists(history):
+        with open(history) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('benchmark') == benchmark and entry.get('target') == target:
+                    previous.append(entry['results'])
+    previous = previous[-BASELINE_RUNS:]
+
+    regressed = False
+    for name, (value, unit, higher_is_better) in results.items():
+        values = [entry[name] for entry in previous if name in entry]
+        line = f'{name:<24} {value:>10.2f} {unit:<5}'
+        if values:
+            baseline = median(values)
+            change = (value - baseline) / baseline if baseline else 0.0
+            worse = -change if higher_is_better else change
+            if unit == 'ms' and abs(value - baseline) < NOISE_MS:
+                worse = 0.0
+            status = 'REGRESSION' if worse > tolerance else 'ok'
+            regressed = regressed or worse > tolerance
+            line += f' baseline {baseline:>10.2f} ({change:+.1%}) {status}'
+        print(line)
+
+    if history and record:
+        entry = {'benchmark': benchmark, 'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                 'commit': commit(), 'target': target, 'results': {name: result[0] for name, result in results.items()}}
+        if os.path.dirname(history):
+            os.makedirs(os.path.dirname(history), exist_ok=True)
+        with open(history, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+    return regressed
+
+
+def device_options(command):
+    """The options shared by the benchmarks that run against a device."""
+    @click.option('--port', '-p', default=None, help='Serial port of a real device; a simulated one is used by default.')
+    @click.option('--baudrate', type=int, default=None, help='Baudrate emulated by the simulated device; unthrottled by default.')
+    @click.option('--wire-latency', type=float, default=0.0, show_default=True, help='Seconds added by the simulated device to each of its writes.')
+    @click.option('--history', default=HISTORY, show_default=True, help='File keeping the results of the previous runs.')
+    @click.option('--record/--no-record', default=True, show_default=True, help='Appends the results to the history file.')
+    @click.option('--tolerance', default=0.2, show_default=True, help='Fraction of the baseline a result may worsen by before it is reported as a regression.')
+    @wraps(command)
+    def wrapper(port, baudrate, wire_latency, history, record, tolerance, **kwargs):
+        target = {'port': 'simulated', 'baudrate': baudrate, 'latency': wire_latency} if port is None else {'port': port}
+        with device(port, baudrate, wire_latency) as tool:
+            results = command(tool, **kwargs)
+        if report(command.__name__, target, results, history, tolerance, record):
+            sys.exit(1)
+    return wrapper
+
+
+@click.group(context_settings=CONTEXT_SETTINGS)
+def cli() -> None:
+    """Benchmarks for srltool."""
+
+
+@cli.command()
+@click.option('--budget', default=150, show_default=True, help='Maximum startup overhead in milliseconds, on top of the bare interpreter.')
+@click.option('--runs', default=10, show_default=True, help='Number of runs per command; the best one is kept.')
+def startup(budget, runs) -> None:
+    """Measures the startup time of the CLI.
+
+    Times `srltool --help` and a command that builds the tool without touching the device (`srltool ls --help`),
+    subtracts the startup time of the bare interpreter and fails if either overhead goes above the budget.
+    \b
+
+    Examples:
+
+    python bench.py startup
+
+    python bench.py startup --budget 100 --runs 20
+    """
+    interpreter = measure([sys.executable, '-c', 'pass'], runs)
+    print(f'{"python -c pass":<20} {interpreter * 1000:>8.1f} ms')
+    failed = False
+    for label, args in [('srltool --help', ['--help']), ('srltool ls --help', ['ls', '--help'])]:
+        elapsed = measure([sys.executable, '-c', 'import cli; cli.main()'] + args, runs)
+        overhead = (elapsed - interpreter) * 1000
+        status = 'ok' if overhead <= budget else 'over budget'
+        failed = failed or overhead > budget
+        print(f'{label:<20} {elapsed * 1000:>8.1f} ms (+{overhead:.1f} ms, budget {budget} ms) {status}')
+    if failed:
+        sys.exit(1)
+
+
+# operations timed by the latency benchmark, given the tool and a local scratch directory; the REMOTE directory holds a small tree.
+LATENCY = {
+    'exec': lambda tool, local: tool.exec_raw('pass'),
+    'ls': lambda tool, local: tool.ls(REMOTE),
+    'stat': lambda tool, local: tool.stat(f'{REMOTE}/tree/d0/f0.bin'),
+    'tree': lambda tool, local: tool.tree(REMOTE),
+    'du': lambda tool, local: tool.du(REMOTE),
+    'memstat': lambda tool, local: tool.memstat(),
+    'flashstat': lambda tool, local: tool.flashstat(),
+    'mkdir+rmdir': lambda tool, local: (tool.mkdir(f'{REMOTE}/new'), tool.rmdir(f'{REMOTE}/new')),
+    'sendfile 1K': lambda tool, local: tool.sendfile(os.path.join(local, 'small.bin'), f'{REMOTE}/small.bin', forced=True),
+    'recvfile 1K': lambda tool, local: tool.recvfile(f'{REMOTE}/small.bin', os.path.join(local, 'back.bin'), check_exist=False),
+}
+
+
+@cli.command()
+@click.option('--runs', default=10, show_default=True, help='Number of runs per command; the median is kept.')
+@device_options
+def latency(tool, runs) -> dict:
+    """Measures the latency of the commands of SerialTool.
+
+    Each command runs in its own raw-REPL session, as it would from the CLI, minus the startup of the interpreter.
+    The results are compared with the previous runs kept in the history file, and the benchmark fails if one of them
+    regressed beyond the tolerance.
+    \b
+
+    Examples:
+
+    python bench.py latency
+
+    python bench.py latency --baudrate 115200 --wire-latency 0.001
+
+    python bench.py latency --port /dev/ttyACM0 --no-record
+    """
+    with tempfile.TemporaryDirectory() as local:
+        make_tree(os.path.join(local, 'tree'), 4, 4096)
+        with open(os.path.join(local, 'small.bin'), 'wb') as f:
+            f.write(os.urandom(1024))
+        quiet(tool.senddir, os.path.join(local, 'tree'), f'{REMOTE}/tree')
+        return {name: (median(timed(tool, lambda tool: operation(tool, local), runs)) * 1000, 'ms', False)
+                for name, operation in LATENCY.items()}
+
+
+@cli.command()
+@click.option('--sizes', default='4K,64K,256K', show_default=True, help='Comma-separated sizes of the transfers.')
+@click.option('--files', default=8, show_default=True, help='Number of files the senddir transfers are split into.')
+@click.option('--runs', default=3, show_default=True, help='Number of runs per transfer; the best one is kept.')
+@device_options
+def throughput(tool, sizes, files, runs) -> dict:
+    """Measures the throughput of sendfile, recvfile and senddir across transfer sizes.
+
+    The payloads are random, so the results are those of incompressible data. The results are compared with the
+    previous runs kept in the history file, and the benchmark fails if one of them regressed beyond the tolerance.
+    \b
+
+    Examples:
+
+    python bench.py throughput
+
+    python bench.py throughput --sizes 1K,1M --baudrate 115200
+
+    python bench.py throughput --port /dev/ttyACM0 --no-record
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as local:
+        for label in sizes.split(','):
+            size = parse_size(label)
+            label = label.strip().upper()
+            blob, back, tree = (os.path.join(local, name) for name in (f'{label}.bin', f'{label}.back', f'{label}.tree'))
+            with open(blob, 'wb') as f:
+                f.write(os.urandom(size))
+            make_tree(tree, files, size)
+            transfers = {
+                f'sendfile {label}': lambda tool: tool.sendfile(blob, f'{REMOTE}/blob.bin', forced=True),
+                f'recvfile {label}': lambda tool: tool.recvfile(f'{REMOTE}/blob.bin', back, check_exist=False),
+                f'senddir {label}': lambda tool: tool.senddir(tree, f'{REMOTE}/tree', forced=True),
+            }
+            for name, operation in transfers.items():
+                results[name] = (size / 1024 / min(timed(tool, operation, runs)), 'KB/s', True)
+            with open(back, 'rb') as f, open(blob, 'rb') as g:
+                if f.read() != g.read():
+                    raise click.ClickException(f'recvfile {label} did not return the data sent.')
+    return results
+
+
+if __name__ == '__main__':
+    cli()
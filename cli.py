@@ -19,13 +19,35 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 
+import os
+import sys
+import re
+import json
+import socket
+import socketserver
+from time import monotonic
+from contextlib import redirect_stdout, redirect_stderr
 import click
-from src import SerialTool
+from src import SerialTool, DeviceTimeout, run_fleet, analyze_capture, format_analysis, format_heap, format_heap_diff
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+# the Unix socket the daemon listens on; commands are forwarded to it while it is running.
+SOCKET_PATH = os.environ.get('SRLTOOL_SOCKET') or os.path.join(
+    os.environ.get('XDG_RUNTIME_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'srltool'), 'srltool.sock')
+# the tool owned by the daemon; set only in the daemon process.
+_daemon_tool = None
 
 @click.group(context_settings=CONTEXT_SETTINGS)
-def cli() -> None:
+@click.option('--port', '-p', envvar='SRLTOOL_PORT', help='Serial port of the device; skips the discovery.')
+@click.option('--serial-number', envvar='SRLTOOL_SERIAL', help='USB serial number of the device, to choose between several.')
+@click.option('--soft-reset', is_flag=True, help='Soft-resets the device once the command has completed.')
+@click.option('--timeout', type=float, envvar='SRLTOOL_TIMEOUT', help='Seconds each step of a command (its completion, a frame of a transfer, a sample of the monitor) is given on the device; 60 by default, 0 waits indefinitely.')
+@click.option('--stats', is_flag=True, help='Prints where the time of the command went (per phase, bytes, retries) once it has completed.')
+@click.option('--stats-json', type=click.Path(dir_okay=False, allow_dash=True), help='Writes the stats of the command to the file as JSON ("-" for stdout).')
+@click.option('--prometheus', type=click.Path(dir_okay=False), envvar='SRLTOOL_PROMETHEUS', help='Writes the stats of the command to the file for the textfile collector of Prometheus.')
+@click.option('--capture', type=click.Path(dir_okay=False), help='Records every byte exchanged with the device in the file, to be read by "srltool analyze".')
+@click.pass_context
+def cli(ctx, port, serial_number, soft_reset, timeout, stats, stats_json, prometheus, capture) -> None:
     """
     Serial Tool(srltool): A tool to communicate with a Micropython(STM32) device\n
     "srltool" is an extremely simplified command-line tool to communicate with Micropython-based STM32 devices over serial connection. 
@@ -34,11 +56,47 @@ def cli() -> None:
     Note: "srltool" was a personal project for personal use; please be cautious specifically while using features such rmdir/rmfile.
     """
     global _command
-    _command = SerialTool()
+    if _daemon_tool is not None:
+        # forwarded by a client: reuse the daemon's connection and its raw-REPL session.
+        if port and port != _daemon_tool.port:
+            raise click.UsageError(f'The daemon is connected to {_daemon_tool.port}, not {port}.')
+        if serial_number and serial_number != _daemon_tool.serial_number:
+            raise click.UsageError(f'The daemon is not connected to the device with the serial number {serial_number}.')
+        _command = _daemon_tool
+        _command.timeout = timeout
+        _command.metrics.reset()
+        # registered first so that it runs last, once the command is over.
+        ctx.call_on_close(lambda: report_stats(ctx.invoked_subcommand, stats, stats_json, prometheus))
+        if capture:
+            _command.start_capture(capture, ctx.invoked_subcommand)
+            ctx.call_on_close(_command.stop_capture)
+        if soft_reset:
+            ctx.call_on_close(_command.soft_reset)
+        return
+    _command = SerialTool(port, serial_number, timeout)
+    if capture:
+        _command.start_capture(capture, ctx.invoked_subcommand)
+    ctx.call_on_close(lambda: report_stats(ctx.invoked_subcommand, stats, stats_json, prometheus))
+    ctx.call_on_close(_command.close)
+    ctx.with_resource(_command.session(reset=soft_reset))
+
+def report_stats(command: str, stats: bool, stats_json: str, prometheus: str) -> None:
+    """Reports the metrics of the command that has just completed, as requested by the --stats options."""
+    metrics = _command.metrics
+    if stats:
+        print(metrics.summary(command))
+    if stats_json == '-':
+        print(json.dumps(dict(metrics.as_dict(), command=command)))
+    elif stats_json:
+        with open(stats_json, 'w') as f:
+            json.dump(dict(metrics.as_dict(), command=command), f, indent=2)
+    if prometheus:
+        metrics.write_prometheus(prometheus, command)
 
 @cli.command()
 @click.argument('dir', type=click.STRING, default='')
-def ls(dir) -> None:
+@click.option('--recursive', '-R', is_flag=True, help='Lists the subdirectories recursively as well.')
+def ls(dir, recursive) -> None:
     """Lists the content of the specified directory.
     \b
 
@@ -47,9 +105,14 @@ def ls(dir) -> None:
     srltool ls 
 
     srltool ls [directory]
+
+    srltool ls [directory] -R
     \f
     """
-    _command.ls(dir)
+    if recursive:
+        _command.ls_recursive(dir)
+    else:
+        _command.ls(dir)
 
 @cli.command()
 @click.argument('path', type=click.STRING, default='.')
@@ -73,17 +136,92 @@ def tree(path, show_hidden, dir_only) -> None:
     """
     _command.tree(path, show_hidden, dir_only)
 
+@cli.command()
+@click.argument('path', type=click.STRING, default='.')
+@click.option('--all', '-a', 'all_files', is_flag=True, help='Shows the size of every file as well.')
+def du(path, all_files) -> None:
+    """Shows the disk usage of the specified directory.
+
+    Prints the total size of the specified directory and of each of its subdirectories.
+    The [--all or -a] option if passed will also show the size of every file, the default flag is False.
+    \b
+
+    Examples:
+
+    srltool du
+
+    srltool du [path-to-dir]
+
+    srltool du [path-to-dir] --all
+    \f
+    """
+    _command.du(path, all=all_files)
+
 @cli.command('memstat')
-def mem_stat() -> str:
+@click.option('--detailed', is_flag=True, help='Parses the heap block map into the largest free block, the fragmentation and a histogram of the block sizes.')
+@click.option('--run', 'script', type=click.File('r'), help='Runs the script between two detailed snapshots and shows what it changed.')
+@click.option('--json', 'as_json', is_flag=True, help='Prints the detailed snapshot(s) as JSON.')
+def mem_stat(detailed, script, as_json) -> str:
     """Returns the memory status of the device.
+
+    The [--detailed] option captures micropython.mem_info(1) after a collection and parses its heap block map into the
+    largest free block, the fragmentation (the share of the free memory outside of it) and a histogram of the sizes of
+    the free runs and of the allocations; [--run] takes a snapshot before and after running a script and shows the change.
     \b
 
-    Example:
+    Examples:
 
     srltool memstat
+
+    srltool memstat --detailed
+
+    srltool memstat --run app.py
+
+    srltool memstat --detailed --json
     \f
     """
-    _command.memstat()
+    if script is not None:
+        result = _command.heap_diff(script.read())
+        if as_json:
+            print(json.dumps(result, indent=2))
+            return
+        if result['output']:
+            print(result['output'], end='' if result['output'].endswith('\n') else '\n')
+        if result['error']:
+            print(f"The script failed: {result['error']}")
+        print('Before:\n' + format_heap(result['before']) + '\n\nAfter:\n' + format_heap(result['after']) + '\n')
+        print(format_heap_diff(result['before'], result['after'], result['diff']))
+    elif detailed:
+        heap = _command.heap()
+        print(json.dumps(heap, indent=2) if as_json else format_heap(heap))
+    else:
+        _command.memstat()
+
+@cli.command()
+@click.option('--rate', default=100.0, show_default=True, help='Samples per second.')
+@click.option('--duration', type=float, help='Seconds to monitor for; until Ctrl-C by default.')
+@click.option('--samples', type=int, help='Number of samples to take; until Ctrl-C by default.')
+@click.option('--history', default=1024, show_default=True, help='Samples kept in the ring buffer the rolling statistics are computed over.')
+@click.option('--csv', 'csv_path', type=click.Path(dir_okay=False), help='Writes every sample to the file as CSV.')
+@click.option('--mmap', 'mmap_path', type=click.Path(dir_okay=False), help='Writes the samples to the file as a memory-mapped ring of records.')
+def monitor(rate, duration, samples, history, csv_path, mmap_path) -> None:
+    """Streams the memory and flash usage of the device.
+
+    A single loop on the device streams binary samples of gc.mem_free(), gc.mem_alloc() and the free flash at [--rate]
+    samples per second; the last [--history] samples are kept with their minimum, maximum and slope, to watch for a leak.
+    The [--csv] and [--mmap] options write the samples to a file as well; see the README for the layout of the ring.
+    \b
+
+    Examples:
+
+    srltool monitor
+
+    srltool monitor --rate 200 --duration 60 --csv heap.csv
+
+    srltool monitor --samples 1000 --mmap heap.map
+    \f
+    """
+    _command.monitor(rate, duration, samples, history, csv_path, mmap_path)
 
 @cli.command('flashstat')
 def flash_stat() -> str:
@@ -170,15 +308,22 @@ def rmdir(dir: str, forced) -> None:
 @cli.command('send-file')
 @click.argument('filename_to_send', type=click.STRING)
 @click.argument('filename_to_save', type=click.STRING, default='')
-@click.argument('buffer_size', type=click.INT, default=64)
+@click.argument('buffer_size', type=click.INT, required=False)
 @click.option('--forced','-f', is_flag=True, help='Replaces the exisiting file; use with caution!')
-def sendfile(filename_to_send: str, filename_to_save: str, forced: bool, buffer_size: int) -> None:
+@click.option('--encoding', type=click.Choice(['raw', 'base64']), default='raw', help='Frame encoding; base64 for links that are not 8-bit clean.')
+@click.option('--compress/--no-compress', default=None, help='Forces or disables the compressed transport; decided per file by default.')
+@click.option('--resume', is_flag=True, help='Continues an interrupted transfer of the file where it stopped.')
+def sendfile(filename_to_send: str, filename_to_save: str, forced: bool, buffer_size: int, encoding: str, compress: bool, resume: bool) -> None:
     """Sends the specified file.
     
     Sends the specified [filename_to_send] and will save as the specified [filename_to_save];
     If the [filename_to_save] has not been specified as an argument, then the same name as the [filename_to_get] will be designated to save the file.
-    buffer_size argument may also be passed to adjust the size of the buffers to be transferred over serial; the default value is 32;
+    buffer_size argument may also be passed to fix the size of the frames to be transferred over serial; by default it is chosen
+    automatically from the free memory of the device and grown while the throughput improves;
+    the [--encoding] option selects raw (default) or base64 frames;
+    the [--compress/--no-compress] option forces or disables the compressed transport, which is otherwise used when the file compresses well;
     the [--forced or -f] option can be passed to over-write the exisitng file, please be cautious!
+    the [--resume] option continues an interrupted transfer from the last byte the device holds, once its sha256 matches the local file.
     \b
 
     Examples:
@@ -188,24 +333,27 @@ def sendfile(filename_to_send: str, filename_to_save: str, forced: bool, buffer_
     srltool send-file [filename_to_send] 
 
     srltool send-file [filename_to_send] --forced buffer_size=128
+
+    srltool send-file [filename_to_send] --resume
     \f
     """
     if filename_to_save == '':
        filename_to_save = filename_to_send
     if forced:
-        _command.sendfile(filename_to_send, filename_to_save, True, buffer_size)
+        _command.sendfile(filename_to_send, filename_to_save, True, buffer_size, encoding, compress, resume)
     else:
-        _command.sendfile(filename_to_send, filename_to_save, False, buffer_size)
+        _command.sendfile(filename_to_send, filename_to_save, False, buffer_size, encoding, compress, resume)
 
 
 @cli.command('send-dir')
 @click.argument('dirname_to_send', type=click.STRING)
 @click.argument('dirname_to_save', type=click.STRING, default='')
 @click.option('--forced','-f', is_flag=True, help='Replaces the existing directory; use with caution!')
-def senddir(dirname_to_send: str, dirname_to_save: str, forced: bool) -> None:
+@click.option('--compress/--no-compress', default=None, help='Forces or disables the compressed transport; decided per file by default.')
+def senddir(dirname_to_send: str, dirname_to_save: str, forced: bool, compress: bool) -> None:
     """Sends the specified directory
     
-    Sends the specified [dirname_to_send] and all its included files to the specified [dirname_to_save];
+    Sends the specified [dirname_to_send] and all its included files and subdirectories to the specified [dirname_to_save] in a single stream;
     If the [dirname_to_save] has not been specified as an argument, then the same name as the [dirname_to_send] will be designated to save the folder. 
     the [--forced or -f] option can be passed to over-write the exisitng folder and all its included files, please be cautious!
     \b
@@ -221,22 +369,51 @@ def senddir(dirname_to_send: str, dirname_to_save: str, forced: bool) -> None:
     if dirname_to_save == '':
         dirname_to_save = dirname_to_send
     if forced:
-        _command.senddir(dirname_to_send, dirname_to_save, True)
+        _command.senddir(dirname_to_send, dirname_to_save, True, compress)
     else:
-        _command.senddir(dirname_to_send, dirname_to_save, False)
+        _command.senddir(dirname_to_send, dirname_to_save, False, compress)
+
+@cli.command('sync')
+@click.argument('dirname_to_send', type=click.STRING)
+@click.argument('dirname_to_save', type=click.STRING, default='')
+@click.option('--delete', is_flag=True, help='Removes remote files that no longer exist locally; use with caution!')
+@click.option('--compress/--no-compress', default=None, help='Forces or disables the compressed transport; decided per file by default.')
+def sync(dirname_to_send: str, dirname_to_save: str, delete: bool, compress: bool) -> None:
+    """Synchronises the specified directory.
+
+    Compares the sha256 of every file under [dirname_to_send] with the files under [dirname_to_save] on the device
+    and only sends the new or changed ones;
+    If the [dirname_to_save] has not been specified as an argument, then the same name as the [dirname_to_send] will be designated to save the folder.
+    the [--delete] option removes the remote files and directories that no longer exist locally, please be cautious!
+    \b
+
+    Examples:
+
+    srltool sync [dirname_to_send] [dirname_to_save]
+
+    srltool sync [dirname_to_send] --delete\f
+    """
+    if dirname_to_save == '':
+        dirname_to_save = dirname_to_send
+    _command.sync(dirname_to_send, dirname_to_save, delete, compress)
 
 @cli.command('recv-file')
 @click.argument('filename_to_get', type=click.STRING)
 @click.argument('filename_to_save', type=click.STRING, default='')
 @click.argument('check_exist', type=click.BOOL, default=True)
-@click.argument('buffer_size', type=click.INT, default=32)
-def recvfile(filename_to_get: str, filename_to_save: str, check_exist: bool, buffer_size: int) -> None:
+@click.argument('buffer_size', type=click.INT, required=False)
+@click.option('--compress/--no-compress', default=None, help='Forces or disables the compressed transport; used when the device supports it by default.')
+@click.option('--resume', is_flag=True, help='Continues an interrupted transfer of the file where it stopped.')
+def recvfile(filename_to_get: str, filename_to_save: str, check_exist: bool, buffer_size: int, compress: bool, resume: bool) -> None:
     """Receives the specified file.
     
     Receives the specified [filename_to_get] and will save as the specified [filename_to_save];
     If the [filename_to_save] has not been specified as an argument, then the same name as the [filename_to_get] will be designated to save the file.
     check_exist argument may be passed to check if the file exists; the default value is True;
-    buffer_size argument may also be passed to adjust the size of the buffers to be transferred over serial; the default value is 32.
+    buffer_size argument may also be passed to fix the size of the frames to be transferred over serial; by default it is chosen
+    automatically from the free memory of the device and grown while the throughput improves;
+    the [--compress/--no-compress] option forces or disables the compressed transport, which is otherwise used when the device can deflate;
+    the [--resume] option continues an interrupted transfer from the end of the partial local file, once its sha256 matches the remote file.
     \b
 
     Examples:
@@ -247,19 +424,22 @@ def recvfile(filename_to_get: str, filename_to_save: str, check_exist: bool, buf
 
     srltool recv-file [filename_to_get] check_exist=True buffer_size=64
 
-    srltool recv-file [filename_to_get] [filename_to_save]\f
+    srltool recv-file [filename_to_get] [filename_to_save]
+
+    srltool recv-file [filename_to_get] --resume\f
     """
     if filename_to_save == '':
         filename_to_save = filename_to_get
-    _command.recvfile(filename_to_get, filename_to_save, check_exist, buffer_size)
+    _command.recvfile(filename_to_get, filename_to_save, check_exist, buffer_size, compress, resume)
 
 @cli.command('recv-dir')
 @click.argument('dirname_to_get', type=click.STRING)
 @click.argument('dirname_to_save', type=click.STRING, default='')
-def recvdir(dirname_to_get, dirname_to_save: str) -> None:
+@click.option('--compress/--no-compress', default=None, help='Forces or disables the compressed transport; used when the device supports it by default.')
+def recvdir(dirname_to_get, dirname_to_save: str, compress: bool) -> None:
     """Receives the specified directory.
     
-    Receives the specified directory [dirname_to_get] and its included files and will save in the specified [dirname_to_save];
+    Receives the specified directory [dirname_to_get] and all its included files and subdirectories in a single stream and will save in the specified [dirname_to_save];
     If the [dirname_to_save] has not been specified as an argument, then the same name as the [dirname_to_get] will be designated to save the folder. 
     \b
     
@@ -272,8 +452,8 @@ def recvdir(dirname_to_get, dirname_to_save: str) -> None:
     srltool recv-dir dirname_to_get\f
     """
     if dirname_to_save == '':
-        direname_to_save = dirname_to_get
-    _command.recvdir(dirname_to_get, dirname_to_save)
+        dirname_to_save = dirname_to_get
+    _command.recvdir(dirname_to_get, dirname_to_save, compress)
 
 @cli.command('astroid')
 @click.argument('iterations', type=click.INT, default=10)
@@ -294,6 +474,278 @@ def astroid(iterations) -> int:
     """
     _command.astroid(iterations)
 
+@cli.command()
+@click.argument('capture', type=click.Path(exists=True, dir_okay=False))
+@click.option('--gap', default=0.02, show_default=True, help='Seconds without traffic reported as an idle gap.')
+@click.option('--top', default=10, show_default=True, help='Number of idle gaps listed, the longest first.')
+@click.option('--json', 'as_json', is_flag=True, help='Prints the analysis as JSON.')
+def analyze(capture, gap, top, as_json) -> None:
+    """Rebuilds the timeline of a capture recorded with the --capture option.
+
+    Lists every phase of the command (raw-REPL entry, script upload, execution, transfer) with its bytes and the time
+    spent blocked on the device, the longest idle gaps, the flow-control stalls and the protocol overhead against the
+    payload; the device is not needed.
+    \b
+
+    Examples:
+
+    srltool --capture deploy.cap send-dir app
+
+    srltool analyze deploy.cap
+
+    srltool analyze deploy.cap --gap 0.005 --top 20
+    """
+    analysis = analyze_capture(capture, gap)
+    if as_json:
+        print(json.dumps(analysis, indent=2))
+    else:
+        print(format_analysis(analysis, top))
+
+@cli.group()
+@click.option('--ports', help='Comma-separated list of ports; every discovered device by default.')
+@click.option('--jobs', '-j', default=8, show_default=True, help='Maximum number of devices worked on at once.')
+@click.pass_context
+def fleet(ctx, ports, jobs) -> None:
+    """Runs a command on every connected device at once.
+
+    One worker (and connection) per port, at most [--jobs] at a time; the output of each device is reported
+    once it has finished, followed by a summary of the failures. Stop the daemon before using it.
+    \b
+
+    Examples:
+
+    srltool fleet stats
+
+    srltool fleet --jobs 16 sync [dirname_to_send] [dirname_to_save]
+
+    srltool fleet --ports /dev/ttyACM0,/dev/ttyACM1 exec script.py
+    \f
+    """
+    if forward_available():
+        raise click.ClickException('A daemon is holding one of the ports; please stop it first.')
+    ctx.obj = {'ports': ports.split(',') if ports else None, 'jobs': jobs}
+
+def report_fleet(ctx, operation) -> None:
+    """Runs the operation on the fleet and prints the output of every device and a summary; exits with 1 if any failed."""
+    start = monotonic()
+    results = run_fleet(operation, ctx.obj['ports'], ctx.obj['jobs'])
+    if not results:
+        raise click.ClickException('No MicroPython/STM32 device was found.')
+    failed = []
+    for port, _, error, output, elapsed in results:
+        print(f'[{port}] {"failed" if error is not None else "ok"} in {elapsed:.2f}s')
+        # keep only the final state of the progress lines, without the terminal escape sequences.
+        lines = [re.sub(r'\x1b\[[0-9;?]*[A-Za-z]', '', line.split('\r')[-1]).strip() for line in output.split('\n')]
+        lines = [line for line in lines if line]
+        for line in lines:
+            print(f'    {line}')
+        if error is not None:
+            message = str(error.code if isinstance(error, SystemExit) else error).strip()
+            for line in message.splitlines():
+                print(f'    {line}')
+            # the last line of a device-side traceback is the error itself.
+            failed.append((port, message.splitlines()[-1] if message else type(error).__name__))
+    print(f'\n{len(results)} device(s): {len(results) - len(failed)} ok, {len(failed)} failed in {monotonic() - start:.2f}s')
+    for port, reason in failed:
+        print(f'  {port}: {reason}')
+    if failed:
+        sys.exit(1)
+
+@fleet.command('stats')
+@click.pass_context
+def fleet_stats(ctx) -> None:
+    """Returns the overall flash size details and memory status of every device."""
+    report_fleet(ctx, lambda tool: tool.overall_stat())
+
+@fleet.command('send-dir')
+@click.argument('dirname_to_send', type=click.STRING)
+@click.argument('dirname_to_save', type=click.STRING, default='')
+@click.option('--forced','-f', is_flag=True, help='Replaces the existing directory; use with caution!')
+@click.option('--compress/--no-compress', default=None, help='Forces or disables the compressed transport; decided per file by default.')
+@click.pass_context
+def fleet_senddir(ctx, dirname_to_send: str, dirname_to_save: str, forced: bool, compress: bool) -> None:
+    """Sends the specified directory to every device."""
+    report_fleet(ctx, lambda tool: tool.senddir(dirname_to_send, dirname_to_save or None, forced, compress))
+
+@fleet.command('sync')
+@click.argument('dirname_to_send', type=click.STRING)
+@click.argument('dirname_to_save', type=click.STRING, default='')
+@click.option('--delete', is_flag=True, help='Removes remote files that no longer exist locally; use with caution!')
+@click.option('--compress/--no-compress', default=None, help='Forces or disables the compressed transport; decided per file by default.')
+@click.pass_context
+def fleet_sync(ctx, dirname_to_send: str, dirname_to_save: str, delete: bool, compress: bool) -> None:
+    """Synchronises the specified directory on every device."""
+    report_fleet(ctx, lambda tool: tool.sync(dirname_to_send, dirname_to_save, delete, compress))
+
+@fleet.command('exec')
+@click.argument('script', type=click.File('r'), required=False)
+@click.option('--command', '-c', help='Python code to execute instead of a script file.')
+@click.pass_context
+def fleet_exec(ctx, script, command: str) -> None:
+    """Executes a MicroPython script (or the code given with -c) on every device and shows its output."""
+    if script is None and command is None:
+        raise click.UsageError('Please pass a script or the -c option.')
+    code = command if command is not None else script.read()
+    report_fleet(ctx, lambda tool: tool.run(code))
+
+class ClientStream:
+    """File-like object that forwards the output of a command to the client of the daemon as it is written;
+    once the client has gone, the output is discarded so that the command still completes on the device, and the
+    stream reads as closed so that the commands that run until interrupted (monitor) stop instead."""
+    def __init__(self, connection):
+        self.connection = connection
+
+    @property
+    def closed(self) -> bool:
+        return self.connection is None
+
+    def write(self, data) -> int:
+        if isinstance(data, bytes):
+            data = data.decode(errors='replace')
+        if self.connection is not None and data:
+            try:
+                self.connection.sendall(json.dumps({'out': data}).encode() + b'\n')
+            except OSError:
+                self.connection = None
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def isatty(self) -> bool:
+        return True
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    """Runs one forwarded command line: reads {"args", "cwd"} and answers with {"out"} messages and a final {"exit"}."""
+    timeout = 5
+
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline())
+        except (OSError, ValueError):
+            return
+        stream = ClientStream(self.connection)
+        self.connection.settimeout(None)
+        cwd = os.getcwd()
+        with redirect_stdout(stream), redirect_stderr(stream):
+            try:
+                os.chdir(request['cwd'])
+                cli.main(args=request['args'], prog_name='srltool', standalone_mode=False)
+                code = 0
+            except click.exceptions.Exit as e:
+                code = e.exit_code
+            except click.ClickException as e:
+                e.show()
+                code = e.exit_code
+            except click.exceptions.Abort:
+                print('Aborted!')
+                code = 1
+            except SystemExit as e:
+                if not isinstance(e.code, int) and e.code is not None:
+                    print(e.code)
+                code = e.code if isinstance(e.code, int) or e.code is None else 1
+            except Exception as e:
+                print(e)
+                code = 1
+            finally:
+                os.chdir(cwd)
+        if stream.connection is not None:
+            try:
+                self.connection.sendall(json.dumps({'exit': code}).encode() + b'\n')
+            except OSError:
+                pass
+
+
+@cli.command()
+def daemon() -> None:
+    """Keeps the connection to the device open for the other commands.
+
+    Listens on a Unix socket (SRLTOOL_SOCKET, by default $XDG_RUNTIME_DIR/srltool.sock) and runs the commands
+    of the other srltool invocations, which are forwarded to it transparently while it is running;
+    the device is kept in the raw-REPL mode in between, so each command only costs the device operation itself.
+    Clients are served one at a time. Stop it with Ctrl-C.
+    \b
+
+    Examples:
+
+    srltool daemon &
+
+    srltool ls
+    \f
+    """
+    global _daemon_tool
+    if not hasattr(socket, 'AF_UNIX'):
+        raise click.ClickException('The daemon needs Unix sockets.')
+    if forward_available():
+        raise click.ClickException(f'A daemon is already listening on {SOCKET_PATH}.')
+    os.makedirs(os.path.dirname(SOCKET_PATH), exist_ok=True)
+    if os.path.exists(SOCKET_PATH):
+        os.remove(SOCKET_PATH)
+    _command.enter_raw_repl()
+    _daemon_tool = _command
+    try:
+        with socketserver.UnixStreamServer(SOCKET_PATH, DaemonHandler) as server:
+            os.chmod(SOCKET_PATH, 0o600)
+            print(f'Listening on {SOCKET_PATH}')
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _daemon_tool = None
+        if os.path.exists(SOCKET_PATH):
+            os.remove(SOCKET_PATH)
+
+def forward_available() -> bool:
+    """Returns True if a daemon is listening on the socket."""
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(SOCKET_PATH):
+        return False
+    with socket.socket(socket.AF_UNIX) as client:
+        try:
+            client.connect(SOCKET_PATH)
+        except OSError:
+            return False
+    return True
+
+def subcommand(args: list) -> str:
+    """Returns the subcommand of the command line [args]: its first argument that is neither an option of the group nor
+    the value of one; None if there is none."""
+    takes_value = {opt for param in cli.params if isinstance(param, click.Option) and not param.is_flag for opt in param.opts}
+    args = iter(args)
+    for arg in args:
+        if arg in takes_value:
+            next(args, None)
+        elif not arg.startswith('-'):
+            return arg
+    return None
+
+def forward(args: list):
+    """Runs the command line on the daemon, if one is running, relaying its output; returns the exit code,
+    or None if there is no daemon to forward to."""
+    if subcommand(args) in (None, 'daemon', 'fleet') or not hasattr(socket, 'AF_UNIX') or not os.path.exists(SOCKET_PATH):
+        return None
+    client = socket.socket(socket.AF_UNIX)
+    try:
+        client.connect(SOCKET_PATH)
+    except OSError:
+        client.close()
+        return None
+    with client, client.makefile('rb') as replies:
+        client.sendall(json.dumps({'args': args, 'cwd': os.getcwd()}).encode() + b'\n')
+        for line in replies:
+            message = json.loads(line)
+            if 'exit' in message:
+                return message['exit']
+            sys.stdout.write(message['out'])
+            sys.stdout.flush()
+    return 1
+
 def main():
-    cli()
+    code = forward(sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+    try:
+        cli()
+    except DeviceTimeout as e:
+        sys.exit(f'Error: {e}')
 
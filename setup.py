@@ -16,7 +16,7 @@ setup(
     long_description = long_description,
     long_description_content_type = "text/markdown",
     url = 'https://github.com/haghighatbin/Srltool.git',
-    py_modules = ['src', 'cli'],
+    py_modules = ['src', 'cli', 'aio'],
     packages = find_packages(),
     install_requires = [requirements],
     python_requires='>=3.7',
@@ -0,0 +1,638 @@
+# Serial tool (srltool) - A tool to communicate with a Micropython-based STM32 device
+# Author: Amin Haghighatbin
+# Copyright 2022 - MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+
+import builtins
+import ctypes
+import errno
+import hashlib as _hashlib
+import binascii as _binascii
+import io as _io
+import json as _json
+import os
+import pty
+import select
+import struct as _struct
+import sys
+import tempfile
+import threading
+import time as _time
+import traceback
+import tty
+import types
+import zlib as _zlib
+from collections import deque
+import click
+
+
+BANNER = b'raw REPL; CTRL-B to exit\r\n>'
+FRIENDLY = b'MicroPython v1.22.0 on 2024-01-01; SimBoard with STM32F405RG\r\nType "help()" for more information.\r\n>>> '
+
+
+def _oserror(code):
+    return OSError(code, errno.errorcode.get(code, str(code)))
+
+
+class Device:
+    """A simulated MicroPython board on a pty (see [port]), running the scripts of srltool against shims of the
+    MicroPython modules, with /flash mapped onto [root]/flash.
+    [raw_paste], [baudrate], [latency], [heap] and [readonly] emulate the firmware, the link and the board.
+    """
+
+    def __init__(self, root, raw_paste=True, window=128, deflate=True, compress=True,
+                 baudrate=None, latency=0.0, heap=100 * 1024, flash_blocks=512, block_size=512, readonly=False):
+        self.root = root
+        os.makedirs(os.path.join(root, 'flash'), exist_ok=True)
+        self.raw_paste, self.window = raw_paste, window
+        self.deflate, self.compress = deflate, compress
+        self.byte_time = 10.0 / baudrate if baudrate else 0.0
+        self.latency = latency
+        self.heap, self.flash_blocks, self.block_size = heap, flash_blocks, block_size
+        self.readonly = readonly
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self._rx = deque()
+        self._cond = threading.Condition()
+        self._intr = 3
+        self._executing = None
+        self._closed = False
+        self.cwd = '/flash'
+        self.globals = {}
+        self.shims = None
+        self.rx_bytes = self.tx_bytes = 0
+        self._threads = [threading.Thread(target=self._reader, daemon=True), threading.Thread(target=self._run, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def close(self):
+        """Stops the device and closes the pty."""
+        self._closed = True
+        with self._cond:
+            self._cond.notify_all()
+        # the threads go first, or they could read from or write to a pty opened since under the same descriptors.
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(1)
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    # wire
+    def _reader(self):
+        while not self._closed:
+            try:
+                if not select.select([self.master], [], [], 0.1)[0]:
+                    continue
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            if self.byte_time:
+                _time.sleep(len(data) * self.byte_time)
+            with self._cond:
+                for c in data:
+                    if c == self._intr and self._executing is not None and self._intr >= 0:
+                        # Ctrl-C raises KeyboardInterrupt in the thread running the script, as on the board.
+                        ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                            ctypes.c_ulong(self._executing), ctypes.py_object(KeyboardInterrupt))
+                        continue
+                    self._rx.append(c)
+                self.rx_bytes += len(data)
+                self._cond.notify_all()
+
+    def getc(self):
+        with self._cond:
+            while not self._rx:
+                if self._closed:
+                    raise SystemExit
+                self._cond.wait(0.1)
+            return self._rx.popleft()
+
+    def read(self, n):
+        out = bytearray()
+        with self._cond:
+            while len(out) < n:
+                while not self._rx:
+                    if self._closed:
+                        raise SystemExit
+                    self._cond.wait(0.1)
+                while self._rx and len(out) < n:
+                    out.append(self._rx.popleft())
+        return bytes(out)
+
+    def any(self):
+        return len(self._rx)
+
+    def write(self, data):
+        data = bytes(data)
+        if self.latency:
+            _time.sleep(self.latency)
+        if self.byte_time:
+            _time.sleep(len(data) * self.byte_time)
+        mv = memoryview(data)
+        while mv:
+            if self._closed:
+                raise SystemExit
+            try:
+                n = os.write(self.master, mv)
+            except OSError:
+                return
+            mv = mv[n:]
+        self.tx_bytes += len(data)
+
+    # repl
+    def _run(self):
+        try:
+            self._friendly()
+        except SystemExit:
+            pass
+
+    def _friendly(self):
+        while True:
+            c = self.getc()
+            if c == 0x01:
+                self.write(b'\r\n' + BANNER)
+                self._raw()
+                self.write(b'\r\n' + FRIENDLY)
+            elif c == 0x03:
+                self.write(b'\r\n>>> ')
+            elif c == 0x04:
+                self._soft_reset()
+                self.write(FRIENDLY)
+            elif c == 0x0d:
+                self.write(b'\r\n>>> ')
+            else:
+                self.write(bytes([c]))
+
+    def _soft_reset(self):
+        self.globals = {}
+        self.shims = None
+        self.cwd = '/flash'
+        self._intr = 3
+        self.write(b'MPY: soft reboot\r\n')
+
+    def _raw(self):
+        buf = bytearray()
+        while True:
+            c = self.getc()
+            if c == 0x01:
+                buf = bytearray()
+                self.write(BANNER)
+            elif c == 0x02:
+                return
+            elif c == 0x03:
+                buf = bytearray()
+            elif c == 0x04:
+                if not buf:
+                    self.write(b'OK\r\n')
+                    self._soft_reset()
+                    self.write(BANNER)
+                    continue
+                self.write(b'OK')
+                self._exec(bytes(buf))
+                buf = bytearray()
+                self.write(b'>')
+            elif c == 0x05 and not buf and self.raw_paste:
+                if self.getc() != ord('A') or self.getc() != 0x01:
+                    continue
+                self.write(b'R\x01' + _struct.pack('<H', self.window))
+                remain = self.window
+                while True:
+                    c = self.getc()
+                    if c == 0x04:
+                        self.write(b'\x04')
+                        break
+                    if c == 0x03:
+                        # the host aborted the paste.
+                        self.write(b'\x04\x04KeyboardInterrupt\r\n\x04')
+                        buf = None
+                        break
+                    buf.append(c)
+                    remain -= 1
+                    if not remain:
+                        self.write(b'\x01')
+                        remain = self.window
+                if buf is not None:
+                    self._exec(bytes(buf))
+                buf = bytearray()
+                self.write(b'>')
+            else:
+                buf.append(c)
+
+    def _exec(self, src):
+        err = ''
+        self._executing = threading.get_ident()
+        try:
+            code = compile(src.decode(), '<stdin>', 'exec')
+            g = self.globals
+            g['__builtins__'] = self._builtins()
+            g['__name__'] = '__main__'
+            exec(code, g)
+        except SystemExit:
+            pass
+        except BaseException as e:
+            err = self._format(e)
+        finally:
+            self._executing = None
+            self._intr = 3
+        self.write(b'\x04')
+        self.write(err.replace('\n', '\r\n').encode())
+        self.write(b'\x04')
+
+    def _format(self, e):
+        lines = ['Traceback (most recent call last):\n']
+        for fs in traceback.extract_tb(e.__traceback__):
+            if fs.filename.startswith('<'):
+                lines.append('  File "{}", line {}, in {}\n'.format(fs.filename, fs.lineno, fs.name))
+        if isinstance(e, OSError) and e.errno:
+            lines.append('OSError: [Errno {}] {}\n'.format(e.errno, errno.errorcode.get(e.errno, '')))
+        else:
+            msg = str(e)
+            lines.append('{}{}\n'.format(type(e).__name__, ': ' + msg if msg else ''))
+        return ''.join(lines)
+
+    # environment
+    def _path(self, p):
+        p = p or self.cwd
+        if not p.startswith('/'):
+            p = self.cwd.rstrip('/') + '/' + p
+        parts = []
+        for part in p.split('/'):
+            if part in ('', '.'):
+                continue
+            if part == '..':
+                if parts:
+                    parts.pop()
+                continue
+            parts.append(part)
+        return '/' + '/'.join(parts)
+
+    def _host(self, p):
+        return os.path.join(self.root, *self._path(p).split('/')[1:])
+
+    def _ro(self):
+        if self.readonly:
+            raise _oserror(errno.EROFS)
+
+    def _builtins(self):
+        b = dict(vars(builtins))
+        dev = self
+
+        def _print(*args, sep=' ', end='\n', file=None):
+            s = sep.join(str(a) for a in args) + end
+            (file or stdout).write(s)
+
+        def _open(path, mode='r', *a, **k):
+            if any(m in mode for m in 'wa+'):
+                dev._ro()
+            return builtins.open(dev._host(path), mode)
+
+        # the modules (sys.modules included) live until the next soft reset, as on the board.
+        if self.shims is None:
+            self.shims = self._modules()
+        shims = self.shims
+        stdout = shims['sys'].stdout
+        modules = shims['sys'].modules
+
+        def _import(name, globals=None, locals=None, fromlist=(), level=0):
+            if name in shims:
+                return shims[name]
+            if name not in modules:
+                for dir in shims['sys'].path:
+                    path = dir.rstrip('/') + '/' + name + '.py' if dir else name + '.py'
+                    if os.path.isfile(dev._host(path)):
+                        with builtins.open(dev._host(path)) as f:
+                            code = compile(f.read(), '<{}>'.format(path), 'exec')
+                        module = types.ModuleType(name)
+                        module.__dict__['__builtins__'] = b
+                        modules[name] = module
+                        try:
+                            exec(code, module.__dict__)
+                        except BaseException:
+                            del modules[name]
+                            raise
+                        break
+                else:
+                    raise ImportError("no module named '{}'".format(name))
+            return modules[name]
+
+        b['print'] = _print
+        b['open'] = _open
+        b['__import__'] = _import
+        return b
+
+    def _modules(self):
+        dev = self
+        m = {}
+
+        def mod(name, **attrs):
+            o = types.ModuleType(name)
+            o.__dict__.update(attrs)
+            return o
+
+        def _stat(p):
+            h = dev._host(p)
+            if not os.path.exists(h):
+                raise _oserror(errno.ENOENT)
+            st = os.stat(h)
+            mode = 0x4000 if os.path.isdir(h) else 0x8000
+            size = 0 if mode == 0x4000 else st.st_size
+            return (mode, 0, 0, 0, 0, 0, size, int(st.st_mtime), int(st.st_mtime), int(st.st_mtime))
+
+        def _listdir(p=''):
+            h = dev._host(p)
+            if not os.path.isdir(h):
+                raise _oserror(errno.ENOENT)
+            return sorted(os.listdir(h))
+
+        def _ilistdir(p=''):
+            h = dev._host(p)
+            for n in _listdir(p):
+                full = os.path.join(h, n)
+                if os.path.isdir(full):
+                    yield (n, 0x4000, 0, 0)
+                else:
+                    yield (n, 0x8000, 0, os.path.getsize(full))
+
+        def _mkdir(p):
+            dev._ro()
+            h = dev._host(p)
+            if os.path.exists(h):
+                raise _oserror(errno.EEXIST)
+            if not os.path.isdir(os.path.dirname(h)):
+                raise _oserror(errno.ENOENT)
+            os.mkdir(h)
+
+        def _remove(p):
+            dev._ro()
+            h = dev._host(p)
+            if not os.path.isfile(h):
+                raise _oserror(errno.ENOENT if not os.path.exists(h) else errno.EISDIR)
+            os.remove(h)
+
+        def _rmdir(p):
+            dev._ro()
+            h = dev._host(p)
+            if not os.path.isdir(h):
+                raise _oserror(errno.ENOENT)
+            if os.listdir(h):
+                raise _oserror(errno.EACCES)
+            os.rmdir(h)
+
+        def _rename(a, b):
+            dev._ro()
+            os.rename(dev._host(a), dev._host(b))
+
+        def _chdir(p):
+            if not os.path.isdir(dev._host(p)):
+                raise _oserror(errno.ENOENT)
+            dev.cwd = dev._path(p)
+
+        def _statvfs(p):
+            used = 0
+            for dp, dn, fn in os.walk(dev._host('/flash')):
+                for f in fn:
+                    used += -(-os.path.getsize(os.path.join(dp, f)) // dev.block_size)
+            free = max(dev.flash_blocks - used, 0)
+            return (dev.block_size, dev.block_size, dev.flash_blocks, free, free, 0, 0, 0, 0, 255)
+
+        m['os'] = m['uos'] = mod('os', listdir=_listdir, ilistdir=_ilistdir, stat=_stat, mkdir=_mkdir,
+                                 remove=_remove, rmdir=_rmdir, rename=_rename, chdir=_chdir,
+                                 getcwd=lambda: dev.cwd, statvfs=_statvfs, sync=lambda: None,
+                                 uname=lambda: ('pyboard', 'pyboard', '1.22.0', 'v1.22.0', 'SimBoard'))
+
+        class _Out:
+            def __init__(self, cooked):
+                self.cooked = cooked
+                if cooked:
+                    self.buffer = _Out(False)
+
+            def write(self, s):
+                if isinstance(s, str):
+                    s = s.encode()
+                if self.cooked:
+                    s = s.replace(b'\n', b'\r\n')
+                dev.write(s)
+                return len(s)
+
+        class _In:
+            def __init__(self, text):
+                self.text = text
+                if text:
+                    self.buffer = _In(False)
+
+            def read(self, n=1):
+                d = dev.read(n)
+                return d.decode() if self.text else d
+
+            def readinto(self, buf, n=None):
+                n = len(buf) if n is None else n
+                d = dev.read(n)
+                buf[:n] = d
+                return n
+
+        m['sys'] = mod('sys', stdout=_Out(True), stdin=_In(True), stderr=_Out(True), platform='pyboard',
+                       implementation=types.SimpleNamespace(name='micropython', version=(1, 22, 0)),
+                       exit=sys.exit, print_exception=lambda e, f=None: None, byteorder='little',
+                       maxsize=2 ** 31 - 1, path=['', '/flash', '/flash/lib'], modules={})
+
+        class USB_VCP:
+            def __init__(self, *a):
+                pass
+
+            def write(self, data):
+                if isinstance(data, str):
+                    data = data.encode()
+                dev.write(data)
+                return len(data)
+
+            def setinterrupt(self, c):
+                dev._intr = c
+
+            def any(self):
+                return dev.any() > 0
+
+            def isconnected(self):
+                return True
+
+        m['pyb'] = mod('pyb', USB_VCP=USB_VCP, millis=lambda: int(_time.monotonic() * 1000) & 0x3fffffff)
+
+        def _kbd_intr(c):
+            dev._intr = c
+
+        class _Poll:
+            # only stdin is polled by the scripts of srltool.
+            def register(self, obj, mask=1):
+                pass
+
+            def poll(self, timeout=-1):
+                end = None if timeout < 0 else _time.monotonic() + timeout / 1000
+                with dev._cond:
+                    while not dev._rx:
+                        if dev._closed:
+                            raise SystemExit
+                        left = 0.1 if end is None else min(0.1, end - _time.monotonic())
+                        if left <= 0:
+                            return []
+                        dev._cond.wait(left)
+                return [(m['sys'].stdin, 1)]
+
+        m['select'] = m['uselect'] = mod('select', poll=_Poll, POLLIN=1, POLLOUT=4, POLLERR=8, POLLHUP=16)
+
+        m['gc'] = mod('gc', mem_free=lambda: dev.heap // 2, mem_alloc=lambda: dev.heap - dev.heap // 2,
+                      collect=lambda: None, threshold=lambda *a: None)
+        m['micropython'] = mod('micropython', kbd_intr=_kbd_intr, const=lambda x: x,
+                               mem_info=lambda *a: dev._mem_info(*a), opt_level=lambda *a: 0,
+                               alloc_emergency_exception_buf=lambda n: None)
+
+        def ticks_ms():
+            return int(_time.monotonic() * 1000) & 0x3fffffff
+
+        def ticks_us():
+            return int(_time.monotonic() * 1000000) & 0x3fffffff
+
+        def ticks_diff(a, b):
+            return ((a - b + 0x20000000) & 0x3fffffff) - 0x20000000
+
+        def sleep(seconds):
+            # in short steps, so that a Ctrl-C interrupts it as it does on the board.
+            end = _time.monotonic() + seconds
+            while not dev._closed:
+                left = end - _time.monotonic()
+                if left <= 0:
+                    break
+                _time.sleep(min(left, 0.01))
+
+        m['time'] = m['utime'] = mod('time', sleep=sleep, sleep_ms=lambda t: sleep(t / 1000),
+                                     sleep_us=lambda t: sleep(t / 1e6), ticks_ms=ticks_ms,
+                                     ticks_us=ticks_us, ticks_diff=ticks_diff,
+                                     ticks_add=lambda a, b: (a + b) & 0x3fffffff, time=lambda: int(_time.time()))
+
+        class sha256:
+            def __init__(self, data=b''):
+                self._h = _hashlib.sha256(bytes(data))
+
+            def update(self, data):
+                self._h.update(bytes(data))
+
+            def digest(self):
+                return self._h.digest()
+
+        m['hashlib'] = m['uhashlib'] = mod('hashlib', sha256=sha256)
+        m['binascii'] = m['ubinascii'] = mod('binascii', hexlify=_binascii.hexlify, unhexlify=_binascii.unhexlify,
+                                             a2b_base64=_binascii.a2b_base64,
+                                             b2a_base64=lambda d, newline=True: _binascii.b2a_base64(bytes(d), newline=newline),
+                                             crc32=lambda d, c=0: _binascii.crc32(bytes(d), c))
+        m['struct'] = m['ustruct'] = _struct
+        m['json'] = m['ujson'] = mod('json', dumps=lambda o: _json.dumps(o, separators=(', ', ': ')),
+                                     loads=_json.loads, dump=_json.dump, load=_json.load)
+        m['io'] = m['uio'] = mod('io', BytesIO=_io.BytesIO, StringIO=_io.StringIO, IOBase=object)
+        m['errno'] = m['uerrno'] = mod('errno', **{k: v for k, v in vars(errno).items() if k.isupper()})
+        if self.deflate:
+            class DeflateIO:
+                def __init__(self, stream, format=1, wbits=0, close=False):
+                    self.stream = stream
+                    self.format = format
+                    self._c = None
+                    self._d = None
+
+                def read(self, n=-1):
+                    if self._d is None:
+                        self._d = _zlib.decompress(self.stream.read())
+                        self._pos = 0
+                    if n < 0:
+                        n = len(self._d) - self._pos
+                    out = self._d[self._pos:self._pos + n]
+                    self._pos += len(out)
+                    return out
+
+                def readinto(self, buf):
+                    d = self.read(len(buf))
+                    buf[:len(d)] = d
+                    return len(d)
+
+                def write(self, data):
+                    if not dev.compress:
+                        raise _oserror(errno.EINVAL)
+                    if self._c is None:
+                        self._c = _zlib.compressobj(6, _zlib.DEFLATED, 10)
+                    self.stream.write(self._c.compress(bytes(data)))
+                    return len(data)
+
+                def close(self):
+                    if self._c is not None:
+                        self.stream.write(self._c.flush())
+
+            m['deflate'] = mod('deflate', DeflateIO=DeflateIO, RAW=1, ZLIB=2, GZIP=3, AUTO=0)
+            m['zlib'] = m['uzlib'] = mod('zlib', decompress=lambda d, w=0, *a: _zlib.decompress(bytes(d)))
+        return m
+
+    def _mem_info(self, verbose=None):
+        total = self.heap
+        used = total // 2
+        print_ = self._modules()['sys'].stdout.write
+        print_('stack: 1000 out of 15360\n')
+        print_('GC: total: {}, used: {}, free: {}\n'.format(total, used, total - used))
+        blocks = total // 16
+        pattern = ('h===....h=..' * (blocks // 12 + 1))[:blocks]
+        runs = [len(r) for r in pattern.replace('h', ' ').replace('=', ' ').split() if r]
+        print_(' No. of 1-blocks: 10, 2-blocks: 5, max blk sz: 4, max free sz: {}\n'.format(max(runs)))
+        if verbose:
+            print_('GC memory layout; from 20003e40:\n')
+            for i in range(0, blocks, 64):
+                print_('{:05x}: {}\n'.format(i * 16, pattern[i:i + 64]))
+
+
+@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('--root', default=None, help='Directory holding the filesystem of the device (/flash is [root]/flash); a temporary one by default.')
+@click.option('--baudrate', type=int, default=None, help='Throttles the link to the speed of a UART of this baudrate.')
+@click.option('--latency', type=float, default=0.0, show_default=True, help='Seconds added to every write of the device.')
+@click.option('--no-raw-paste', is_flag=True, help='Emulates a firmware without the raw-paste mode.')
+@click.option('--readonly', is_flag=True, help='Makes the filesystem read-only.')
+def main(root, baudrate, latency, no_raw_paste, readonly) -> None:
+    """Runs a simulated MicroPython device and prints its port; stop it with Ctrl-C.
+    \b
+
+    Examples:
+
+    python sim.py
+
+    then, in another shell, with the port it printed:
+
+    srltool --port /dev/pts/3 ls
+
+    python sim.py --root /tmp/board --baudrate 115200 --latency 0.002
+    """
+    device = Device(root or tempfile.mkdtemp(prefix='srltool-sim-'), raw_paste=not no_raw_paste, baudrate=baudrate,
+                    latency=latency, readonly=readonly)
+    print(device.port, flush=True)
+    try:
+        while True:
+            _time.sleep(1)
+    except KeyboardInterrupt:
+        device.close()
+
+
+if __name__ == '__main__':
+    main()
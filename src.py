@@ -22,142 +22,1074 @@
 
 import sys
 import os
+import posixpath
+import io
+import re
+import struct
+import binascii
+import zlib
+import hashlib
+import json
+import mmap
+import csv
 import serial
 import serial.tools.list_ports as lp
-from time import sleep
+try:
+    from serial.tools.list_ports_linux import SysFS
+except ImportError:
+    SysFS = None
+from time import monotonic, time
 from textwrap import dedent
-import matplotlib.pyplot as plt
+from contextlib import contextmanager
+from functools import wraps
+from collections import deque
+from types import GeneratorType
+from inspect import isgeneratorfunction, iscoroutinefunction, isasyncgenfunction
+from concurrent.futures import ThreadPoolExecutor
 
+# USB (VID, PID) pairs of the supported devices: the MicroPython pyboard (CDC+MSC, CDC+HID, CDC only) and the STM32 virtual COM port.
+USB_IDS = {
+    (0xf055, 0x9800): 'MicroPython',
+    (0xf055, 0x9801): 'MicroPython',
+    (0xf055, 0x9802): 'MicroPython',
+    (0x0483, 0x5740): 'STM32',
+}
+BAUDRATE = 115200
+# the last port a device was found on, so that warm invocations can skip the enumeration.
+PORT_CACHE = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'srltool', 'port.json')
 
-class SerialTool:
-    """Class to communicate with STM32 devices over a serial connection."""
-    def __init__(self):
-        """Initialising the serial communication with the STM32 device."""
-        try:
-            if lp.comports():
-                for idx, port in enumerate(lp.comports()):
-                    print(f"Available port: {str(port.device)}")
-                    if "ttyUSB" in str(port.device) or "ttyACM" in str(port.device):
-                        serial_port = [str(port.device), 'STM32']
-                if serial_port:
-                    try:
-                        self.serial = serial.Serial(serial_port[0], baudrate=115200)
-                        print(f"Connection with the [{serial_port[1]}] established on {port.device}\n")
-                    except PermissionError:
-                        print("Permission denied.\nPlease run the script in sudo mode.")
-                        sys.exit(1)
-                    except Exception as e:
-                        print(e)
-                        print("Are you sure you're running the script in sudo mode?")
-                        sys.exit(1)
+# journals of the interrupted transfers, one small JSON file per transfer; see write_journal().
+JOURNAL_DIR = os.path.join(os.path.dirname(PORT_CACHE), 'transfers')
 
-                else:
-                    print("No serial ports were found.")
-                    sys.exit(1)
+# acknowledgement byte written by the device-side transfer loops.
+ACK = b'\x06'
+# written instead of an ACK by an upload loop whose device runs low on memory; the host halves the frame size.
+LOW_MEMORY = b'\x0e'
+# written instead of the first ACK by a transfer loop on a device that can't compute CRC32s (no binascii.crc32).
+NO_CRC = b'\x15'
+# the end-of-file replies of the transfer loops: the file is complete and its sha256 matches, (uploads only) the file is
+# complete but the device can't compute its sha256 (no hashlib), the frames listed next (by index) failed their CRC32
+# and must be resent, or (downloads only) the sha256 doesn't match.
+FILE_OK = b'K'
+FILE_UNCHECKED = b'U'
+RESEND = b'R'
+MISMATCH = b'H'
+# written by the host to stop a device-side transfer loop it gives up on: as the end-of-file reply of a download loop,
+# or as the length of the next frame (ABORT_FRAME) of an upload loop.
+ABORT = b'X'
+ABORT_FRAME = 0xffff
+# the high bit of a frame's length marks a deflate (zlib, 1 KB window) compressed payload.
+COMPRESSED = 0x8000
+# the type field of os.ilistdir() entries.
+S_IFDIR = 0x4000
+S_IFREG = 0x8000
+# seconds a cached remote listing is trusted for, within a session.
+CACHE_TTL = 5.0
+# seconds the device gets to answer a raw-REPL handshake (entering the raw-REPL, raw-paste negotiation, soft reset).
+HANDSHAKE_TIMEOUT = 3.0
+# seconds each step of a command is given unless a timeout is set: the command's completion, a frame or acknowledgement
+# of a transfer, a sample of the monitor.
+DEFAULT_TIMEOUT = 60.0
+RAW_REPL_PROMPT = b'raw REPL; CTRL-B to exit\r\n>'
+# wire captures: the magic line and a JSON line of metadata, then one record per call or event -- kind, time since the
+# start of the capture, duration of the call (both in seconds) and the length of the data that follows.
+CAPTURE_MAGIC = b'SRLCAP1\n'
+CAPTURE_RECORD = struct.Struct('<cddI')
+# a sample of the monitor loop, after its 'S' tag: ticks_us(), gc.mem_free(), gc.mem_alloc() and the free flash bytes.
+SAMPLE = struct.Struct('<IIII')
+# the ticks_us() of the device wrap around at this period.
+TICKS_PERIOD = 1 << 30
+# the memory-mapped ring of samples written by Telemetry: a header (magic, capacity in records, samples written so far,
+# the next one going to record [written % capacity]) followed by the records (seconds since the first sample and the
+# free memory, allocated memory and free flash in bytes).
+TELEMETRY_HEADER = struct.Struct('<8sQQ')
+TELEMETRY_MAGIC = b'SRLTEL1\n'
+TELEMETRY_RECORD = struct.Struct('<dIII')
+# frame sizes of the transfers: the size they start at and the bounds of the automatic sizing (see FrameSizer).
+FRAME_SIZE = 512
+MIN_FRAME = 64
+MAX_FRAME = 16384
+# reply frames: a sync marker (never part of text output, 0xff being invalid UTF-8), a type byte (JSON or little-endian
+# int32 array) and the payload length as uint32; a header claiming more than REPLY_MAX bytes is not taken as a frame.
+REPLY_SYNC = b'\xffSRL'
+REPLY_HEADER = struct.Struct('<cI')
+REPLY_JSON = b'J'
+REPLY_INTS = b'I'
+REPLY_MAX = 1 << 22
+# prepended to the scripts run by exec_replies(); reply() and reply_ints() write a frame to the host.
+REPLY = """\
+import sys, struct
+try:
+    import json
+except ImportError:
+    import ujson as json
+try:
+    import pyb
+    write = pyb.USB_VCP().write
+except ImportError:
+    write = sys.stdout.buffer.write
+def frame(tag, data):
+    write(b'\\xffSRL' + tag + struct.pack('<I', len(data)))
+    write(data)
+def reply(obj):
+    frame(b'J', json.dumps(obj).encode())
+def reply_ints(values):
+    frame(b'I', struct.pack('<%di' % len(values), *values))
+"""
+# the resident helper module: installed on the device on first use (see install_helper_steps()) so that the listing,
+# status and removal commands are one-line calls of its functions instead of scripts to be sent and compiled each time.
+# Bump HELPER_VERSION whenever HELPER changes; outdated helpers are reinstalled.
+HELPER_VERSION = 3
+HELPER_PATH = '/flash/_srl.py'
+HELPER = REPLY + """\
+try:
+    import os
+except ImportError:
+    import uos as os
+VERSION = %d
+def listdir(dir):
+    reply([[item[0], item[1], item[3] if len(item) > 3 else 0] for item in os.ilistdir(dir)])
+def walk(path, show_hidden, dir_only, rel=''):
+    sep = '' if path.endswith('/') else '/'
+    items, dirs = [], []
+    for item in os.ilistdir(path):
+        name = item[0]
+        if not show_hidden and name.startswith('.'):
+            continue
+        if item[1] & 0x4000:
+            items.append([name, 0x4000, 0])
+            dirs.append(name)
+        elif not dir_only:
+            items.append([name, 0x8000, item[3] if len(item) > 3 else os.stat(path + sep + name)[6]])
+    reply([rel, items])
+    for name in dirs:
+        walk(path + sep + name, show_hidden, dir_only, rel + name + '/')
+def memstat():
+    import gc
+    free = gc.mem_free()
+    allocated = gc.mem_alloc()
+    reply_ints([free + allocated, allocated, free])
+def flashstat():
+    reply_ints(list(os.statvfs('/flash')))
+def rmdir(path, recursive):
+    if recursive:
+        for item in list(os.ilistdir(path)):
+            if item[1] & 0x4000:
+                rmdir(path + '/' + item[0], True)
             else:
-                print("No communication ports were found.")
-                sys.exit(1)
+                os.remove(path + '/' + item[0])
+    os.rmdir(path)
+def digest(path, n=-1):
+    try:
+        import hashlib
+    except ImportError:
+        import uhashlib as hashlib
+    try:
+        from ubinascii import hexlify
+    except ImportError:
+        from binascii import hexlify
+    mv = memoryview(bytearray(512))
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while n:
+            k = f.readinto(mv if n < 0 or n >= 512 else mv[:n])
+            if not k:
+                break
+            h.update(mv[:k])
+            if n > 0:
+                n -= k
+    return hexlify(h.digest()).decode()
+def prefix(path, n):
+    try:
+        size = os.stat(path)[6]
+    except OSError:
+        reply(None)
+        return
+    reply([size, digest(path, size if n < 0 else min(n, size))])
+def hashes(dir, digests):
+    files, dirs = {}, []
+    def walk(path, rel):
+        for item in os.ilistdir(path):
+            if item[1] & 0x4000:
+                dirs.append(rel + item[0])
+                walk(path + '/' + item[0], rel + item[0] + '/')
+            elif not digests:
+                files[rel + item[0]] = os.stat(path + '/' + item[0])[6]
+            else:
+                files[rel + item[0]] = digest(path + '/' + item[0])
+    try:
+        os.stat(dir)
+    except OSError:
+        pass
+    else:
+        walk(dir, '')
+    reply([files, dirs])
+""" % HELPER_VERSION
 
-        except Exception as e:
-            print(e)
 
-    def enter_raw_repl(self) -> None:
-        """Entering the raw-REPL mode."""
-
-        self.serial.write(b'\r\x03')
-        sleep(0.1)
-        self.serial.write(b'\x03')
-        sleep(0.1)
-
-        n = self.serial.inWaiting()
-        while n > 0:
-            self.serial.read(n)
-            n = self.serial.inWaiting()
-
-        for retry in range(3): 
-            self.serial.write(b'\r\x01')
-            sleep(0.01)
-            data = self.serial.read_all()
-            if data.endswith(b'raw REPL; CTRL-B to exit\r\n>'):
+class DeviceError(RuntimeError):
+    """Raised when a script executed on the device raises an exception; the message is the device-side traceback."""
+
+
+class DeviceTimeout(RuntimeError):
+    """Raised when the device doesn't answer before the deadline of the operation; the message names what was awaited."""
+
+
+class TransferAborted(RuntimeError):
+    """Raised when a device-side transfer loop stops unexpectedly; the message is its error."""
+
+
+class Metrics:
+    """Where the time of a tool goes: the wall time of each phase (connect, raw_repl, upload, execution, transfer...),
+    exclusive of the phases nested in it, the bytes written to and read from the device, the retries and the time spent
+    idle, blocked on the device. Kept by each tool as [metrics]; see in_phase()."""
+    def __init__(self):
+        # the SerialCapture recording the phases and the payload alongside the traffic, if any.
+        self.capture = None
+        self.reset()
+
+    def reset(self) -> None:
+        """Starts over, from now."""
+        self.started = monotonic()
+        self.phases = {}
+        self.nested = []
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.payload_bytes = 0
+        self.retries = 0
+        self.idle = 0.0
+
+    @contextmanager
+    def phase(self, name: str):
+        """Records the time spent in the block under the phase [name], minus the time of the phases nested in it."""
+        start = monotonic()
+        self.nested.append([name, 0.0])
+        if self.capture is not None:
+            self.capture.event(b'B', name.encode())
+        try:
+            yield
+        finally:
+            if self.capture is not None:
+                self.capture.event(b'E', name.encode())
+            elapsed = monotonic() - start
+            count, seconds = self.phases.get(name, (0, 0.0))
+            self.phases[name] = (count + 1, seconds + elapsed - self.nested.pop()[1])
+            if self.nested:
+                self.nested[-1][1] += elapsed
+
+    def attach(self, capture) -> None:
+        """Records the phases and the payload in [capture] from now on (None to stop), starting with the phases
+        already in progress."""
+        self.capture = capture
+        if capture is not None:
+            for name, _ in self.nested:
+                capture.event(b'B', name.encode())
+
+    def payload(self, size: int) -> None:
+        """Accounts for [size] bytes of file content put on (or taken off) the wire by a transfer; the rest of the bytes
+        written and read are protocol overhead."""
+        self.payload_bytes += size
+        if self.capture is not None:
+            self.capture.event(b'P', struct.pack('<I', size))
+
+    def as_dict(self) -> dict:
+        """The metrics as a JSON-serialisable dict; 'other' is the time spent outside of any phase (on the host)."""
+        wall = monotonic() - self.started
+        phases = {name: {'count': count, 'seconds': round(seconds, 6)} for name, (count, seconds) in self.phases.items()}
+        phases['other'] = {'count': 1, 'seconds': round(max(0.0, wall - sum(seconds for _, seconds in self.phases.values())), 6)}
+        return {'wall_seconds': round(wall, 6), 'phases': phases, 'bytes_written': self.bytes_written,
+                'bytes_read': self.bytes_read, 'payload_bytes': self.payload_bytes, 'retries': self.retries,
+                'idle_seconds': round(self.idle, 6)}
+
+    def summary(self, command: str) -> str:
+        """A human-readable summary of the metrics of [command]."""
+        metrics = self.as_dict()
+        lines = [f"Stats for [{command}] in {metrics['wall_seconds']:.3f}s:"]
+        for name, phase in sorted(metrics['phases'].items(), key=lambda item: -item[1]['seconds']):
+            share = phase['seconds'] / metrics['wall_seconds'] * 100 if metrics['wall_seconds'] else 0.0
+            lines.append(f"  {name:<12} {phase['seconds']:>8.3f}s {share:>5.1f}% {phase['count']:>5}x")
+        lines.append(f"  written {metrics['bytes_written'] / 1024:.2f} KB, read {metrics['bytes_read'] / 1024:.2f} KB "
+                     f"(payload {metrics['payload_bytes'] / 1024:.2f} KB), {metrics['retries']} retries, "
+                     f"idle {metrics['idle_seconds']:.3f}s")
+        return '\n'.join(lines)
+
+    def write_prometheus(self, path: str, command: str) -> None:
+        """Writes the metrics of [command] to [path] in the Prometheus text format, for the textfile collector of the
+        node exporter; the file is replaced atomically."""
+        metrics = self.as_dict()
+        label = f'command="{command}"'
+        lines = ['# HELP srltool_phase_seconds Wall time of the last command per phase.', '# TYPE srltool_phase_seconds gauge']
+        lines += [f'srltool_phase_seconds{{{label},phase="{name}"}} {phase["seconds"]}' for name, phase in metrics['phases'].items()]
+        for name, key, help in [('command_seconds', 'wall_seconds', 'Wall time of the last command.'),
+                                ('bytes_written', 'bytes_written', 'Bytes written to the device by the last command.'),
+                                ('bytes_read', 'bytes_read', 'Bytes read from the device by the last command.'),
+                                ('payload_bytes', 'payload_bytes', 'File content transferred by the last command.'),
+                                ('retries', 'retries', 'Retries of the last command.'),
+                                ('idle_seconds', 'idle_seconds', 'Time the last command spent blocked on the device.')]:
+            lines += [f'# HELP srltool_{name} {help}', f'# TYPE srltool_{name} gauge', f'srltool_{name}{{{label}}} {metrics[key]}']
+        with open(path + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+
+class SerialCapture:
+    """Stands in for the serial connection of a tool and records every byte written to and read from it in the file
+    [path], with the time and the duration of each call; the phases and the payload of the tool's metrics are recorded
+    alongside (see CAPTURE_RECORD and analyze_capture())."""
+    def __init__(self, connection, path: str, port: str, label: str=None):
+        self.connection = connection
+        self.file = open(path, 'wb')
+        self.start = monotonic()
+        meta = {'version': 1, 'port': port, 'command': label, 'started': time()}
+        self.file.write(CAPTURE_MAGIC + json.dumps(meta).encode() + b'\n')
+
+    def record(self, kind: bytes, start: float, end: float, data: bytes=b'') -> None:
+        self.file.write(CAPTURE_RECORD.pack(kind, start - self.start, end - start, len(data)))
+        self.file.write(data)
+
+    def event(self, kind: bytes, data: bytes=b'') -> None:
+        now = monotonic()
+        self.record(kind, now, now, data)
+
+    @property
+    def timeout(self):
+        return self.connection.timeout
+
+    @timeout.setter
+    def timeout(self, value) -> None:
+        self.connection.timeout = value
+
+    def write(self, data: bytes) -> int:
+        start = monotonic()
+        n = self.connection.write(data)
+        self.record(b'W', start, monotonic(), bytes(data))
+        return n
+
+    def read(self, size: int=1) -> bytes:
+        start = monotonic()
+        data = self.connection.read(size)
+        self.record(b'R', start, monotonic(), data)
+        return data
+
+    def read_until(self, expected: bytes=b'\n', size: int=None) -> bytes:
+        start = monotonic()
+        data = self.connection.read_until(expected, size)
+        self.record(b'R', start, monotonic(), data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        start = monotonic()
+        n = self.connection.readinto(buffer)
+        self.record(b'R', start, monotonic(), bytes(buffer[:n]))
+        return n
+
+    def stop(self):
+        """Stops recording and returns the connection."""
+        self.file.close()
+        return self.connection
+
+    def close(self) -> None:
+        self.stop().close()
+
+    def __getattr__(self, name: str):
+        return getattr(self.connection, name)
+
+
+def read_capture(path: str) -> tuple:
+    """Reads a capture written by SerialCapture and returns its metadata and its records as (kind, time, duration, data)
+    tuples; a record cut short (e.g. by a crash) ends the capture."""
+    with open(path, 'rb') as f:
+        if f.readline() != CAPTURE_MAGIC:
+            raise RuntimeError(f'{path} is not a srltool capture.')
+        meta = json.loads(f.readline())
+        records = []
+        while True:
+            header = f.read(CAPTURE_RECORD.size)
+            if len(header) < CAPTURE_RECORD.size:
+                break
+            kind, at, duration, size = CAPTURE_RECORD.unpack(header)
+            data = f.read(size)
+            if len(data) < size:
                 break
+            records.append((kind, at, duration, data))
+    return meta, records
+
+
+def analyze_capture(path: str, gap: float=0.02) -> dict:
+    """Rebuilds the timeline of a capture (see SerialCapture): every phase with its bytes and the time spent blocked on
+    the device, the idle gaps longer than [gap] seconds (waiting for the device, or the host busy between two calls),
+    the flow-control stalls (raw-paste windows, transfer acknowledgements and writes that blocked) and the protocol
+    overhead, the bytes on the wire that are not file content."""
+    meta, records = read_capture(path)
+    timeline, stack, gaps = [], [], []
+    stalls = {'raw-paste window': [], 'transfer ack': [], 'blocked write': []}
+    written = read = payload = 0
+    by_phase = {}
+    last_end = last_write = None
+    for kind, at, duration, data in records:
+        current = stack[-1]['phase'] if stack else 'other'
+        if kind == b'B':
+            entry = {'phase': data.decode(), 'start': at, 'end': at, 'depth': len(stack), 'written': 0, 'read': 0, 'idle': 0.0}
+            timeline.append(entry)
+            stack.append(entry)
+        elif kind == b'E':
+            if stack:
+                stack.pop()['end'] = at
+        elif kind == b'P':
+            payload += struct.unpack('<I', data)[0]
+        else:
+            if last_end is not None and at - last_end > gap:
+                gaps.append({'at': last_end, 'seconds': at - last_end, 'phase': current, 'waiting for': 'the host'})
+            last_end = at + duration
+            totals = by_phase.setdefault(current, {'written': 0, 'read': 0})
+            if kind == b'W':
+                written += len(data)
+                totals['written'] += len(data)
+                for entry in stack:
+                    entry['written'] += len(data)
+                if duration > gap:
+                    stalls['blocked write'].append(duration)
+                last_write = data
             else:
-                if retry >= 3:
-                    print(data)
-                    return
-                sleep(0.2)
+                read += len(data)
+                totals['read'] += len(data)
+                for entry in stack:
+                    entry['read'] += len(data)
+                    entry['idle'] += duration
+                if duration > gap:
+                    gaps.append({'at': at, 'seconds': duration, 'phase': current,
+                                 'waiting for': f'the device, after writing {last_write[:24]!r}' if last_write else 'the device'})
+                if data == b'\x01' and current == 'upload':
+                    stalls['raw-paste window'].append(duration)
+                elif data == ACK and current == 'transfer':
+                    stalls['transfer ack'].append(duration)
+    end = records[-1][1] + records[-1][2] if records else 0.0
+    return {
+        'meta': meta, 'seconds': end,
+        'timeline': timeline,
+        'gaps': sorted(gaps, key=lambda item: -item['seconds']),
+        'stalls': {name: {'count': len(waits), 'seconds': sum(waits), 'longest': max(waits, default=0.0)} for name, waits in stalls.items()},
+        'bytes': {'written': written, 'read': read, 'payload': payload, 'overhead': written + read - payload, 'by_phase': by_phase},
+    }
 
-    def soft_reset(self) -> None:
-        """Soft-reset the device."""
-        self.serial.write(b'\r\x04')
 
-    def exit_raw_repl(self) -> None:
-        """Exits the raw-REPL mode."""
-        self.serial.write(b'\r\x02')
+def format_analysis(analysis: dict, top: int=10) -> str:
+    """The report of analyze_capture() for humans, listing the [top] longest idle gaps."""
+    meta = analysis['meta']
+    lines = [f"Capture of [{meta.get('command') or '?'}] on {meta.get('port')}: {analysis['seconds']:.3f}s", '',
+             f"{'start':>9} {'duration':>9}  {'phase':<20} {'written':>9} {'read':>9} {'idle':>8}"]
+    for entry in analysis['timeline']:
+        name = '  ' * entry['depth'] + entry['phase']
+        lines.append(f"{entry['start']:>9.3f} {entry['end'] - entry['start']:>9.3f}  {name:<20} {entry['written']:>9} {entry['read']:>9} {entry['idle']:>8.3f}")
+    gaps = analysis['gaps']
+    lines += ['', f"Idle gaps: {len(gaps)}, {sum(item['seconds'] for item in gaps):.3f}s in total" + (f'; the {top} longest:' if len(gaps) > top else ':')]
+    for item in gaps[:top]:
+        lines.append(f"  {item['at']:>9.3f} {item['seconds']:>8.3f}s in {item['phase']}, waiting for {item['waiting for']}")
+    lines += ['', 'Flow-control stalls:']
+    for name, stall in analysis['stalls'].items():
+        lines.append(f"  {name:<18} {stall['count']:>6}x {stall['seconds']:>8.3f}s (longest {stall['longest']:.3f}s)")
+    volume = analysis['bytes']
+    wire = volume['written'] + volume['read']
+    lines += ['', f"Bytes: {volume['written']} written, {volume['read']} read; payload {volume['payload']}, "
+                  f"protocol overhead {volume['overhead']} ({volume['overhead'] / wire * 100 if wire else 0:.1f}% of the wire)"]
+    for name, totals in sorted(volume['by_phase'].items()):
+        lines.append(f"  {name:<18} {totals['written']:>9} written {totals['read']:>9} read")
+    return '\n'.join(lines)
 
-    def execute(self, cmd: str) -> None:
-        """Executes the command by first entering the raw-REPL mode, executing the script, soft resetting the device and finally exiting the raw-REPL mode."""
-        self.enter_raw_repl()
-        if len(cmd) < 256:
-            self.serial.write(cmd.encode())
+
+def heap_buckets(runs: list, block_size: int) -> dict:
+    """Counts the [runs] (lengths in blocks) per power-of-two size, keyed by the upper bound of the size in bytes."""
+    buckets = {}
+    for run in runs:
+        upper = 1
+        while upper < run:
+            upper *= 2
+        buckets[upper * block_size] = buckets.get(upper * block_size, 0) + 1
+    return dict(sorted(buckets.items()))
+
+
+def parse_heap(text: str) -> dict:
+    """Parses the output of micropython.mem_info(1) into the GC totals, the block map of the heap, the largest free
+    block, the fragmentation and the histograms of the free runs and of the allocations by size."""
+    totals = re.search(r'GC: total: (\d+), used: (\d+), free: (\d+)', text)
+    if totals is None:
+        raise RuntimeError('No heap information in the output of micropython.mem_info().')
+    total, used, free = map(int, totals.groups())
+    cells, block_size, layout, blocks = [], None, False, 0
+    for line in text.replace('\r', '').splitlines():
+        if line.startswith('GC memory layout'):
+            # a heap split in several areas has a layout per area; a blank cell keeps their runs apart.
+            if cells:
+                cells.append(' ')
+            layout, blocks = True, 0
+            continue
+        if not layout:
+            continue
+        row = re.match(r'\s*([0-9a-fA-F]+): (\S*)', line)
+        if row:
+            offset = int(row.group(1), 16)
+            if offset and blocks and block_size is None:
+                block_size = offset // blocks
+            cells.append(row.group(2))
+            blocks += len(row.group(2))
+            continue
+        folded = re.search(r'\((\d+) lines all free\)', line)
+        if folded:
+            cells.append('.' * 64 * int(folded.group(1)))
+            blocks += 64 * int(folded.group(1))
+    heap_map = ''.join(cells)
+    block_size = block_size or 16
+    free_runs = [len(run) for run in re.findall(r'\.+', heap_map)]
+    allocations = [len(run) for run in re.findall(r'[^.= ]=*', heap_map)]
+    largest = max(free_runs, default=0) * block_size
+    if not heap_map:
+        # no block map (a port that doesn't print it); the summary line still has the largest free block.
+        summary = re.search(r'max free sz: (\d+)', text)
+        largest = int(summary.group(1)) * block_size if summary else 0
+    return {
+        'total': total, 'used': used, 'free': free, 'block_size': block_size,
+        'largest_free': largest, 'fragmentation': 1 - largest / free if free else 0.0,
+        'free_runs': len(free_runs), 'allocations': len(allocations),
+        'free_histogram': heap_buckets(free_runs, block_size), 'allocation_histogram': heap_buckets(allocations, block_size),
+        'map': heap_map,
+    }
+
+
+def diff_heap(before: dict, after: dict) -> dict:
+    """The change between two snapshots of parse_heap(): the difference of each total, of each histogram bucket, and the
+    allocations found only in [after] (by the position of their head in the block map) with the blocks they hold."""
+    diff = {key: after[key] - before[key] for key in ('used', 'free', 'largest_free', 'fragmentation', 'free_runs', 'allocations')}
+    for key in ('free_histogram', 'allocation_histogram'):
+        sizes = sorted(set(before[key]) | set(after[key]))
+        diff[key] = {size: after[key].get(size, 0) - before[key].get(size, 0) for size in sizes if after[key].get(size, 0) != before[key].get(size, 0)}
+    old = {match.start() for match in re.finditer(r'[^.= ]', before['map'])}
+    new = [match for match in re.finditer(r'[^.= ]=*', after['map']) if match.start() not in old]
+    diff['new_allocations'] = len(new)
+    diff['new_allocation_bytes'] = sum(len(match.group()) for match in new) * after['block_size']
+    return diff
+
+
+def format_heap(heap: dict) -> str:
+    """The report of parse_heap() for humans."""
+    lines = [f"Heap: {heap['total']} bytes in blocks of {heap['block_size']}; {heap['used']} used, {heap['free']} free.",
+             f"Largest free block: {heap['largest_free']} bytes; fragmentation {heap['fragmentation'] * 100:.1f}% "
+             f"({heap['free_runs']} free runs, {heap['allocations']} allocations)", '',
+             f"  {'size':>10} {'free runs':>10} {'allocations':>12}"]
+    for size in sorted(set(heap['free_histogram']) | set(heap['allocation_histogram'])):
+        lines.append(f"  {'<= ' + str(size):>10} {heap['free_histogram'].get(size, 0):>10} {heap['allocation_histogram'].get(size, 0):>12}")
+    return '\n'.join(lines)
+
+
+def format_heap_diff(before: dict, after: dict, diff: dict) -> str:
+    """The report of diff_heap() for humans."""
+    lines = ['Change:']
+    for key, label in (('used', 'used'), ('free', 'free'), ('largest_free', 'largest free block'),
+                       ('free_runs', 'free runs'), ('allocations', 'allocations')):
+        lines.append(f"  {label:<20} {before[key]:>10} -> {after[key]:>10} ({diff[key]:+d})")
+    lines.append(f"  {'fragmentation':<20} {before['fragmentation'] * 100:>9.1f}% -> {after['fragmentation'] * 100:>9.1f}% ({diff['fragmentation'] * 100:+.1f} points)")
+    lines.append(f"  {diff['new_allocations']} new allocations holding {diff['new_allocation_bytes']} bytes")
+    for key, label in (('free_histogram', 'free runs'), ('allocation_histogram', 'allocations')):
+        if diff[key]:
+            lines.append(f'  {label} by size: ' + ', '.join(f'<= {size}: {change:+d}' for size, change in diff[key].items()))
+    return '\n'.join(lines)
+
+
+def deflate(data: bytes) -> bytes:
+    """Compresses a block with a 1 KB window, small enough for the device to inflate it."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 10)
+    return compressor.compress(data) + compressor.flush()
+
+
+def journal_path(direction: str, local: str, remote: str) -> str:
+    """The journal of the [direction] ('upload' or 'download') transfer between [local] and [remote]."""
+    key = hashlib.sha1(f'{direction}\0{os.path.abspath(local)}\0{absolute_path(remote)}'.encode()).hexdigest()
+    return os.path.join(JOURNAL_DIR, key[:16] + '.json')
+
+
+def read_journal(direction: str, local: str, remote: str) -> dict:
+    """Returns the journal of an interrupted transfer (see write_journal()), or None if there is none."""
+    try:
+        with open(journal_path(direction, local, remote)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_journal(direction: str, local: str, remote: str) -> None:
+    """Records that a transfer is starting; the journal is removed by clear_journal() once it completes, so one left
+    behind marks a transfer that was interrupted and whose partial file may be resumed (see --resume)."""
+    try:
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        with open(journal_path(direction, local, remote), 'w') as f:
+            json.dump({'direction': direction, 'local': os.path.abspath(local), 'remote': absolute_path(remote), 'started': time()}, f)
+    except OSError:
+        pass
+
+
+def clear_journal(direction: str, local: str, remote: str) -> None:
+    """Removes the journal of a completed transfer."""
+    try:
+        os.remove(journal_path(direction, local, remote))
+    except OSError:
+        pass
+
+
+def resume_mismatch(resp, held: int, total: int, side: str) -> str:
+    """Why an interrupted transfer can't be resumed, from the reply of the helper's prefix() ([resp]; None if the remote
+    file is missing, () if the device couldn't hash it): the partial file on the [side] holds [held] bytes of [total]."""
+    if resp == ():
+        return "the device can't compute the sha256 of the partial file"
+    if resp is None:
+        return 'the file is no longer on the device'
+    if held > total:
+        return f'the partial file on the {side} ({held} bytes) is larger than the whole file ({total} bytes)'
+    return f"the sha256 of the partial file on the {side} doesn't match the first {held} bytes of the whole file"
+
+
+def skipped_checks(crc: bool, digest: bool) -> str:
+    """The integrity checks a transfer went without, as listed in its summary: '' if the CRC32s of its frames ([crc])
+    and the sha256 of its files ([digest]) were both checked."""
+    return ' and '.join(name for name, checked in (('CRC32', crc), ('sha256', digest)) if not checked)
+
+
+def file_digest(path: str, size: int) -> str:
+    """The sha256 of the first [size] bytes of the local file [path], as the helper's digest() computes it on the device."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while size > 0:
+            data = f.read(min(size, 65536))
+            if not data:
+                break
+            h.update(data)
+            size -= len(data)
+    return h.hexdigest()
+
+
+class FrameSizer:
+    """Picks the size of the frames of a transfer. Starting from [size], the size is doubled as long as each doubling
+    improves the throughput (measured over at least 8 frames and [period] seconds) by 10%, up to [limit]; then it settles
+    on the best size found. shrink() halves it, for good, when the device runs low on memory.
+    Downloads run the same rule on the device, with the parameters of the sizer (see download_steps())."""
+    def __init__(self, size: int, limit: int, period: float):
+        self.limit = limit
+        self.size = min(size, limit)
+        self.period = period
+        self.growing = self.size < limit
+        self.best = 0.0
+        self.restart()
+
+    def restart(self) -> None:
+        self.start = monotonic()
+        self.bytes = self.frames = 0
+
+    def sent(self, n: int) -> None:
+        """Accounts for a frame of [n] bytes sent, and resizes the frames at the end of a period."""
+        if not self.growing:
+            return
+        self.bytes += n
+        self.frames += 1
+        elapsed = monotonic() - self.start
+        if self.frames < 8 or elapsed < self.period:
+            return
+        rate = self.bytes / elapsed
+        if rate > self.best * 1.1 and self.size < self.limit:
+            self.best = rate
+            self.size *= 2
         else:
-            for i in range(0, len(cmd), 256):
-                self.serial.write(cmd[i:min(i + 256, len(cmd))].encode())
-                sleep(0.01)
-        self.soft_reset()
-        sleep(0.125)
-        self.exit_raw_repl()
+            if rate < self.best:
+                self.size //= 2
+            self.growing = False
+        self.restart()
 
-    def clear(self) -> None:
-        """Clears the screen on the REPL"""
-        cmd = """
+    def shrink(self) -> None:
+        self.size = self.limit = max(MIN_FRAME, self.size // 2)
+        self.growing = False
+
+
+class Telemetry:
+    """The samples streamed by the monitor loop of a device (see monitor_steps()): the last [size] of them are kept in a
+    ring buffer, over which the minimum, the maximum and the slope (least squares, per second) of each field are computed.
+    Every sample may also be written as CSV to [csv_path] and to a memory-mapped ring at [mmap_path] (see TELEMETRY_HEADER),
+    which another process can read while the monitor runs."""
+    FIELDS = ('free', 'alloc', 'flash_free')
+
+    def __init__(self, size: int=1024, csv_path: str=None, mmap_path: str=None):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.csv_file = self.csv = self.map = None
+        if csv_path:
+            self.csv_file = open(csv_path, 'w', newline='')
+            self.csv = csv.writer(self.csv_file)
+            self.csv.writerow(('t',) + self.FIELDS)
+        if mmap_path:
+            length = TELEMETRY_HEADER.size + size * TELEMETRY_RECORD.size
+            with open(mmap_path, 'w+b') as f:
+                f.truncate(length)
+                self.map = mmap.mmap(f.fileno(), length)
+            TELEMETRY_HEADER.pack_into(self.map, 0, TELEMETRY_MAGIC, size, 0)
+
+    def add(self, t: float, free: int, alloc: int, flash_free: int) -> None:
+        """Accounts for a sample taken [t] seconds after the first one."""
+        self.samples.append((t, free, alloc, flash_free))
+        if self.csv is not None:
+            self.csv.writerow((f'{t:.6f}', free, alloc, flash_free))
+        if self.map is not None:
+            size = self.samples.maxlen
+            TELEMETRY_RECORD.pack_into(self.map, TELEMETRY_HEADER.size + self.count % size * TELEMETRY_RECORD.size, t, free, alloc, flash_free)
+            # the count goes last, so that a reader never sees a record before it is complete.
+            TELEMETRY_HEADER.pack_into(self.map, 0, TELEMETRY_MAGIC, size, self.count + 1)
+        self.count += 1
+
+    @property
+    def rate(self) -> float:
+        """Samples per second over the ring buffer."""
+        if len(self.samples) < 2:
+            return 0.0
+        span = self.samples[-1][0] - self.samples[0][0]
+        return (len(self.samples) - 1) / span if span else 0.0
+
+    def stats(self) -> dict:
+        """The last value, minimum, maximum and slope (per second) of each field over the ring buffer, by field."""
+        n = len(self.samples)
+        if not n:
+            return {}
+        times = [sample[0] for sample in self.samples]
+        mean_t = sum(times) / n
+        var_t = sum((t - mean_t) ** 2 for t in times)
+        result = {}
+        for i, field in enumerate(self.FIELDS, 1):
+            values = [sample[i] for sample in self.samples]
+            mean_v = sum(values) / n
+            slope = sum((t - mean_t) * (v - mean_v) for t, v in zip(times, values)) / var_t if var_t else 0.0
+            result[field] = {'last': values[-1], 'min': min(values), 'max': max(values), 'slope': slope}
+        return result
+
+    def status(self) -> str:
+        """A one-line summary of the ring buffer, for the progress line of the monitor."""
+        stats = self.stats()
+        fields = ', '.join(f"{field} {s['last']} ({s['slope']:+.0f} B/s)" for field, s in stats.items())
+        return f'{self.count} samples at {self.rate:.1f} Hz; {fields}'
+
+    def summary(self) -> str:
+        """A human-readable summary of the samples taken."""
+        elapsed = self.samples[-1][0] if self.samples else 0.0
+        lines = [f'{self.count} samples in {elapsed:.2f}s ({self.rate:.1f} Hz); over the last {len(self.samples)}:',
+                 f"  {'field':<12} {'last':>10} {'min':>10} {'max':>10} {'slope':>12}"]
+        for field, s in self.stats().items():
+            lines.append(f"  {field:<12} {s['last']:>10} {s['min']:>10} {s['max']:>10} {s['slope']:>8.1f} B/s")
+        return '\n'.join(lines)
+
+    def close(self) -> None:
+        if self.csv_file is not None:
+            self.csv_file.close()
+        if self.map is not None:
+            self.map.close()
+
+
+def remote_path(path: str) -> str:
+    """Normalises a remote path so that it can be used as a cache key; '' is the current directory of the device."""
+    path = posixpath.normpath(path) if path else ''
+    return '' if path == '.' else path
+
+
+def absolute_path(path: str) -> str:
+    """Normalises a remote path to an absolute one, relative paths being relative to /flash, the working directory of the device."""
+    return posixpath.join('/flash', remote_path(path))
+
+
+def is_helper(path: str) -> bool:
+    """Whether the remote [path] is the resident helper, which srltool keeps out of the listings and of the files sync removes."""
+    return absolute_path(path) == HELPER_PATH
+
+
+def in_session(method):
+    """Runs the decorated SerialTool method inside a raw-REPL session, so that the commands it issues
+    (including the nested ls checks) share a single raw-REPL entry."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.session():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def in_phase(name: str):
+    """Records the time spent in the decorated method under the phase [name] of the tool's metrics (see Metrics).
+    Works for plain methods, for the *_steps generators and for the coroutines of AsyncSerialTool alike."""
+    def decorator(method):
+        if isgeneratorfunction(method):
+            @wraps(method)
+            def wrapper(self, *args, **kwargs):
+                with self.metrics.phase(name):
+                    return (yield from method(self, *args, **kwargs))
+        elif iscoroutinefunction(method):
+            @wraps(method)
+            async def wrapper(self, *args, **kwargs):
+                with self.metrics.phase(name):
+                    return await method(self, *args, **kwargs)
+        elif isasyncgenfunction(method):
+            @wraps(method)
+            async def wrapper(self, *args, **kwargs):
+                with self.metrics.phase(name):
+                    async for item in method(self, *args, **kwargs):
+                        yield item
+        else:
+            @wraps(method)
+            def wrapper(self, *args, **kwargs):
+                with self.metrics.phase(name):
+                    return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def identify_port(device: str):
+    """Returns the USB details (vid, pid, serial_number) of a single port without enumerating the others, or None where
+    that is not possible (non-Linux hosts, ports that are not USB)."""
+    if SysFS is None or not os.path.exists(device):
+        return None
+    info = SysFS(os.path.realpath(device))
+    if info.vid is None:
+        return None
+    return info
+
+
+def find_devices(serial_number: str=None) -> list:
+    """Enumerates the ports of the supported devices, matched by their USB VID/PID (and [serial_number], if given)."""
+    return [port for port in lp.comports() if (port.vid, port.pid) in USB_IDS
+            and serial_number in (None, port.serial_number)]
+
+
+class SerialOperations:
+    """The operations shared by SerialTool and AsyncSerialTool, and the state they keep about the device.
+    Each operation is written once, as a generator (the *_steps methods) that yields its I/O requests as (method, *args)
+    tuples and receives their results back. The methods are 'write', 'read', 'read_until', 'readinto', 'execute',
+    'follow', 'exec_reply', 'exec_replies' and 'arm_deadline'. SerialTool.drive() serves them with blocking calls and
+    AsyncSerialTool.drive() with coroutines, so the protocols are not duplicated between the two."""
+    def __init__(self, port: str=None, serial_number: str=None, timeout: float=None):
+        """Initialising the state of the connection with the STM32 device.
+        The connection is opened when a command first needs it (see connect()); [port] bypasses the discovery and
+        [serial_number] restricts it to a single device. [timeout] is the number of seconds each step of a command is
+        given to complete (see arm_deadline()); None stands for DEFAULT_TIMEOUT and 0 waits for as long as it takes."""
+        self.port = port
+        self.serial_number = serial_number
+        self.timeout = timeout
+        self.deadline = None
+        self.metrics = Metrics()
+        # (path, label) of the wire capture requested with start_capture().
+        self.capture = None
+        self.connection = None
+        self.use_raw_paste = True
+        self.codecs = None
+        # whether the resident helper is installed (True), can't be (False) or hasn't been checked yet (None).
+        self.helper = None
+        self.in_raw_repl = False
+        self.session_depth = 0
+        self.cache_ttl = CACHE_TTL
+        self.listings = {}
+        self.reply_buffer = bytearray(256)
+        # the text stream the operations print to; sys.stdout (whichever it is at the time) if None.
+        self.output = None
+
+    @property
+    def stdout(self):
+        return sys.stdout if self.output is None else self.output
+
+    def discover(self) -> tuple:
+        """Finds the port of the device and returns it as (port, name).
+        The last good port is tried first and is only trusted if it still belongs to a supported device with the same
+        serial number; otherwise the ports are enumerated and matched by their USB VID/PID (and serial number, if given).
+        Exits if no device or more than one device is found, rather than guessing."""
+        try:
+            with open(PORT_CACHE) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = None
+        if cached and self.serial_number in (None, cached['serial_number']):
+            info = identify_port(cached['port'])
+            if info is not None and (info.vid, info.pid) in USB_IDS and info.serial_number == cached['serial_number']:
+                return cached['port'], USB_IDS[(info.vid, info.pid)]
+
+        candidates = find_devices(self.serial_number)
+        if not candidates:
+            sys.exit("No MicroPython/STM32 device was found.")
+        if len(candidates) > 1:
+            print("More than one device was found:", file=self.stdout)
+            for port in candidates:
+                print(f"  {port.device} [{USB_IDS[(port.vid, port.pid)]}] serial number: {port.serial_number}", file=self.stdout)
+            sys.exit("Please choose a device with the --port or --serial-number option.")
+        port = candidates[0]
+        try:
+            os.makedirs(os.path.dirname(PORT_CACHE), exist_ok=True)
+            with open(PORT_CACHE, 'w') as f:
+                json.dump({'port': port.device, 'serial_number': port.serial_number}, f)
+        except OSError:
+            pass
+        return port.device, USB_IDS[(port.vid, port.pid)]
+
+    def arm_deadline(self) -> None:
+        """Starts the deadline of the step being awaited, [timeout] seconds from now: the execution of a command arms it,
+        and the long-running loops re-arm it on each unit of progress (an acknowledgement, a frame, a sample), so that a
+        stalled device is detected without bounding the length of a transfer."""
+        timeout = DEFAULT_TIMEOUT if self.timeout is None else self.timeout
+        self.deadline = monotonic() + timeout if timeout > 0 else None
+
+    def remaining(self):
+        """Seconds left before the deadline of the current command, or None if it has none."""
+        return None if self.deadline is None else max(0.0, self.deadline - monotonic())
+
+    def host_timeout_ms(self) -> int:
+        """Milliseconds a device-side loop waits for the host before it gives up: the deadline of a step (see
+        arm_deadline()), or -1 if there is none."""
+        timeout = DEFAULT_TIMEOUT if self.timeout is None else self.timeout
+        return int(timeout * 1000) if timeout > 0 else -1
+
+    def invalidate(self, path: str=None) -> None:
+        """Discards the cached listings of [path], of its subdirectories and of its parent; all of them if [path] is None."""
+        if path is None:
+            self.listings.clear()
+            return
+        self.cache_remove(path)
+        self.listings.pop(posixpath.dirname(remote_path(path)), None)
+
+    def cache_add(self, path: str, type: int, size: int=0) -> None:
+        """Records a remote file or directory created by the tool in the cached listing of its parent."""
+        path = remote_path(path)
+        parent, name = posixpath.split(path)
+        cached = self.listings.get(parent)
+        if cached:
+            items = [item for item in cached[1] if item[0] != name]
+            self.listings[parent] = (cached[0], sorted(items + [(name, type, size)]))
+        if type == S_IFDIR and path not in self.listings:
+            self.listings[path] = (monotonic(), [])
+
+    def cache_remove(self, path: str) -> None:
+        """Removes a remote file or directory deleted by the tool from the cache."""
+        path = remote_path(path)
+        parent, name = posixpath.split(path)
+        for dir in list(self.listings):
+            if dir == path or dir.startswith(path.rstrip('/') + '/'):
+                del self.listings[dir]
+        cached = self.listings.get(parent)
+        if cached:
+            self.listings[parent] = (cached[0], [item for item in cached[1] if item[0] != name])
+
+    def install_helper_steps(self):
+        """Installs the resident helper (HELPER_PATH) on the device, replacing an outdated one. Sets [helper] to True, or to
+        False if it can't be installed (a read-only filesystem, no /flash...), in which case call_steps() sends the helper
+        along with each call instead."""
+        install = f"""
         import sys
-        sys.stdout.write("\x1b[2J\x1b[H")
+        try:
+            import os
+        except ImportError:
+            import uos as os
+        sys.modules.pop('_srl', None)
+        with open('{HELPER_PATH}.tmp', 'w') as f:
+            f.write({HELPER!r})
+        os.rename('{HELPER_PATH}.tmp', '{HELPER_PATH}')
         """
-        self.execute(dedent(cmd))
+        yield 'execute', dedent(install)
+        _, err = yield 'follow',
+        self.invalidate(HELPER_PATH)
+        self.helper = not err
 
-    def close(self) -> None:
-        """Closes the serial connection."""
-        self.serial.close()
-    
-    def ls(self, dir: str='', show: bool=True) -> str:
+    def call_steps(self, function: str, *args, replies: bool=False):
+        """Calls [function] of the resident helper with [args] (reprs of Python literals) and returns its reply,
+        or the list of all its replies with [replies]. The call checks the version of the helper as it imports it; a
+        missing or outdated helper is installed (see install_helper_steps()) and the call made again. Where it can't be
+        installed, the helper is sent along with the call and compiled each time instead.
+        A DeviceError carrying the device-side traceback is raised if the call fails."""
+        method = 'exec_replies' if replies else 'exec_reply'
+        call = f'{function}({", ".join(map(repr, args))})'
+        prelude = f"from _srl import VERSION\nif VERSION != {HELPER_VERSION}:\n    raise ImportError(\"'_srl' is outdated\")\nfrom _srl import {function}\n"
+        if self.helper is False:
+            return (yield method, call, HELPER)
+        try:
+            result = yield method, call, prelude
+        except DeviceError as e:
+            # not installed yet, outdated, or removed behind our back.
+            if "'_srl'" not in str(e):
+                raise
+        else:
+            self.helper = True
+            return result
+        yield from self.install_helper_steps()
+        return (yield method, call, prelude if self.helper else HELPER)
+
+    def listdir_steps(self, dir: str='', refresh: bool=False):
+        """Returns the sorted os.ilistdir() entries of the remote directory [dir] as (name, type, size) tuples,
+        or None if it doesn't exist. Listings are cached for [cache_ttl] seconds (see invalidate())."""
+        dir = remote_path(dir)
+        cached = self.listings.get(dir)
+        if cached and not refresh and monotonic() - cached[0] < self.cache_ttl:
+            return cached[1]
+
+        try:
+            resp = yield from self.call_steps('listdir', dir)
+        except DeviceError:
+            self.listings.pop(dir, None)
+            return None
+        items = sorted(tuple(item) for item in resp)
+        self.listings[dir] = (monotonic(), items)
+        return items
+
+    def stat_steps(self, path: str):
+        """Returns (type, size) of the remote [path] from the (cached) listing of its parent, or None if it doesn't exist."""
+        path = remote_path(path)
+        parent, name = posixpath.split(path)
+        if not name:
+            return (S_IFDIR, 0)
+        for item in (yield from self.listdir_steps(parent)) or []:
+            if item[0] == name:
+                return item[1:]
+        return None
+
+    def ls_steps(self, dir: str='', show: bool=True):
         """Lists the content of the specified directory.
+        The listing is served from the session cache when [show] is False, and refreshed otherwise.
         Examples:
         srltool ls
         or 
         srltool ls [directory]
         """
 
-        cmd = f"""
-        try:
-            import pyb
-            import os
-        except ImportError:
-            import uos as os
-        usb = pyb.USB_VCP()
-        resp = [item for item in os.ilistdir('{dir}')]
-        usb.write(repr(resp))
-        """
-        self.execute(dedent(cmd))
-        if self.serial.read(2) == b'OK':
-            raw_resp = self.serial.read_until(b'>')
-            if b'\x04\x04>' not in raw_resp:
-                print("Something went wrong!\nPerhaps the parent directory doesn't exist,")
-                return
-            files, dirs = [], []
-            for item in sorted(eval(raw_resp.decode()[:-3])):
-                if hex(item[1]) == '0x4000':
-                    if show:
-                        print('[d]',f'{item[0]:>16}')
-                    dirs.append(item[0])
-                if hex(item[1]) == '0x8000':
-                    if show:
-                        print('[f]',f'{item[0]:>16}',f'{item[3]:>10}')
-                    files.append(item[0])
-        self.exit_raw_repl()
+        items = yield from self.listdir_steps(dir, refresh=show)
+        if items is None:
+            print("Something went wrong!\nPerhaps the parent directory doesn't exist,", file=self.stdout)
+            return
+        files, dirs = [], []
+        for name, type, size in items:
+            if is_helper(posixpath.join(dir, name)):
+                continue
+            if type == S_IFDIR:
+                if show:
+                    print('[d]',f'{name:>16}', file=self.stdout)
+                dirs.append(name)
+            if type == S_IFREG:
+                if show:
+                    print('[f]',f'{name:>16}',f'{size:>10}', file=self.stdout)
+                files.append(name)
         return(files, dirs)
 
-    def tree(self, path: str='.', show_hidden=True, dir_only=False) -> int:
+    def walk_steps(self, path: str='.', show_hidden: bool=True, dir_only: bool=False):
+        """Walks the remote directory [path] in a single round trip and returns its entries as (relative_path, type, size) records,
+        or None if it doesn't exist. The device lists every directory once with os.ilistdir() and streams one reply frame
+        of compact (name, type, size) entries per directory as it goes; hidden entries and, with [dir_only], files are
+        filtered out on the device, and the resident helper on the host.
+        An unfiltered walk also refreshes the cached listings of every directory it visits."""
+        records = []
+        now = monotonic()
+        try:
+            for rel, items in (yield from self.call_steps('walk', path, show_hidden, dir_only, replies=True)):
+                records.extend((rel + name, type, size) for name, type, size in items if not is_helper(posixpath.join(path, rel + name)))
+                if show_hidden and not dir_only:
+                    self.listings[remote_path(posixpath.join(path, rel))] = (now, sorted(tuple(item) for item in items))
+        except DeviceError:
+            return None
+        return records
+
+    def tree_steps(self, path: str='.', show_hidden=True, dir_only=False):
         """Lists the content of the specified directory in a Tree format.
+        The tree is rendered on the host from a single walk() of the device.
         Examples:
         srltool tree
         or 
@@ -166,143 +1098,1364 @@ class SerialTool:
         srltool tree --show-hidden --dir-only
         """
 
+        records = yield from self.walk_steps(path, show_hidden, dir_only)
+        if records is None:
+            print("Something went wrong!\nPerhaps the parent directory doesn't exist!", file=self.stdout)
+            return
+        children = {}
+        for rel, type, size in sorted(records):
+            parent, name = posixpath.split(rel)
+            children.setdefault(parent, []).append((name, type))
+
+        blank, branch, elbow, tee = '    ', '│   ', '└───', '├───'
+        nd = sum(1 for record in records if record[1] == S_IFDIR)
+        nf = len(records) - nd
+
+        def show_dir(rel, level, prefix):
+            items = children.get(rel, [])
+            for idx, (name, type) in enumerate(items):
+                label = f'{name} (dir)' if type == S_IFDIR else name
+                is_last = idx == len(items) - 1
+                if level == 0:
+                    print(label, file=self.stdout)
+                else:
+                    print(blank, prefix + (elbow if is_last else tee) + label, file=self.stdout)
+                if type == S_IFDIR:
+                    show_dir(posixpath.join(rel, name), level + 1, prefix + (blank if is_last else branch) if level else prefix)
+
+        show_dir('', 0, '')
+        print(f'{nd} folder(s), {nf} files.' if nf else f'{nd} folder(s).', file=self.stdout)
+        return nd, nf
+
+    def memstat_steps(self):
+        """Returns the memory status of the device.
+
+        Example:
+        srltool memstat
+        """
+
+        resp = yield from self.call_steps('memstat')
+        print('\nTotal memory size: {:.3f} MB'.format(resp[0]/1048576), file=self.stdout)
+        print('Allocated memory : {:.3f} MB'.format(resp[1]/1048576), file=self.stdout)
+        print('Available memory: {:.3f} [{}%] MB\n'.format(resp[2]/1048576, round(resp[2]/resp[0] * 100,1)), file=self.stdout)
+        return repr(resp)
+
+    def flashstat_steps(self):
+        """Returns details of the allocated and available flash space.
+
+        Example:
+        srltool flashstat
+        """
+
+        resp = yield from self.call_steps('flashstat')
+        _total = resp[0] * resp[3] / 1048576
+        _remained = resp[0] * resp[2] / 1048576
+        print('\nTotal flash size: {:.3f} MB'.format(_total), file=self.stdout)
+        print('Remained free space: {:.3f} MB'.format(_remained), file=self.stdout)
+        return repr(resp)
+
+    def heap_steps(self):
+        """Returns the heap of the device parsed by parse_heap(), from micropython.mem_info(1) after a collection, so that
+        the block map shows only the objects still referenced."""
+        cmd = """
+        import gc, micropython
+        gc.collect()
+        micropython.mem_info(1)
+        """
+        yield 'execute', dedent(cmd)
+        out, err = yield 'follow',
+        if err:
+            raise DeviceError(err.decode().replace('\r', '').strip())
+        return parse_heap(out.decode(errors='replace'))
+
+    def heap_diff_steps(self, script: str):
+        """Runs the [script] on the device between two snapshots of its heap (see heap_steps()) and returns them with
+        their difference (see diff_heap()) and the output and the error of the script.
+
+        Example:
+        srltool memstat --run app.py
+        """
+        before = yield from self.heap_steps()
+        yield 'execute', script
+        out, err = yield 'follow',
+        after = yield from self.heap_steps()
+        return {'before': before, 'after': after, 'diff': diff_heap(before, after),
+                'output': out.decode(errors='replace').replace('\r', ''), 'error': err.decode(errors='replace').replace('\r', '').strip()}
+
+    @in_phase('monitor')
+    def monitor_steps(self, telemetry: Telemetry, rate: float=100, duration: float=None, samples: int=None):
+        """Streams the memory and flash usage of the device into [telemetry] at [rate] samples per second, for [duration]
+        seconds or [samples] samples, or until interrupted or its output is closed.
+
+        Example:
+        srltool monitor --rate 200 --duration 60 --csv heap.csv
+        """
         cmd = f"""
+        import sys, gc, struct
         try:
             import pyb
             import os
+            w = pyb.USB_VCP().write
         except ImportError:
             import uos as os
-        class Tree():
-            def __init__(self, path='.', show_hidden=False, dir_only=False):
-                self.blank  = '    '
-                self.branch = '│   '
-                self.elbow  = '└───'
-                self.tee    = '├───'
-                self.nf, self.nd = 0, 0
-                self.path = path
-                self.show_hidden, self.dir_only = show_hidden, dir_only
-            
-            def show_dir(self, level=0, is_last=False, prefix='', *args, **kwargs):
-                if self.show_hidden:
-                    folder = sorted(os.listdir(self.path))
+            w = sys.stdout.buffer.write
+        try:
+            from time import ticks_us, ticks_add, ticks_diff, sleep_us
+        except ImportError:
+            from utime import ticks_us, ticks_add, ticks_diff, sleep_us
+        sample = bytearray({1 + SAMPLE.size})
+        sample[0] = ord('S')
+        n = 0
+        w({ACK!r})
+        t = ticks_us()
+        try:
+            while True:
+                if not n % {max(1, int(rate // 10))}:
+                    st = os.statvfs('/flash')
+                    flash = st[0] * st[3]
+                struct.pack_into('<IIII', sample, 1, ticks_us(), gc.mem_free(), gc.mem_alloc(), flash)
+                w(sample)
+                n += 1
+                t = ticks_add(t, {max(1, int(1000000 / rate))})
+                d = ticks_diff(t, ticks_us())
+                if d > 0:
+                    sleep_us(d)
                 else:
-                    folder = [f for f in os.listdir(self.path) if not f.startswith('.')]
-                
-                if self.dir_only:
-                    folder = [item for item in folder if os.stat('{{}}/'.format(self.path) + item)[0] & 0x4000]
-                
-                last_file = folder[-1] if len(folder) > 0 else ''
-                for item in folder:
-                    if os.stat('{{}}/'.format(self.path) + item)[0] & 0x4000:
-                        self.nd += 1
-                        if level == 0:
-                            print('{{}} (dir)'.format(item))
-                        else:
-                            if item != last_file:
-                                is_last = False
-                                print(self.blank, prefix + self.tee + '{{}} (dir)'.format(item))
-                            else:
-                                is_last = True
-                                print(self.blank, prefix + self.elbow + '{{}} (dir)'.format(item))
-                        os.chdir(item)
-                        level += 1
-                        if level > 1:
-                            prefix += self.blank if item == last_file else self.branch
-                        
-                        self.show_dir(level=level, is_last=is_last, prefix=prefix)
-
-                        prefix = prefix[:-4] if level > 0 else prefix
-                        os.chdir('..')
-                        level -= 1
-                    else:
-                        if self.dir_only:
-                            return self.nd
-                        self.nf += 1
-                        if level == 0:
-                            print(item)
-                        else:
-                            if item != last_file:
-                                print(self.blank, prefix + self.tee + '{{}}'.format(item))
-                            else:
-                                print(self.blank, prefix + self.elbow + '{{}}'.format(item))
-                
-                return self.nd, self.nf
-
-            def __repr__(self) -> str:
-                nd , nf = self.show_dir()
-                if nf:
-                    return ('{{}} folder(s), {{}} files.').format(nd, nf)
-                else: 
-                    return ('{{}} folder(s).').format(nd)
-            
-        print(Tree(path='{path}', show_hidden={show_hidden}, dir_only={dir_only}))
+                    # behind schedule (the link is too slow for the rate); carry on from now rather than in a burst.
+                    t = ticks_us()
+        except KeyboardInterrupt:
+            pass
+        w(b'E')
         """
+        yield 'execute', dedent(cmd)
+        yield from self.read_ack_steps()
 
-        self.execute(dedent(cmd))
-        sleep(0.2)
-        if self.serial.read(2) == b'OK':
-            raw_resp = self.serial.read_until(b'>')
-            if b'\x04\x04>' not in raw_resp:
-                print("Something went wrong!\nPerhaps the parent directory doesn't exist!")
+        start = shown = monotonic()
+        stopping = False
+        last = None
+        elapsed = 0
+        self.stdout.write("\033[?25l")
+        while True:
+            tag = yield 'read', 1
+            if tag == b'E':
+                break
+            if tag != b'S':
+                yield from self.abort_transfer_steps(tag)
+            ticks, free, alloc, flash_free = SAMPLE.unpack((yield 'read', SAMPLE.size))
+            if last is None:
+                last = ticks
+            elapsed += (ticks - last) % TICKS_PERIOD
+            last = ticks
+            telemetry.add(elapsed / 1e6, free, alloc, flash_free)
+            yield 'arm_deadline',
+            now = monotonic()
+            if not stopping and (duration is not None and now - start >= duration or samples is not None and telemetry.count >= samples or self.stdout.closed):
+                yield 'write', b'\x03'
+                stopping = True
+            if now - shown >= 0.25:
+                shown = now
+                self.stdout.write(f"\033[KMonitoring: {telemetry.status()}\r")
+                self.stdout.flush()
+        yield 'follow',
+        self.stdout.write("\033[?25h\033[K")
+        print(telemetry.summary(), file=self.stdout)
+        return telemetry
+
+    def probe_codecs_steps(self):
+        """Returns the compression codecs available on the device; 'inflate' if it can decompress uploads and
+        'deflate' if it can compress downloads. The result is cached for the lifetime of the connection."""
+        if self.codecs is None:
+            cmd = """
+            codecs = []
+            try:
+                import deflate, io
+                codecs.append('inflate')
+                try:
+                    d = deflate.DeflateIO(io.BytesIO(), deflate.ZLIB, 10)
+                    d.write(b'srltool')
+                    d.close()
+                    codecs.append('deflate')
+                except Exception:
+                    pass
+            except ImportError:
+                try:
+                    import zlib
+                    codecs.append('inflate')
+                except ImportError:
+                    pass
+            reply(codecs)
+            """
+            self.codecs = yield 'exec_reply', dedent(cmd)
+        return self.codecs
+
+    def frame_sizer_steps(self, frame_size: int=None):
+        """Returns the FrameSizer of a transfer: [frame_size] throughout if it is given; otherwise the frames start at
+        FRAME_SIZE and may grow up to a limit set by the free memory of the device (gc.mem_free(), a sixteenth of it for
+        the frame, which the device buffers, inflates and copies), while the round trip of that query sets the period
+        the throughput is measured over."""
+        if frame_size:
+            if frame_size >= COMPRESSED:
+                raise ValueError(f'Frame size must be smaller than {COMPRESSED} bytes.')
+            return FrameSizer(frame_size, frame_size, 0)
+        start = monotonic()
+        free = (yield from self.call_steps('memstat'))[2]
+        rtt = monotonic() - start
+        limit = MIN_FRAME
+        while limit * 2 <= min(MAX_FRAME, free // 16):
+            limit *= 2
+        return FrameSizer(FRAME_SIZE, limit, max(0.05, 4 * rtt))
+
+    def sendfile_steps(self, filename_to_send: str, filename_to_save: str=None, forced: bool=False, BUFFER_SIZE: int=None, encoding: str='raw', compress: bool=None, resume: bool=False):
+        """ Sends the specified file [filename_to_send] and will save as the specified file [filename_to_save].
+            If the [filename_to_save] has not been specified as an argument, then the same name as the [filename_to_get] will be designated to save the file.
+            buffer_size argument may also be passed to fix the size of the frames; by default it is sized automatically (see frame_sizer_steps());
+            encoding may be 'raw' or 'base64'; compress forces (True) or disables (False) the compressed transport;
+            the [--forced or -f] option can be passed to over-write the exisitng file, please be cautious!
+            the [--resume] option continues an interrupted transfer of the file from the last byte the device holds.
+
+            Examples:
+            srltool send-file [filename_to_send] [filename_to_save]
+            or
+            srltool send-file [filename_to_send] 
+            or
+            srltool send-file [filename_to_send] --forced buffer_size=128
+            or
+            srltool send-file [filename_to_send] --resume
+        """
+        if filename_to_save is None:
+            filename_to_save = filename_to_send
+        
+        # print(f'filename_to_send: {filename_to_send}\nfilename_to_save: {filename_to_save}')
+
+        file = filename_to_save.split('/')[-1]
+        dir = '/'.join(filename_to_save.split('/')[:-1])
+        if (yield from self.listdir_steps(dir)) is None:
+            print('Saving to root...', file=self.stdout)
+            dir = '/flash'
+            filename_to_save = dir + '/' + file
+        offset = 0
+        if resume:
+            if read_journal('upload', filename_to_send, filename_to_save) is None:
+                print('No interrupted transfer of this file was found; sending it from the start.', file=self.stdout)
+            else:
+                forced = True
+                try:
+                    resp = yield from self.call_steps('prefix', filename_to_save, -1)
+                except DeviceError:
+                    resp = ()
+                if resp and resp[0] <= os.path.getsize(filename_to_send) and resp[1] == file_digest(filename_to_send, resp[0]):
+                    offset = resp[0]
+                    print(f'Resuming [{filename_to_send}] from byte {offset}.', file=self.stdout)
+                else:
+                    print(f'Warning: {resume_mismatch(resp, resp[0] if resp else 0, os.path.getsize(filename_to_send), "device")}; sending [{filename_to_send}] from the start.', file=self.stdout)
+        if not forced:
+            if (yield from self.stat_steps(filename_to_save)) is not None:
+                print("File exists, please use the -f/--forced option to overwrite the file.", file=self.stdout)
                 return
-            resp =  raw_resp.decode()[:-3]
-        else:
-            print('something went wrong!')
-            raise RuntimeError
-        print(resp if resp else '')
-            
-    def memstat(self) -> str:
-        """Returns the memory status of the device.
+        
+        # print(f'filename_to_send: {filename_to_send}\nfilename_to_save: {filename_to_save}')
 
-        Example:
-        srltool memstat
+        write_journal('upload', filename_to_send, filename_to_save)
+        yield from self.upload_tree_steps([(filename_to_send, filename_to_save)], BUFFER_SIZE, encoding, compress, offsets={filename_to_save: offset})
+        clear_journal('upload', filename_to_send, filename_to_save)
+
+    @in_phase('transfer')
+    def upload_tree_steps(self, entries: list, frame_size: int=None, encoding: str='raw', compress: bool=None, window: int=4, offsets: dict=None):
+        """ Streams the (local_path, remote_path) [entries] to the device as a single archive of CRC32-checked frames;
+            an entry whose local_path is None creates the remote directory, and the files in [offsets] are appended to.
         """
+        sizer = yield from self.frame_sizer_steps(frame_size)
+        if encoding == 'raw':
+            header_size, size_expr, payload_expr, payload_size = 2, 'hdr[0] | hdr[1] << 8', 'mv[:n]', sizer.limit
+            frame_header_size, frame_expr = 6, "struct.unpack('<HI', fhdr)"
+            crc_size, crc_expr = 4, "struct.unpack('<I', crcb)[0]"
+        elif encoding == 'base64':
+            header_size, size_expr, payload_expr, payload_size = 4, 'int(bytes(hdr), 16)', 'a2b_base64(mv[:n])', (sizer.limit + 2) // 3 * 4
+            frame_header_size, frame_expr = 12, 'int(bytes(fhdr[:4]), 16), int(bytes(fhdr[4:]), 16)'
+            crc_size, crc_expr = 8, 'int(bytes(crcb), 16)'
+        else:
+            raise ValueError(f'Unknown encoding: {encoding}')
+
+        plan = []
+        for filename_to_send, filename_to_save in entries:
+            use_compression = compress
+            if filename_to_send is not None and use_compression is None:
+                with open(filename_to_send, 'rb') as f:
+                    sample = f.read(16384)
+                use_compression = bool(sample) and len(deflate(sample)) < 0.9 * len(sample)
+            plan.append((filename_to_send, filename_to_save, bool(use_compression)))
+        if any(item[2] for item in plan) and 'inflate' not in (yield from self.probe_codecs_steps()):
+            print('The device cannot inflate; sending uncompressed.', file=self.stdout)
+            plan = [(local, remote, False) for local, remote, _ in plan]
 
         cmd = f"""
-        import gc, pyb
-        usb = pyb.USB_VCP()
-        free_mem = gc.mem_free()
-        allocated_mem = gc.mem_alloc()
-        total_mem = free_mem + allocated_mem
-        usb.write(repr([total_mem, allocated_mem, free_mem]))
+        import sys, gc, struct, micropython
+        try:
+            import pyb
+            import os
+            w = pyb.USB_VCP().write
+        except ImportError:
+            import uos as os
+            w = sys.stdout.buffer.write
+        try:
+            from ubinascii import a2b_base64, hexlify
+        except ImportError:
+            from binascii import a2b_base64, hexlify
+        try:
+            from binascii import crc32
+        except ImportError:
+            crc32 = None
+        try:
+            from hashlib import sha256
+        except ImportError:
+            try:
+                from uhashlib import sha256
+            except ImportError:
+                sha256 = None
+        try:
+            import deflate, io
+            def inflate(data):
+                return deflate.DeflateIO(io.BytesIO(bytes(data)), deflate.ZLIB).read()
+        except ImportError:
+            try:
+                from zlib import decompress as inflate
+            except ImportError:
+                inflate = None
+        try:
+            import select
+        except ImportError:
+            import uselect as select
+        poller = select.poll()
+        poller.register(sys.stdin, select.POLLIN)
+        def rd(b):
+            # Ctrl-C is disabled while the loop runs; a host that stopped streaming is given up on instead.
+            if not poller.poll({self.host_timeout_ms()}):
+                raise OSError('timed out waiting for the host')
+            sys.stdin.buffer.readinto(b)
+        tag = bytearray(1)
+        hdr = bytearray({header_size})
+        fhdr = bytearray({frame_header_size})
+        crcb = bytearray({crc_size})
+        digest = bytearray(64)
+        mv = memoryview(bytearray({payload_size}))
+        count = 0
+        def size():
+            rd(hdr)
+            return {size_expr}
+        def tick():
+            global count
+            count += 1
+            if not count % {window}:
+                if gc.mem_free() < {4 * sizer.limit}:
+                    gc.collect()
+                w({ACK!r} if gc.mem_free() >= {4 * sizer.limit} else {LOW_MEMORY!r})
+        def receive(f):
+            bad = []
+            index = 0
+            while True:
+                rd(fhdr)
+                s, offset = {frame_expr}
+                if s == {ABORT_FRAME}:
+                    raise ValueError('transfer aborted by the host')
+                if not s:
+                    rd(digest)
+                    if not bad:
+                        return
+                    w({RESEND!r} + struct.pack('<H%dI' % len(bad), len(bad), *bad))
+                    bad = []
+                    continue
+                n = s & {~COMPRESSED & 0xffff}
+                if n > {payload_size}:
+                    raise ValueError('corrupted frame header; the transfer lost sync')
+                rd(mv[:n])
+                rd(crcb)
+                if crc32 is None or crc32(mv[:n], crc32(fhdr)) == {crc_expr}:
+                    data = {payload_expr}
+                    f.seek(offset)
+                    f.write(inflate(data) if s & {COMPRESSED} else data)
+                else:
+                    bad.append(index)
+                index += 1
+                tick()
+        def check(path):
+            if sha256 is None:
+                return False
+            h = sha256()
+            with open(path, 'rb') as f:
+                while True:
+                    n = f.readinto(mv)
+                    if not n:
+                        break
+                    h.update(mv[:n])
+            if hexlify(h.digest()) != digest:
+                raise ValueError('sha256 mismatch: ' + path)
+            return True
+        micropython.kbd_intr(-1)
+        # the host streams nothing before this, or a 0x03 of a frame could interrupt the loop before it starts.
+        w({ACK!r} if crc32 else {NO_CRC!r})
+        try:
+            while True:
+                rd(tag)
+                if tag == b'E':
+                    break
+                if tag[0] not in b'DFA':
+                    raise ValueError('transfer aborted by the host')
+                path = sys.stdin.buffer.read(size()).decode()
+                if tag == b'D':
+                    try:
+                        os.mkdir(path)
+                    except OSError:
+                        pass
+                    tick()
+                    continue
+                with open(path, 'r+b' if tag == b'A' else 'wb') as f:
+                    tick()
+                    receive(f)
+                w({FILE_OK!r} if check(path) else {FILE_UNCHECKED!r})
+        finally:
+            micropython.kbd_intr(3)
+        w({ACK!r})
         """
-        self.execute(dedent(cmd))
-        if self.serial.read(2) == b'OK':
-            raw_resp = self.serial.read_until(b'>')       
-            resp =  eval(raw_resp.decode()[:-3])
-            print('\nTotal memory size: {:.3f} MB'.format(resp[0]/1048576))
-            print('Allocated memory : {:.3f} MB'.format(resp[1]/1048576))
-            print('Available memory: {:.3f} [{}%] MB\n'.format(resp[2]/1048576, round(resp[2]/resp[0] * 100,1)))
-        self.exit_raw_repl()
-        return repr(resp)
+        yield 'execute', dedent(cmd)
+        resp = yield 'read', 1
+        if resp not in (ACK, NO_CRC):
+            yield from self.abort_transfer_steps(resp)
+        # whether the device checks the CRC32 of the frames, and has checked the sha256 of every file so far.
+        checked, verified = resp == ACK, True
+        if not checked:
+            print('Warning: the device has no binascii.crc32; the frames are written unchecked.', file=self.stdout)
 
-    def flashstat(self) -> str:
-        """Returns details of the allocated and available flash space.
+        units = acked = wire = 0
 
-        Example:
-        srltool flashstat
+        def length(n):
+            return struct.pack('<H', n) if encoding == 'raw' else b'%04x' % n
+
+        def encode(offset, payload, flags):
+            if encoding == 'base64':
+                payload = binascii.b2a_base64(payload, newline=False)
+            header = struct.pack('<HI', len(payload) | flags, offset) if encoding == 'raw' else b'%04x%08x' % (len(payload) | flags, offset)
+            crc = zlib.crc32(payload, zlib.crc32(header))
+            return header + payload + (struct.pack('<I', crc) if encoding == 'raw' else b'%08x' % crc)
+
+        def ack():
+            nonlocal acked
+            if (yield from self.read_ack_steps()):
+                sizer.shrink()
+            acked += window
+
+        def write_unit(data):
+            nonlocal units, wire
+            yield 'write', data
+            wire += len(data)
+            units += 1
+            while units - acked >= 2 * window:
+                yield from ack()
+
+        try:
+            total_sent = 0
+            total_start = monotonic()
+            chunk = bytearray(sizer.limit * 4)
+            end = encode(0, b'', 0)[:-crc_size]
+            for filename_to_send, filename_to_save, use_compression in plan:
+                path = filename_to_save.encode()
+                if filename_to_send is None:
+                    yield from write_unit(b'D' + length(len(path)) + path)
+                    continue
+                offset = (offsets or {}).get(filename_to_save, 0)
+                yield from write_unit((b'A' if offset else b'F') + length(len(path)) + path)
+                total = os.path.getsize(filename_to_send)
+                sent, wire_start, start = offset, wire, monotonic()
+                # (offset, size, flags) of the data of each frame sent, by index, to read it again if it must be resent.
+                frames = []
+                pos, resent = offset, 0
+                self.stdout.write("\033[?25l")
+                with open(filename_to_send, 'rb') as f:
+                    f.seek(offset)
+                    while True:
+                        frame_size = sizer.size
+                        n = f.readinto(memoryview(chunk)[:frame_size * 4 if use_compression else frame_size])
+                        if not n:
+                            break
+                        block = memoryview(chunk)[:n]
+                        packed = deflate(block) if use_compression else None
+                        if packed is not None and len(packed) <= frame_size and len(packed) < n:
+                            payloads = [(pos, n, packed, COMPRESSED)]
+                        else:
+                            payloads = [(pos + i, min(frame_size, n - i), bytes(block[i:i + frame_size]), 0) for i in range(0, n, frame_size)]
+                        for at, size, payload, flags in payloads:
+                            self.metrics.payload(len(payload))
+                            frames.append((at, size, flags))
+                            yield from write_unit(encode(at, payload, flags))
+                            sizer.sent(len(payload))
+                        pos += n
+                        sent += n
+                        elapsed = monotonic() - start
+                        self.stdout.write(f"Sending [{filename_to_send}]: {round(sent / total * 100)}% {(sent - offset) / elapsed / 1024 if elapsed else 0:.1f} KB/s\r")
+                        self.stdout.flush()
+                    digest = file_digest(filename_to_send, total).encode()
+                    while True:
+                        yield 'write', end + digest
+                        wire += len(end) + len(digest)
+                        while units - acked >= window:
+                            yield from ack()
+                        resp = yield 'read', 1
+                        if resp in (FILE_OK, FILE_UNCHECKED):
+                            break
+                        if resp != RESEND:
+                            yield from self.abort_transfer_steps(resp)
+                        count = struct.unpack('<H', (yield 'read', 2))[0]
+                        self.metrics.retries += count
+                        resent += count
+                        for index in struct.unpack(f'<{count}I', (yield 'read', 4 * count)):
+                            at, size, flags = frames[index]
+                            f.seek(at)
+                            data = f.read(size)
+                            frames.append((at, size, flags))
+                            yield from write_unit(encode(at, deflate(data) if flags else data, flags))
+                elapsed = max(monotonic() - start, 1e-6)
+                sent -= offset
+                total_sent += sent
+                self.stdout.write("\033[?25h")
+                self.stdout.write("\033[K")
+                self.stdout.write(f'Sent [{filename_to_send}]: {sent} bytes in {elapsed:.2f}s ({sent / elapsed / 1024:.1f} KB/s')
+                if use_compression:
+                    self.stdout.write(f'; {wire - wire_start} bytes on the wire at {(wire - wire_start) / elapsed / 1024:.1f} KB/s')
+                if resent:
+                    self.stdout.write(f'; {resent} frame(s) resent')
+                skipped = skipped_checks(checked, resp == FILE_OK)
+                if skipped:
+                    self.stdout.write(f'; {skipped} not checked')
+                self.stdout.write(')\n')
+                self.stdout.flush()
+                if resp != FILE_OK and verified:
+                    verified = False
+                    print('Warning: the device has no hashlib.sha256; the files written are not verified.', file=self.stdout)
+            yield 'write', b'E'
+            for _ in range(units // window - acked // window + 1):
+                yield from self.read_ack_steps()
+        except BaseException as e:
+            # errors, Ctrl-Cs and cancellations alike, unless the loop has stopped already or the steps are being closed.
+            if not isinstance(e, (TransferAborted, GeneratorExit)):
+                yield from self.stop_transfer_steps(encode(0, b'', ABORT_FRAME)[:-crc_size])
+            raise
+        yield 'follow',
+        for filename_to_send, filename_to_save, _ in plan:
+            if filename_to_send is None:
+                self.cache_add(filename_to_save, S_IFDIR)
+            else:
+                self.cache_add(filename_to_save, S_IFREG, os.path.getsize(filename_to_send))
+        if len(plan) > 1:
+            elapsed = max(monotonic() - total_start, 1e-6)
+            skipped = skipped_checks(checked, verified)
+            print(f'{len(plan)} entries, {total_sent} bytes in {elapsed:.2f}s ({total_sent / elapsed / 1024:.1f} KB/s; {wire} bytes on the wire; {sizer.size}-byte frames{"; " + skipped + " not checked" if skipped else ""})', file=self.stdout)
+
+    def read_ack_steps(self):
+        """Waits for the acknowledgement of a device-side transfer loop and returns True if the device is running low on
+        memory (LOW_MEMORY); if the loop has stopped instead, the rest of its output is drained and its error is raised."""
+        resp = yield 'read', 1
+        if resp not in (ACK, LOW_MEMORY):
+            yield from self.abort_transfer_steps(resp)
+        yield 'arm_deadline',
+        return resp == LOW_MEMORY
+
+    def abort_transfer_steps(self, resp: bytes):
+        """Drains the output of a device-side transfer loop that stopped unexpectedly, [resp] being the
+        unexpected byte(s) already read, and raises its error."""
+        if not resp.endswith(b'\x04'):
+            resp += yield 'read_until', b'\x04'
+        err = (yield 'read_until', b'\x04')[:-1].decode().replace('\r', '')
+        yield 'read_until', b'>'
+        # frames still in flight were taken as input by the raw-REPL; force a clean re-entry.
+        self.in_raw_repl = False
+        # whatever the loop managed to write is unknown.
+        self.invalidate()
+        self.stdout.write("\033[?25h\n")
+        raise TransferAborted(f'Transfer aborted by the device: {err or resp}')
+
+    def stop_transfer_steps(self, abort: bytes):
+        """Stops a device-side transfer loop the host gives up on (after an error or a Ctrl-C) by writing [abort], which
+        the loop takes for the end of the transfer, rather than leave it to wait for its read timeout with Ctrl-C disabled."""
+        # whatever the loop still writes is left to the re-entry of the raw-REPL, and what it managed to write is unknown.
+        self.in_raw_repl = False
+        self.invalidate()
+        self.stdout.write("\033[?25h\n")
+        try:
+            yield 'write', abort
+        except Exception:
+            pass
+
+    def recvfile_steps(self, filename_to_get: str, filename_to_save: str=None, check_exist: bool=True, BUFFER_SIZE: int=None, compress: bool=None, resume: bool=False):
+        """ Receives the specified file [filename_to_get] and will save as the specified file [filename_to_save].
+            If the [filename_to_save] has not been specified as an argument, then the same name as the [filename_to_get] will be designated to save the file.
+            check_exist argument may be passed to check if the file exists; the default value is True;
+            buffer_size argument may also be passed to fix the size of the frames; by default it is sized automatically (see frame_sizer_steps());
+            compress forces (True) or disables (False) the compressed transport;
+            the [--resume] option continues an interrupted transfer of the file from the end of the partial local file.
+
+            Examples:
+            srltool recv-file [filename_to_get] [filename_to_save]
+            or
+            srltool recv-file [filename_to_get] 
+            or
+            srltool recv-file [filename_to_get] check_exist=True buffer_size=64
+            or
+            srltool recv-file [filename_to_get] [filename_to_save]
+            or
+            srltool recv-file [filename_to_get] --resume
         """
+        if check_exist:
+            st = yield from self.stat_steps(filename_to_get)
+            if st is None or st[0] != S_IFREG:
+                print("File doesn't exist.", file=self.stdout)
+                return
+        if filename_to_save is None:
+            filename_to_save = filename_to_get
+        offset = 0
+        if resume:
+            if read_journal('download', filename_to_save, filename_to_get) is None or not os.path.isfile(filename_to_save):
+                print('No interrupted transfer of this file was found; receiving it from the start.', file=self.stdout)
+            else:
+                size = os.path.getsize(filename_to_save)
+                try:
+                    resp = yield from self.call_steps('prefix', filename_to_get, size)
+                except DeviceError:
+                    resp = ()
+                if resp and size <= resp[0] and resp[1] == file_digest(filename_to_save, size):
+                    offset = size
+                    print(f'Resuming [{filename_to_get}] from byte {offset}.', file=self.stdout)
+                else:
+                    print(f'Warning: {resume_mismatch(resp, size, resp[0] if resp else 0, "host")}; receiving [{filename_to_get}] from the start.', file=self.stdout)
+        write_journal('download', filename_to_save, filename_to_get)
+        yield from self.download_steps(filename_to_get, filename_to_save, BUFFER_SIZE, compress, offset)
+        clear_journal('download', filename_to_save, filename_to_get)
+
+    @in_phase('transfer')
+    def download_steps(self, filename_to_get: str, filename_to_save: str, frame_size: int=None, compress: bool=None, offset: int=0):
+        """ Streams [filename_to_get] from the device into [filename_to_save] as CRC32-checked frames, from [offset] for a
+            single file; a directory is sent whole as a single archive.
+        """
+        sizer = yield from self.frame_sizer_steps(frame_size)
+        if compress is None or compress:
+            if 'deflate' not in (yield from self.probe_codecs_steps()):
+                if compress:
+                    print('The device cannot deflate; receiving uncompressed.', file=self.stdout)
+                compress = False
+            else:
+                compress = True
 
         cmd = f"""
+        import sys, gc, struct, micropython
         try:
             import pyb
             import os
+            w = pyb.USB_VCP().write
         except ImportError:
             import uos as os
-        usb = pyb.USB_VCP()
-        usb.write(repr(os.statvfs('/flash')))
+            w = sys.stdout.buffer.write
+        try:
+            from time import ticks_ms, ticks_diff
+        except ImportError:
+            from utime import ticks_ms, ticks_diff
+        try:
+            from ubinascii import hexlify
+        except ImportError:
+            from binascii import hexlify
+        try:
+            from binascii import crc32
+        except ImportError:
+            crc32 = None
+        try:
+            from hashlib import sha256
+        except ImportError:
+            try:
+                from uhashlib import sha256
+            except ImportError:
+                sha256 = None
+        try:
+            import select
+        except ImportError:
+            import uselect as select
+        if {compress}:
+            import deflate, io
+        poller = select.poll()
+        poller.register(sys.stdin, select.POLLIN)
+        def rd(b):
+            # Ctrl-C is disabled while the loop runs; a host that stopped replying is given up on instead.
+            if not poller.poll({self.host_timeout_ms()}):
+                raise OSError('timed out waiting for the host')
+            sys.stdin.buffer.readinto(b)
+        buf = bytearray({sizer.limit})
+        mv = memoryview(buf)
+        hdr = bytearray(2)
+        fhdr = bytearray(6)
+        tag = bytearray(1)
+        block, limit, growing, best = {sizer.size}, {sizer.limit}, {sizer.growing}, 0
+        start, sent, frames = ticks_ms(), 0, 0
+        def adapt(n):
+            global block, limit, growing, best, start, sent, frames
+            if gc.mem_free() < 4 * block:
+                gc.collect()
+                if gc.mem_free() < 4 * block:
+                    block = limit = max({MIN_FRAME}, block // 2)
+                    growing = False
+            if not growing:
+                return
+            sent += n
+            frames += 1
+            elapsed = ticks_diff(ticks_ms(), start)
+            if frames < 8 or elapsed < {int(sizer.period * 1000)}:
+                return
+            rate = sent / elapsed
+            if rate > best * 1.1 and block < limit:
+                best = rate
+                block *= 2
+            else:
+                if rate < best:
+                    block //= 2
+                growing = False
+            start, sent, frames = ticks_ms(), 0, 0
+        def send(data, flags):
+            n = len(data)
+            hdr[0], hdr[1] = n & 0xff, n >> 8 | flags
+            w(hdr)
+            w(data)
+        def send_frame(n, offset):
+            data, flags = mv[:n], 0
+            if {compress}:
+                b = io.BytesIO()
+                d = deflate.DeflateIO(b, deflate.ZLIB, 10)
+                d.write(data)
+                d.close()
+                packed = b.getvalue()
+                if len(packed) < n:
+                    data, flags = packed, {COMPRESSED}
+            struct.pack_into('<HI', fhdr, 0, len(data) | flags, offset)
+            w(fhdr)
+            w(data)
+            w(struct.pack('<I', crc32(data, crc32(fhdr)) if crc32 else 0))
+        def digest(path):
+            if sha256 is None:
+                return b'-' * 64
+            h = sha256()
+            with open(path, 'rb') as f:
+                while True:
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    h.update(mv[:n])
+            return hexlify(h.digest())
+        def send_file(path, rel, offset=0):
+            size = os.stat(path)[6]
+            w(b'F')
+            send(rel.encode(), 0)
+            w(bytes([size & 0xff, size >> 8 & 0xff, size >> 16 & 0xff, size >> 24]))
+            # (offset, size) of the block of each frame sent, by index, to read it again if it must be resent.
+            blocks = []
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                while True:
+                    n = f.readinto(mv[:block])
+                    if not n:
+                        break
+                    blocks.append((offset, n))
+                    send_frame(n, offset)
+                    adapt(n)
+                    offset += n
+                d = digest(path)
+                while True:
+                    w(bytes(6))
+                    w(d)
+                    rd(tag)
+                    if tag == {FILE_OK!r}:
+                        break
+                    if tag != {RESEND!r}:
+                        raise ValueError('sha256 mismatch: ' + path if tag == {MISMATCH!r} else 'transfer aborted by the host')
+                    count = struct.unpack('<H', sys.stdin.buffer.read(2))[0]
+                    for index in struct.unpack('<%dI' % count, sys.stdin.buffer.read(4 * count)):
+                        offset, n = blocks[index]
+                        f.seek(offset)
+                        blocks.append((offset, n))
+                        send_frame(f.readinto(mv[:n]), offset)
+        def walk(path, rel):
+            for item in os.ilistdir(path):
+                if item[1] & 0x4000:
+                    w(b'D')
+                    send((rel + item[0]).encode(), 0)
+                    walk(path + '/' + item[0], rel + item[0] + '/')
+                else:
+                    send_file(path + '/' + item[0], rel + item[0])
+        st = os.stat({filename_to_get!r})
+        w({ACK!r} if crc32 else {NO_CRC!r})
+        micropython.kbd_intr(-1)
+        try:
+            if st[0] & 0x4000:
+                walk({filename_to_get!r}, '')
+            else:
+                send_file({filename_to_get!r}, '', {offset})
+        finally:
+            micropython.kbd_intr(3)
+        w(b'E')
         """
-        self.execute(dedent(cmd))
-        if self.serial.read(2) == b'OK':
-            raw_resp = self.serial.read_until(b'>')
-            resp = eval(raw_resp.decode()[:-3])
-            _total = resp[0] * resp[3] / 1048576
-            _remained = resp[0] * resp[2] / 1048576
-            print('\nTotal flash size: {:.3f} MB'.format(_total))
-            print('Remained free space: {:.3f} MB'.format(_remained))
-        self.exit_raw_repl()
-        return repr(resp)
+        yield 'execute', dedent(cmd)
+        resp = yield 'read', 1
+        if resp not in (ACK, NO_CRC):
+            yield from self.abort_transfer_steps(resp)
+        # whether the device sends the CRC32 of the frames, and has sent the sha256 of every file so far.
+        checked, verified = resp == ACK, True
+        if not checked:
+            print('Warning: the device has no binascii.crc32; the frames are received unchecked.', file=self.stdout)
+
+        files = total_received = total_wire = 0
+        total_start = monotonic()
+        mv = memoryview(bytearray(sizer.limit))
+        try:
+            while True:
+                tag = yield 'read', 1
+                if tag == b'E':
+                    break
+                if tag not in (b'D', b'F'):
+                    yield from self.abort_transfer_steps(tag)
+                rel = (yield 'read', struct.unpack('<H', (yield 'read', 2))[0]).decode()
+                local = os.path.join(filename_to_save, *rel.split('/')) if rel else filename_to_save
+                if tag == b'D':
+                    os.makedirs(local, exist_ok=True)
+                    continue
+
+                label = f'{filename_to_get}/{rel}' if rel else filename_to_get
+                total = struct.unpack('<I', (yield 'read', 4))[0]
+                dir = os.path.dirname(local)
+                if dir:
+                    os.makedirs(dir, exist_ok=True)
+                skipped = 0 if rel else offset
+                received, wire = skipped, 0
+                index, bad, resent = 0, [], 0
+                start = monotonic()
+                self.stdout.write("\033[?25l")
+                with open(local, 'r+b' if skipped else 'wb') as f:
+                    while True:
+                        header = yield 'read', 6
+                        yield 'arm_deadline',
+                        size, at = struct.unpack('<HI', header)
+                        if not size:
+                            digest = (yield 'read', 64).decode()
+                            if bad:
+                                yield 'write', RESEND + struct.pack(f'<H{len(bad)}I', len(bad), *bad)
+                                self.metrics.retries += len(bad)
+                                resent += len(bad)
+                                bad = []
+                                continue
+                            f.flush()
+                            if digest != '-' * 64 and digest != file_digest(local, total):
+                                yield 'write', MISMATCH
+                                yield from self.abort_transfer_steps(b'')
+                            yield 'write', FILE_OK
+                            break
+                        n = size & ~COMPRESSED
+                        if n > sizer.limit:
+                            # the rest of the stream can't be framed; the device is stopped at the end of the file.
+                            raise RuntimeError('Corrupted frame header; the transfer lost sync.')
+                        yield 'readinto', mv[:n]
+                        crc = struct.unpack('<I', (yield 'read', 4))[0]
+                        wire += n + 10
+                        if checked and zlib.crc32(mv[:n], zlib.crc32(header)) != crc:
+                            bad.append(index)
+                            index += 1
+                            continue
+                        index += 1
+                        self.metrics.payload(n)
+                        block = zlib.decompress(mv[:n]) if size & COMPRESSED else mv[:n]
+                        f.seek(at)
+                        f.write(block)
+                        received += len(block)
+                        elapsed = monotonic() - start
+                        self.stdout.write(f"Receiving [{label}]: {round(received / total * 100)}% {(received - skipped) / elapsed / 1024 if elapsed else 0:.1f} KB/s\r")
+                        self.stdout.flush()
+                elapsed = max(monotonic() - start, 1e-6)
+                files += 1
+                received -= skipped
+                total_received += received
+                total_wire += wire
+                self.stdout.write("\033[?25h")
+                self.stdout.write("\033[K")
+                self.stdout.write(f'Received [{label}]: {received} bytes in {elapsed:.2f}s ({received / elapsed / 1024:.1f} KB/s')
+                if compress:
+                    self.stdout.write(f'; {wire} bytes on the wire at {wire / elapsed / 1024:.1f} KB/s')
+                if resent:
+                    self.stdout.write(f'; {resent} frame(s) resent')
+                skipped = skipped_checks(checked, digest != '-' * 64)
+                if skipped:
+                    self.stdout.write(f'; {skipped} not checked')
+                self.stdout.write(')\n')
+                self.stdout.flush()
+                if digest == '-' * 64 and verified:
+                    verified = False
+                    print('Warning: the device has no hashlib.sha256; the files received are not verified.', file=self.stdout)
+        except BaseException as e:
+            # errors, Ctrl-Cs and cancellations alike, unless the loop has stopped already or the steps are being closed.
+            if not isinstance(e, (TransferAborted, GeneratorExit)):
+                yield from self.stop_transfer_steps(ABORT)
+            raise
+        yield 'follow',
+        if files > 1:
+            elapsed = max(monotonic() - total_start, 1e-6)
+            skipped = skipped_checks(checked, verified)
+            print(f'{files} files, {total_received} bytes in {elapsed:.2f}s ({total_received / elapsed / 1024:.1f} KB/s; {total_wire} bytes on the wire{"; " + skipped + " not checked" if skipped else ""})', file=self.stdout)
+
 
+class SerialTool(SerialOperations):
+    """Class to communicate with STM32 devices over a serial connection."""
+    @property
+    def serial(self) -> serial.Serial:
+        """The serial connection to the device, opened on first use."""
+        if self.connection is None:
+            self.connect()
+        return self.connection
+
+    @in_phase('connect')
+    def connect(self) -> None:
+        """Opens the serial connection, to [port] if one was given and to the discovered device otherwise."""
+        if self.port:
+            port, name = self.port, 'device'
+        else:
+            port, name = self.discover()
+        try:
+            self.connection = serial.Serial(port, baudrate=BAUDRATE)
+        except PermissionError:
+            sys.exit("Permission denied; please run the script in sudo mode.")
+        except Exception as e:
+            sys.exit(f"{e}; are you sure you're running the script in sudo mode?")
+        self.port = port
+        if self.capture is not None:
+            self.connection = SerialCapture(self.connection, self.capture[0], port, self.capture[1])
+            self.metrics.attach(self.connection)
+        print(f"Connection with the [{name}] established on {port}\n", file=self.stdout)
+
+    def enter_raw_repl(self) -> None:
+        """Entering the raw-REPL mode; does nothing if the device is already in it.
+        Any running program is interrupted and the output still pending is skipped up to the raw-REPL prompt,
+        which is awaited for HANDSHAKE_TIMEOUT seconds per attempt."""
+        if self.in_raw_repl:
+            return
+
+        with self.metrics.phase('raw_repl'):
+            self.write(b'\r\x03\x03')
+            for retry in range(3):
+                self.serial.reset_input_buffer()
+                self.write(b'\r\x01')
+                try:
+                    self.expect(RAW_REPL_PROMPT, 'the raw-REPL prompt', HANDSHAKE_TIMEOUT)
+                except DeviceTimeout:
+                    if retry == 2:
+                        raise
+                    self.metrics.retries += 1
+                    self.write(b'\r\x03\x03')
+                else:
+                    self.in_raw_repl = True
+                    return
+
+    @in_phase('soft_reset')
+    def soft_reset(self) -> None:
+        """Soft-resets the device, discarding the state left behind by the previous commands."""
+        self.enter_raw_repl()
+        self.write(b'\x04')
+        self.expect(RAW_REPL_PROMPT, 'the device to soft-reset', HANDSHAKE_TIMEOUT)
+        if not self.session_depth:
+            self.exit_raw_repl()
+
+    def exit_raw_repl(self) -> None:
+        """Exits the raw-REPL mode."""
+        self.write(b'\r\x02')
+        self.in_raw_repl = False
+
+    @contextmanager
+    def session(self, reset: bool=False):
+        """Keeps the device in the raw-REPL mode for the duration of the block, so that consecutive commands don't
+        re-enter it each time. Sessions may be nested; the outermost one soft-resets the device on leaving if [reset] is True.
+
+        Example:
+        with tool.session():
+            tool.mkdir('lib')
+            tool.sendfile('lib/utils.py')
+        """
+        self.session_depth += 1
+        try:
+            yield self
+        finally:
+            self.session_depth -= 1
+            if not self.session_depth:
+                self.invalidate()
+                if reset:
+                    self.soft_reset()
+                if self.in_raw_repl:
+                    self.exit_raw_repl()
+
+    def raw_paste_write(self, data: bytes) -> None:
+        """Writes the script in raw-paste mode, honouring the window size and the flow-control bytes sent by the device."""
+        window_size = struct.unpack('<H', self.receive(2, 'the raw-paste window size', HANDSHAKE_TIMEOUT))[0]
+        window_remain = window_size
+        i = 0
+        try:
+            while i < len(data):
+                while window_remain == 0 or self.serial.inWaiting():
+                    flag = self.receive(1, 'the raw-paste flow control', HANDSHAKE_TIMEOUT)
+                    if flag == b'\x01':
+                        window_remain += window_size
+                    elif flag == b'\x04':
+                        # the device aborted the paste; acknowledge and let it report the error.
+                        self.write(b'\x04')
+                        return
+                    else:
+                        raise RuntimeError(f'Unexpected data during raw-paste: {flag}')
+                chunk = data[i:i + window_remain]
+                self.write(chunk)
+                window_remain -= len(chunk)
+                i += len(chunk)
+        except BaseException:
+            # a Ctrl-C aborts the paste, otherwise the device would keep reading whatever comes next as the script;
+            # the next command re-enters the raw-REPL, skipping the report of the abort.
+            self.write(b'\x03')
+            self.in_raw_repl = False
+            raise
+        self.write(b'\x04')
+        self.expect(b'\x04', 'the end of the raw-paste', HANDSHAKE_TIMEOUT)
+
+    @in_phase('upload')
+    def execute(self, cmd: str) -> None:
+        """Executes the command by first entering the raw-REPL mode (unless already in it), sending the script
+        (in raw-paste mode when the firmware supports it) and waiting for the device to accept it.
+        The output of the script is left on the serial line to be read by follow()."""
+        self.enter_raw_repl()
+        self.arm_deadline()
+        data = cmd.encode()
+        if self.use_raw_paste:
+            self.write(b'\x05A\x01')
+            resp = self.receive(2, 'the raw-paste reply', HANDSHAKE_TIMEOUT)
+            if resp == b'R\x01':
+                self.raw_paste_write(data)
+                return
+            if resp != b'R\x00':
+                # firmware without raw-paste support re-enters the raw-REPL on the trailing \x01;
+                # the first two bytes of its banner ('ra') were consumed above.
+                self.expect(RAW_REPL_PROMPT[2:], 'the raw-REPL prompt', HANDSHAKE_TIMEOUT)
+            self.use_raw_paste = False
+
+        for i in range(0, len(data), 256):
+            self.write(data[i:i + 256])
+            # without raw-paste there is no flow control; let each chunk leave the port before the next one is written.
+            self.serial.flush()
+        self.write(b'\x04')
+        resp = self.receive(2, 'the device to accept the command', HANDSHAKE_TIMEOUT)
+        if resp != b'OK':
+            raise RuntimeError(f'Could not execute the command: {resp}')
+
+    @in_phase('execution')
+    def follow(self) -> tuple:
+        """Reads the output of the executed command up to the raw-REPL prompt and returns it as (stdout, stderr);
+        the raw-REPL mode is exited afterwards unless a session is active."""
+        out = self.expect(b'\x04', 'the output of the command')[:-1]
+        return out, self.read_stderr()
+
+    def read_stderr(self) -> bytes:
+        """Reads the stderr section of the executed command's response (once its stdout has been consumed) up to the
+        raw-REPL prompt and returns it; the raw-REPL mode is exited afterwards unless a session is active."""
+        err = self.expect(b'\x04', 'the end of the command')[:-1]
+        self.expect(b'>', 'the raw-REPL prompt')
+        if not self.session_depth:
+            self.exit_raw_repl()
+        return err
+
+    def exec_raw(self, cmd: str) -> tuple:
+        """Executes the command and returns its output as (stdout, stderr)."""
+        self.execute(cmd)
+        return self.follow()
+
+    @in_phase('execution')
+    def exec_replies(self, cmd: str, prelude: str=REPLY):
+        """Executes the command with the reply() and reply_ints() helpers defined (by the [prelude]) and yields the decoded
+        reply frames it writes, as they arrive. Each frame is read into a reusable buffer; any other output of the command
+        (print()s included) is skipped up to the next REPLY_SYNC. A DeviceError carrying the device-side traceback is raised
+        if the command fails."""
+        self.execute(prelude + cmd)
+        tail = b''
+        while True:
+            byte = self.receive(1, 'a reply of the device')
+            if byte == b'\x04':
+                break
+            tail = (tail + byte)[-len(REPLY_SYNC):]
+            if tail != REPLY_SYNC:
+                continue
+            tail = b''
+            tag, size = REPLY_HEADER.unpack(self.receive(REPLY_HEADER.size, 'a reply of the device'))
+            if tag not in (REPLY_JSON, REPLY_INTS) or size > REPLY_MAX:
+                continue
+            if len(self.reply_buffer) < size:
+                self.reply_buffer = bytearray(size)
+            mv = memoryview(self.reply_buffer)[:size]
+            self.readinto(mv)
+            self.arm_deadline()
+            if tag == REPLY_JSON:
+                yield json.loads(bytes(mv))
+            else:
+                yield list(struct.unpack_from(f'<{size // 4}i', mv))
+        err = self.read_stderr()
+        if err:
+            raise DeviceError(err.decode().replace('\r', '').strip())
+
+    def run(self, script: str) -> str:
+        """Executes the [script] on the device, prints and returns its output; a DeviceError is raised if it fails."""
+        out, err = self.exec_raw(script)
+        out = out.decode(errors='replace')
+        if out:
+            print(out.replace('\r', ''), end='' if out.endswith('\n') else '\n', file=self.stdout)
+        if err:
+            raise DeviceError(err.decode().replace('\r', '').strip())
+        return out
+
+    def exec_reply(self, cmd: str, prelude: str=REPLY):
+        """Executes the command and returns its first reply frame (see exec_replies()), or None if it didn't reply."""
+        replies = list(self.exec_replies(cmd, prelude))
+        return replies[0] if replies else None
+
+    def clear(self) -> None:
+        """Clears the screen on the REPL"""
+        cmd = """
+        import sys
+        sys.stdout.write("\x1b[2J\x1b[H")
+        """
+        self.exec_raw(dedent(cmd))
+
+    def close(self) -> None:
+        """Closes the serial connection, if it was opened."""
+        if self.connection is None:
+            return
+        if self.in_raw_repl:
+            self.exit_raw_repl()
+        self.connection.close()
+        self.connection = None
+        self.metrics.attach(None)
+
+    def start_capture(self, path: str, label: str=None) -> None:
+        """Records the traffic with the device in the file [path] (see SerialCapture) until stop_capture() or close(),
+        from the connection onwards if it isn't open yet; [label] names the command in the capture."""
+        self.capture = (path, label)
+        if self.connection is not None:
+            self.connection = SerialCapture(self.connection, path, self.port, label)
+            self.metrics.attach(self.connection)
+
+    def stop_capture(self) -> None:
+        """Stops recording the traffic with the device."""
+        if isinstance(self.connection, SerialCapture):
+            self.connection = self.connection.stop()
+        self.capture = None
+        self.metrics.attach(None)
+
+    def drive(self, steps):
+        """Runs an operation written as a generator of I/O requests (see SerialOperations) to completion with blocking calls
+        and returns its result; errors (and Ctrl-Cs) raised while serving a request are thrown back into the generator."""
+        try:
+            request = next(steps)
+            while True:
+                try:
+                    result = getattr(self, request[0])(*request[1:])
+                    if isinstance(result, GeneratorType):
+                        result = list(result)
+                except (Exception, KeyboardInterrupt) as e:
+                    request = steps.throw(e)
+                else:
+                    request = steps.send(result)
+        except StopIteration as e:
+            return e.value
+
+    def call(self, function: str, *args, replies: bool=False):
+        """See SerialOperations.call_steps()."""
+        return self.drive(self.call_steps(function, *args, replies=replies))
+
+    def write(self, data: bytes) -> None:
+        self.metrics.bytes_written += len(data)
+        self.serial.write(data)
+
+    def read(self, size: int) -> bytes:
+        return self.receive(size, 'the device')
+
+    def read_until(self, marker: bytes) -> bytes:
+        return self.expect(marker, 'the device')
+
+    def readinto(self, buffer) -> None:
+        self.serial.timeout = self.remaining()
+        start = monotonic()
+        size = self.serial.readinto(buffer)
+        self.metrics.idle += monotonic() - start
+        self.metrics.bytes_read += size
+        if size < len(buffer):
+            self.in_raw_repl = False
+            raise DeviceTimeout('Timed out waiting for the device.')
+
+    def expect(self, marker: bytes, what: str, timeout: float=None) -> bytes:
+        """Reads up to and including [marker] and returns it; a DeviceTimeout naming [what] is raised if it doesn't arrive
+        within [timeout] seconds, or before the deadline of the current command if [timeout] is not given."""
+        self.serial.timeout = self.remaining() if timeout is None else timeout
+        start = monotonic()
+        data = self.serial.read_until(marker)
+        self.metrics.idle += monotonic() - start
+        self.metrics.bytes_read += len(data)
+        if not data.endswith(marker):
+            # the device is in an unknown state; the next command interrupts it and re-enters the raw-REPL.
+            self.in_raw_repl = False
+            raise DeviceTimeout(f'Timed out waiting for {what} (received {data[-40:]}).')
+        return data
+
+    def receive(self, size: int, what: str, timeout: float=None) -> bytes:
+        """Reads exactly [size] bytes and returns them; see expect() for the deadline."""
+        self.serial.timeout = self.remaining() if timeout is None else timeout
+        start = monotonic()
+        data = self.serial.read(size)
+        self.metrics.idle += monotonic() - start
+        self.metrics.bytes_read += len(data)
+        if len(data) < size:
+            self.in_raw_repl = False
+            raise DeviceTimeout(f'Timed out waiting for {what} (received {data[-40:]}).')
+        return data
+
+    def listdir(self, dir: str='', refresh: bool=False) -> list:
+        """See listdir_steps()."""
+        return self.drive(self.listdir_steps(dir, refresh))
+
+    def stat(self, path: str) -> tuple:
+        """See stat_steps()."""
+        return self.drive(self.stat_steps(path))
+
+    def ls(self, dir: str='', show: bool=True) -> str:
+        """See ls_steps()."""
+        return self.drive(self.ls_steps(dir, show))
+
+    def walk(self, path: str='.', show_hidden: bool=True, dir_only: bool=False) -> list:
+        """See walk_steps()."""
+        return self.drive(self.walk_steps(path, show_hidden, dir_only))
+
+    def tree(self, path: str='.', show_hidden=True, dir_only=False) -> int:
+        """See tree_steps()."""
+        return self.drive(self.tree_steps(path, show_hidden, dir_only))
+
+    def memstat(self) -> str:
+        """See memstat_steps()."""
+        return self.drive(self.memstat_steps())
+
+    def flashstat(self) -> str:
+        """See flashstat_steps()."""
+        return self.drive(self.flashstat_steps())
+
+    def heap(self) -> dict:
+        """See heap_steps()."""
+        return self.drive(self.heap_steps())
+
+    @in_session
+    def heap_diff(self, script: str) -> dict:
+        """See heap_diff_steps()."""
+        return self.drive(self.heap_diff_steps(script))
+
+    @in_session
+    def monitor(self, rate: float=100, duration: float=None, samples: int=None, history: int=1024, csv_path: str=None, mmap_path: str=None) -> Telemetry:
+        """See monitor_steps(); the samples are kept in a Telemetry of [history] samples, written to [csv_path] and
+        [mmap_path] if given. A Ctrl-C stops the monitor as well."""
+        telemetry = Telemetry(history, csv_path, mmap_path)
+        try:
+            self.drive(self.monitor_steps(telemetry, rate, duration, samples))
+        except KeyboardInterrupt:
+            # stop the loop of the device and skip the samples still on their way.
+            self.write(b'\x03')
+            self.expect(b'E\x04', 'the end of the monitor loop')
+            self.read_stderr()
+            self.stdout.write("\033[?25h\033[K")
+            print(telemetry.summary(), file=self.stdout)
+        finally:
+            telemetry.close()
+        return telemetry
+
+    def probe_codecs(self) -> list:
+        """See probe_codecs_steps()."""
+        return self.drive(self.probe_codecs_steps())
+
+    @in_session
+    def sendfile(self, filename_to_send: str, filename_to_save: str=None, forced: bool=False, BUFFER_SIZE: int=None, encoding: str='raw', compress: bool=None, resume: bool=False) -> None:
+        """See sendfile_steps()."""
+        return self.drive(self.sendfile_steps(filename_to_send, filename_to_save, forced, BUFFER_SIZE, encoding, compress, resume))
+
+    def upload_tree(self, entries: list, frame_size: int=None, encoding: str='raw', compress: bool=None, window: int=4, offsets: dict=None) -> None:
+        """See upload_tree_steps()."""
+        return self.drive(self.upload_tree_steps(entries, frame_size, encoding, compress, window, offsets))
+
+    def read_ack(self) -> None:
+        """See read_ack_steps()."""
+        return self.drive(self.read_ack_steps())
+
+    def abort_transfer(self, resp: bytes) -> None:
+        """See abort_transfer_steps()."""
+        return self.drive(self.abort_transfer_steps(resp))
+
+    @in_session
+    def recvfile(self, filename_to_get: str, filename_to_save: str=None, check_exist: bool=True, BUFFER_SIZE: int=None, compress: bool=None, resume: bool=False) -> None:
+        """See recvfile_steps()."""
+        return self.drive(self.recvfile_steps(filename_to_get, filename_to_save, check_exist, BUFFER_SIZE, compress, resume))
+
+    def download(self, filename_to_get: str, filename_to_save: str, frame_size: int=None, compress: bool=None, offset: int=0) -> None:
+        """See download_steps()."""
+        return self.drive(self.download_steps(filename_to_get, filename_to_save, frame_size, compress, offset))
+
+    def ls_recursive(self, dir: str='') -> None:
+        """Lists the content of the specified directory and of all its subdirectories, one section per directory, from a single walk()."""
+        records = self.walk(dir or '.')
+        if records is None:
+            print("Something went wrong!\nPerhaps the parent directory doesn't exist,", file=self.stdout)
+            return
+        children = {'': []}
+        for rel, type, size in sorted(records):
+            parent, name = posixpath.split(rel)
+            children[parent].append((name, type, size))
+            if type == S_IFDIR:
+                children[rel] = []
+        for rel in sorted(children):
+            print(f'{posixpath.join(dir, rel) if rel else dir or "."}:', file=self.stdout)
+            for name, type, size in children[rel]:
+                if type == S_IFDIR:
+                    print('[d]',f'{name:>16}', file=self.stdout)
+                else:
+                    print('[f]',f'{name:>16}',f'{size:>10}', file=self.stdout)
+            print(file=self.stdout)
+
+    def du(self, path: str='.', show_hidden: bool=True, all: bool=False) -> int:
+        """Prints the disk usage of the specified directory and of each of its subdirectories (including their contents), from a single walk().
+        If the [--all or -a] option is passed then the size of every file is printed as well.
+        Returns the total size in bytes.
+
+        Examples:
+        srltool du
+        or
+        srltool du [directory] --all
+        """
+        records = self.walk(path, show_hidden)
+        if records is None:
+            print("Something went wrong!\nPerhaps the directory doesn't exist!", file=self.stdout)
+            return
+        totals = {'': 0}
+        for rel, type, size in records:
+            if type == S_IFDIR:
+                totals.setdefault(rel, 0)
+                continue
+            parent = posixpath.dirname(rel)
+            while True:
+                totals[parent] = totals.get(parent, 0) + size
+                if not parent:
+                    break
+                parent = posixpath.dirname(parent)
+        lines = [(rel, total) for rel, total in totals.items()]
+        if all:
+            lines += [(rel, size) for rel, type, size in records if type == S_IFREG]
+        # every entry after its contents, as du does.
+        for rel, total in sorted(lines, key=lambda line: tuple(line[0].split('/') if line[0] else ()) + ('\uffff',)):
+            print(f'{total:>10}  {posixpath.join(path, rel) if rel else path}', file=self.stdout)
+        return totals['']
+
+    @in_session
     def overall_stat(self) -> str:
         """ Returns the overall flash size details and memory status.
 
@@ -314,6 +2467,7 @@ class SerialTool:
         self.flashstat()
         self.memstat()
     
+    @in_session
     def mkdir(self, dir: str, ignore_if_exists: bool=True) -> None:
         """ Creates the specified directory.
         The [--ignore-if-exists] option if passed then if the directory exists will be preserved without deletion. 
@@ -323,12 +2477,12 @@ class SerialTool:
         or
         srltool mkdir [directory_to_create] --ignore-if-exists 
         """
-        if dir in self.ls(show=False)[1]:
+        if self.stat(dir) is not None:
             if ignore_if_exists:
-                print('Directory already exists!')
+                print('Directory already exists!', file=self.stdout)
                 return
             else:
-                print('Directory exists, removing recursively.')
+                print('Directory exists, removing recursively.', file=self.stdout)
                 self.rmdir(dir, recursive=True)
         cmd = f"""
         try:
@@ -337,8 +2491,14 @@ class SerialTool:
             import uos as os
         os.mkdir('{dir}')
         """
-        self.execute(dedent(cmd))
+        _, err = self.exec_raw(dedent(cmd))
+        if err:
+            print(f'Could not create the directory: {err.decode()}', file=self.stdout)
+            self.invalidate(dir)
+            return
+        self.cache_add(dir, S_IFDIR)
 
+    @in_session
     def rmfile(self, file: str) -> None:
         """ Removes the specified file without further notice, please be cautious!
     
@@ -346,10 +2506,9 @@ class SerialTool:
         srltool rmfile [file_to_delete]
         """
 
-        filename = file.split('/')[-1]
-        dirname = '/'.join(file.split('/')[:-1])
-        if filename not in self.ls(dirname, show=False)[0]:
-            print("File doesn't exist!")
+        st = self.stat(file)
+        if st is None or st[0] != S_IFREG:
+            print("File doesn't exist!", file=self.stdout)
             return
 
         cmd = f"""
@@ -359,9 +2518,11 @@ class SerialTool:
             import uos as os
         os.remove('{file}')
         """
-        self.execute(dedent(cmd))
-        print('file was removed.')
+        self.exec_raw(dedent(cmd))
+        self.cache_remove(file)
+        print('file was removed.', file=self.stdout)
 
+    @in_session
     def rmdir(self, dir: str, recursive: bool=False) -> None:
         """ Removes the specified directory.
             If the [--forced or -f] option is passed then if the existed folder and all its contents including
@@ -373,101 +2534,31 @@ class SerialTool:
             srltool rmdir [dir_to_delete] --forced
         """
 
-        if recursive:
-            cmd = f"""
-            try:
-                import os
-            except ImportError:
-                import uos as os
-            def rmdir(directory):
-                os.chdir(directory)
-                for f in os.listdir():
-                    try:
-                        os.remove(f)
-                    except OSError:
-                        pass
-                for f in os.listdir():
-                    rmdir(f)
-                os.chdir('..')
-                os.rmdir(directory)
-            rmdir('{dir}')
-            """
-            self.execute(dedent(cmd))
-            print('directory was removed.')
+        if not recursive:
+            st = self.stat(dir)
+            if st is None or st[0] != S_IFDIR:
+                print("Directory doesn't exist!", file=self.stdout)
+                return
+            if self.listdir(dir):
+                print('directory is not empty, please consider the --forced/-f option to remove recursively.', file=self.stdout)
+                return
+        try:
+            self.call('rmdir', dir, recursive)
+        except DeviceError as e:
+            print(f'Could not remove the directory: {e}', file=self.stdout)
+            self.invalidate(dir)
             return
+        self.cache_remove(dir)
+        print('directory was removed.', file=self.stdout)
 
-        if dir not in self.ls(show=False)[1]:
-            print("Directory doesn't exist!")
-            return
-        if not self.ls(dir, show=False)[0] and not self.ls(dir, show=False)[1]:
-            cmd = f"""
-            try:
-                import os
-            except ImportError:
-                import uos as os
-            os.rmdir('{dir}')
-            """
-            self.execute(cmd)
-            print('directory was removed.')
-        else:
-            print('directory is not empty, please consider the --forced/-f option to remove recursively.')
- 
-    def sendfile(self, filename_to_send: str, filename_to_save: str=None, forced: bool=False, BUFFER_SIZE: int=64) -> None:
-        """ Sends the specified file [filename_to_send] and will save as the specified file [filename_to_save].
-            If the [filename_to_save] has not been specified as an argument, then the same name as the [filename_to_get] will be designated to save the file.
-            buffer_size argument may also be passed to adjust the size of the buffers to be transferred over serial; the default value is 32;
-            the [--forced or -f] option can be passed to over-write the exisitng file, please be cautious!
+    def upload(self, filename_to_send: str, filename_to_save: str, frame_size: int=None, encoding: str='raw', compress: bool=None, window: int=4) -> None:
+        """ Streams the local file [filename_to_send] to [filename_to_save] on the device; see upload_tree()."""
+        self.upload_tree([(filename_to_send, filename_to_save)], frame_size, encoding, compress, window)
 
-            Examples:
-            srltool send-file [filename_to_send] [filename_to_save]
-            or
-            srltool send-file [filename_to_send] 
-            or
-            srltool send-file [filename_to_send] --forced buffer_size=128
-        """
-        if filename_to_save is None:
-            filename_to_save = filename_to_send
-        
-        # print(f'filename_to_send: {filename_to_send}\nfilename_to_save: {filename_to_save}')
-
-        file = filename_to_save.split('/')[-1]
-        dir = '/'.join(filename_to_save.split('/')[:-1])
-        if self.ls(dir, show=False) is None:
-            print('Saving to root...')
-            dir = '/flash'
-            filename_to_save = dir + '/' + file
-        if not forced:
-            if file in self.ls(dir, show=False)[0]:
-                print("File exists, please use the -f/--forced option to overwrite the file.")
-                return
-        
-        # print(f'filename_to_send: {filename_to_send}\nfilename_to_save: {filename_to_save}')
-
-        self.enter_raw_repl()
-        with open(filename_to_send, 'rb') as f:
-            content = f.read()
-            self.serial.write(f"with open('{filename_to_save}', 'wb') as f:\r".encode())
-            sleep(0.1)
-            segments = [content[i:i + BUFFER_SIZE] for i in range(0, len(content), BUFFER_SIZE)]
-            sys.stdout.write("\033[?25l")
-            for idx, segment in enumerate(segments):
-                self.serial.write(textwrap.indent(f"f.write({segment})\r", '    ').encode())
-                progress = round((int(idx + 1) / int(len(segments))) * 100)
-                sys.stdout.write(f"Sending [{filename_to_send}]: {progress}%\r")
-                sys.stdout.flush()
-                sleep(0.1)
-            sys.stdout.write("\033[?25h")
-            sys.stdout.flush()
-        sys.stdout.write("\033[K")
-        sys.stdout.write(f'Sent [{filename_to_send}]\n')
-        sleep(0.5)
-        self.soft_reset()
-        sleep(0.5)
-        self.exit_raw_repl()
-        sleep(0.5) 
-
-    def senddir(self, dirname_to_send: str, dirname_to_save: str=None, forced:bool = False) -> None:
-        """ Sends the specified directory [dirname_to_send] and all its included files to the specifieddirectory [dirname_to_save].
+    @in_session
+    def senddir(self, dirname_to_send: str, dirname_to_save: str=None, forced:bool = False, compress: bool=None) -> None:
+        """ Sends the specified directory [dirname_to_send] and all its included files and subdirectories to the specified directory [dirname_to_save].
+            The whole tree is packed into a single archive stream (see upload_tree()).
             If the [dirname_to_save] has not been specified as an argument, then the same name as the [dirname_to_send] will be designated to save the folder. 
             the [--forced or -f] option can be passed to over-write the exisitng folder and all its included files, please be cautious!
 
@@ -480,92 +2571,107 @@ class SerialTool:
         """
         if dirname_to_save is None:
             dirname_to_save = dirname_to_send
-        
-        # print(f'dirname_to_send: {dirname_to_send}\ndirname_to_save: {dirname_to_save}')
+        dirname_to_save = dirname_to_save.rstrip('/')
+        if not os.path.isdir(dirname_to_send):
+            print("Directory doesn't exist.", file=self.stdout)
+            return
 
-        if not forced:
-            current_path = os.getcwd()
-            child_dir = dirname_to_send.split('/')[-1]
-            parent_dir = current_path + '/' + '/'.join(dirname_to_send.split('/')[:-1])
-            if child_dir not in os.listdir(parent_dir):
-                print("Directory doesn't exist.")
-                return
+        existing = {} if forced else self.remote_hashes(dirname_to_save, digests=False)[0]
+        entries = [(None, dirname_to_save)]
+        for root, dirs, files in os.walk(dirname_to_send):
+            dirs.sort()
+            rel = os.path.relpath(root, dirname_to_send).replace(os.sep, '/')
+            prefix = '' if rel == '.' else rel + '/'
+            entries.extend((None, f'{dirname_to_save}/{prefix}{d}') for d in dirs)
+            for file in sorted(files):
+                if prefix + file in existing:
+                    print(f"File exists [{dirname_to_save}/{prefix}{file}], please use the -f/--forced option to overwrite the file.", file=self.stdout)
+                    continue
+                entries.append((os.path.join(root, file), f'{dirname_to_save}/{prefix}{file}'))
+        self.upload_tree(entries, compress=compress)
+        print('Directory was sent.', file=self.stdout)
 
-        self.mkdir(f'{dirname_to_save}')
-        sleep(0.1)
-        # print(f'dirname_to_send: {dirname_to_send}\ndirname_to_save: {dirname_to_save}')
-        for file in os.listdir(f'{dirname_to_send}/'): 
-            if forced:
-                self.sendfile(f'{dirname_to_send}/{file}', f'{dirname_to_save}/{file}', forced=True)
-            else:
-                self.sendfile(f'{dirname_to_send}/{file}', f'{dirname_to_save}/{file}', forced=False)
-            sleep(0.5)
-        print('Directory was sent.')
+    def remote_hashes(self, dir: str, digests: bool=True) -> tuple:
+        """Walks [dir] on the device in a single round trip and returns ({relative_path: sha256}, [relative_dirs]);
+        both are empty if the directory doesn't exist. With digests=False the file sizes are returned instead of hashes."""
+        return tuple(self.call('hashes', dir, digests))
 
-    def recvfile(self, filename_to_get: str, filename_to_save: str=None, check_exist: bool=True, BUFFER_SIZE: int=32) -> None:
-        """ Receives the specified file [filename_to_get] and will save as the specified file [filename_to_save].
-            If the [filename_to_save] has not been specified as an argument, then the same name as the [filename_to_get] will be designated to save the file.
-            check_exist argument may be passed to check if the file exists; the default value is True;
-            buffer_size argument may also be passed to adjust the size of the buffers to be transferred over serial; the default value is 32.
+    @in_session
+    def sync(self, dirname_to_send: str, dirname_to_save: str=None, delete: bool=False, compress: bool=None) -> None:
+        """ Synchronises the local directory [dirname_to_send] (recursively) with [dirname_to_save] on the device.
+            The sha256 of every remote file is computed on the device in one round trip and compared with the local hashes;
+            only new or changed files are sent. With [--delete], remote files and directories that no longer exist locally are removed
+            (the resident helper excepted).
+            If the [dirname_to_save] has not been specified as an argument, then the same name as the [dirname_to_send] will be designated.
 
             Examples:
-            srltool recv-file [filename_to_get] [filename_to_save]
-            or
-            srltool recv-file [filename_to_get] 
-            or
-            srltool recv-file [filename_to_get] check_exist=True buffer_size=64
+            srltool sync [dirname_to_send] [dirname_to_save]
             or
-            srltool recv-file [filename_to_get] [filename_to_save]
+            srltool sync [dirname_to_send] --delete
         """
+        if not os.path.isdir(dirname_to_send):
+            print("Directory doesn't exist.", file=self.stdout)
+            return
+        if not dirname_to_save:
+            dirname_to_save = dirname_to_send
+        dirname_to_save = dirname_to_save.rstrip('/')
 
-        cmd = f"""
-        try:
-            import pyb
-            import os
-            from time import sleep
-        except ImportError:
-            import uos as os
-        usb = pyb.USB_VCP()
-        with open('{filename_to_get}', 'r') as f:
-            content = f.read()
-            segments = [content[i:i + {BUFFER_SIZE}] for i in range(0, len(content), {BUFFER_SIZE})]
-            for segment in segments:
-                usb.write(repr({{}}).format(segment))
-                sleep(0.1)
-        """
-        file = filename_to_get.split('/')[-1]
-        dir = '/'.join(filename_to_get.split('/')[:-1])
-        if check_exist:
-            if file not in self.ls(dir, show=False)[0]:
-                print("File doesn't exist.")
-                return
-        print(f'Reading "{filename_to_get}"')
-        self.execute(dedent(cmd))
-        sleep(0.01)
-        if filename_to_save is None:
-            filename_to_save = filename_to_get
+        local_files, local_dirs = {}, []
+        for root, dirs, files in os.walk(dirname_to_send):
+            rel = os.path.relpath(root, dirname_to_send).replace(os.sep, '/')
+            prefix = '' if rel == '.' else rel + '/'
+            local_dirs.extend(prefix + d for d in dirs)
+            for file in files:
+                with open(os.path.join(root, file), 'rb') as f:
+                    local_files[prefix + file] = hashlib.sha256(f.read()).hexdigest()
 
-        file = filename_to_save.split('/')[-1]
-        dir = '/'.join(filename_to_save.split('/')[:-1])
-        current_dir = os.getcwd()
+        remote_files, remote_dirs = self.remote_hashes(dirname_to_save)
+        changed = sorted(rel for rel, digest in local_files.items() if remote_files.get(rel) != digest)
+        missing_dirs = [dirname_to_save + '/' + d for d in sorted(local_dirs) if d not in remote_dirs]
+        stale_files = sorted(rel for rel in remote_files if rel not in local_files and not is_helper(f'{dirname_to_save}/{rel}')) if delete else []
+        stale_dirs = sorted((d for d in remote_dirs if d not in local_dirs), reverse=True) if delete else []
 
-        if dir in os.listdir(current_dir):
-            os.chdir(dir)
-        else:
-            os.makedirs(dir)
-            os.chdir(dir)
-
-        if self.serial.read(2) == b'OK':
-            print(f'Writing "{file}"')
-            with open(file, 'wb') as f:
-                raw_resp = self.serial.read_until(b">")
-                resp = raw_resp[:-3]
-                f.write(resp)
-        os.chdir(current_dir)
-        self.clear()
-
-    def recvdir(self, dirname_to_get:  str, dirname_to_save: str=None) -> None:
-        """ Receives the specified directory [dirname_to_get] and its included files and will save in the specified directory [dirname_to_save].
+        if not remote_files and not remote_dirs:
+            missing_dirs.insert(0, dirname_to_save)
+        if missing_dirs or stale_files or stale_dirs:
+            cmd = f"""
+            try:
+                import os
+            except ImportError:
+                import uos as os
+            for d in {missing_dirs!r}:
+                try:
+                    os.mkdir(d)
+                except OSError:
+                    pass
+            for f in {[dirname_to_save + '/' + f for f in stale_files]!r}:
+                os.remove(f)
+            def rmtree(directory):
+                for item in os.ilistdir(directory):
+                    if item[1] & 0x4000:
+                        rmtree(directory + '/' + item[0])
+                    else:
+                        os.remove(directory + '/' + item[0])
+                os.rmdir(directory)
+            for d in {[dirname_to_save + '/' + d for d in stale_dirs]!r}:
+                try:
+                    rmtree(d)
+                except OSError:
+                    pass
+            """
+            _, err = self.exec_raw(dedent(cmd))
+            self.invalidate(dirname_to_save)
+            if err:
+                raise RuntimeError(f'Could not prepare {dirname_to_save}: {err.decode()}')
+
+        if changed:
+            self.upload_tree([(os.path.join(dirname_to_send, *rel.split('/')), f'{dirname_to_save}/{rel}') for rel in changed], compress=compress)
+        print(f'{len(changed)} file(s) sent, {len(local_files) - len(changed)} unchanged, {len(stale_files)} removed.', file=self.stdout)
+
+    @in_session
+    def recvdir(self, dirname_to_get:  str, dirname_to_save: str=None, compress: bool=None) -> None:
+        """ Receives the specified directory [dirname_to_get] and all its included files and subdirectories and will save in the specified directory [dirname_to_save].
+            The whole tree is sent by the device as a single archive stream (see download()).
             If the [dirname_to_save] has not been specified as an argument, then the same name as the [dirname_to_get] will be designated to save the folder. 
             
             Examples:
@@ -573,33 +2679,24 @@ class SerialTool:
             or
             srltool recv-dir dirname_to_get
         """
-        child_dir = dirname_to_get.split('/')[-1]
-        parent_dir = '/'.join(dirname_to_get.split('/')[:-1])
-        if child_dir not in self.ls(parent_dir, show=False)[1]:
-            print("Directory doesn't exist")
+        st = self.stat(dirname_to_get)
+        if st is None or st[0] != S_IFDIR:
+            print("Directory doesn't exist", file=self.stdout)
             return
 
-        if dirname_to_save == '':
+        if not dirname_to_save:
             dirname_to_save = dirname_to_get
 
-        files = self.ls(f'{dirname_to_get}', show=False)[0]
-        if not files:
-            os.makedirs(dirname_to_save)
-            return
-
-        current_dir = os.getcwd()
-        os.makedirs(dirname_to_save)
-        os.chdir(dirname_to_save)
-
-        for file in files:
-            self.recvfile(f'{dirname_to_get}/{file}', f'{dirname_to_save}/{file}', check_exist=False)
-            sleep(0.01)
-        os.chdir(current_dir)
+        os.makedirs(dirname_to_save, exist_ok=True)
+        self.download(dirname_to_get, dirname_to_save, compress=compress)
     
     def astroid(self, n):
         """Requests a list of coordinates and will plot an astroid as a serial test to 
         assess the serial connection with the device.
         """
+        # matplotlib takes hundreds of milliseconds to import; only this command needs it.
+        import matplotlib.pyplot as plt
+
         def plot(_list):
             plt.axis('off')
             for _ in range(1):
@@ -616,25 +2713,42 @@ class SerialTool:
                     plt.pause(0.1)
             plt.show()
         cmd = f"""
-        import pyb
-        from utime import sleep
-        usb = pyb.USB_VCP()
         a = [[(i, 0), (0, abs(abs(i) - {n})), (0, -(abs(abs(i) - {n})))] for i in range(-{n}, {n} + 1)]
         segments = [a[i:i + 64] for i in range(0, len(a), 64)]
         for segment in segments:
-            usb.write(repr({{}}).format(segment))
-            sleep(0.02)
+            reply(segment)
         """
-        self.execute(dedent(cmd))
-        sleep(0.5)
-        if self.serial.read(2) == b'OK':
-            raw_resp = self.serial.read_until(b'>')
-            if b'\x04\x04>' not in raw_resp:
-                print("Something went wrong!\nPerhaps the parent directory doesn't exist!")
-                return
-            resp =  raw_resp.decode()[:-3]
-        else:
-            print('something went wrong!')
-            raise RuntimeError
+        resp = []
+        for segment in self.exec_replies(dedent(cmd)):
+            resp.extend(segment)
         if resp:
-            plot(eval(resp))
+            plot(resp)
+
+
+def run_fleet(operation, ports: list=None, jobs: int=8) -> list:
+    """Runs operation(tool) on every device at once, one worker thread (and SerialTool, within a session) per port,
+    at most [jobs] at a time. All the discovered devices are used unless [ports] is given.
+    Returns one (port, result, error, output, elapsed) tuple per port, in order; [error] is None if the operation
+    succeeded and [output] is what the operation printed to the output stream of its tool, progress lines included."""
+    if ports is None:
+        ports = [port.device for port in find_devices()]
+
+    def work(port):
+        start = monotonic()
+        result = error = None
+        tool = SerialTool(port=port)
+        tool.output = io.StringIO()
+        try:
+            with tool.session():
+                result = operation(tool)
+        except (Exception, SystemExit) as e:
+            error = e
+        finally:
+            try:
+                tool.close()
+            except Exception:
+                pass
+        return port, result, error, tool.output.getvalue(), monotonic() - start
+
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(ports) or 1))) as pool:
+        return list(pool.map(work, ports))
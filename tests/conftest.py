@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import src
+from sim import Device
+from src import SerialTool
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keeps the port cache and the transfer journals of the tests out of the cache of the user."""
+    monkeypatch.setattr(src, 'PORT_CACHE', str(tmp_path / 'cache' / 'port.json'))
+    monkeypatch.setattr(src, 'JOURNAL_DIR', str(tmp_path / 'cache' / 'transfers'))
+    return tmp_path / 'cache'
+
+
+@pytest.fixture
+def make_device(tmp_path):
+    """Starts simulated devices (see sim.Device) rooted in the temporary directory of the test, and stops them after it."""
+    devices = []
+
+    def make(**kwargs):
+        device = Device(str(tmp_path / f'board{len(devices)}'), **kwargs)
+        devices.append(device)
+        return device
+    yield make
+    for device in devices:
+        device.close()
+
+
+@pytest.fixture
+def device(make_device):
+    return make_device()
+
+
+@pytest.fixture
+def flash(device):
+    """The directory of the host that holds /flash of [device]."""
+    return os.path.join(device.root, 'flash')
+
+
+@pytest.fixture
+def tool(device):
+    tool = SerialTool(port=device.port, timeout=10)
+    yield tool
+    tool.close()
+
+
+@pytest.fixture
+def cli_env(tmp_path, device):
+    """The environment of the srltool processes of a test: bound to [device], with a daemon socket and a cache of their own."""
+    return dict(os.environ, SRLTOOL_PORT=device.port, SRLTOOL_SOCKET=str(tmp_path / 'srltool.sock'),
+                XDG_CACHE_HOME=str(tmp_path / 'cache'), PYTHONPATH=ROOT)
+
+
+@pytest.fixture
+def srltool(cli_env, tmp_path):
+    """Runs srltool with the arguments in a process of its own and returns the CompletedProcess."""
+    def run(*args, timeout=60):
+        return subprocess.run([sys.executable, '-c', 'import cli; cli.main()', *args], env=cli_env, cwd=tmp_path,
+                              capture_output=True, text=True, timeout=timeout)
+    return run
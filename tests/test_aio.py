@@ -0,0 +1,56 @@
+import asyncio
+import os
+
+import pytest
+
+from aio import AsyncSerialTool
+from src import DeviceError, S_IFREG
+
+
+async def exercise(device, local, tmp_path):
+    async with AsyncSerialTool(device.port, timeout=10) as tool:
+        assert (await tool.run('print(1 + 1)')).strip() == '2'
+        await tool.sendfile(local, 'data.bin')
+        await tool.recvfile('data.bin', str(tmp_path / f'{os.path.basename(device.root)}.bin'))
+        # the operations issued at once on one tool are serialised.
+        assert await asyncio.gather(*[tool.stat('data.bin') for _ in range(4)]) == [(S_IFREG, 20000)] * 4
+        async with tool.session():
+            await tool.run('x = 5')
+            assert (await tool.run('print(x)')).strip() == '5'
+        with pytest.raises(DeviceError, match='ValueError'):
+            await tool.exec_reply("raise ValueError('x')")
+
+
+def test_devices_at_once(make_device, tmp_path):
+    data = os.urandom(20000)
+    (tmp_path / 'data.bin').write_bytes(data)
+    devices = [make_device() for _ in range(3)]
+
+    async def main():
+        await asyncio.gather(*[exercise(device, str(tmp_path / 'data.bin'), tmp_path) for device in devices])
+    asyncio.run(main())
+    for device in devices:
+        assert (tmp_path / f'{os.path.basename(device.root)}.bin').read_bytes() == data
+
+
+def test_cancelled_transfer_stops_the_device(make_device, tmp_path):
+    (tmp_path / 'big.bin').write_bytes(os.urandom(400_000))
+    device = make_device(baudrate=2_000_000)
+
+    async def main():
+        async with AsyncSerialTool(device.port, timeout=10) as tool:
+            task = asyncio.create_task(tool.sendfile(str(tmp_path / 'big.bin'), 'big.bin', compress=False))
+            while device._intr == 3:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            # the loop of the device has given up, with Ctrl-C enabled again, and the tool can go on.
+            for _ in range(100):
+                if device._intr == 3:
+                    break
+                await asyncio.sleep(0.02)
+            assert device._intr == 3
+            return (await tool.run('print(8)')).strip()
+    assert asyncio.run(main()) == '8'
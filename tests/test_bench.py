@@ -0,0 +1,34 @@
+import json
+
+from click.testing import CliRunner
+
+import bench
+
+
+def test_report_flags_regressions(tmp_path, capsys):
+    history = str(tmp_path / 'history.jsonl')
+    target = {'port': 'simulated'}
+    for value in (100, 110, 90):
+        assert not bench.report('throughput', target, {'sendfile 4K': (value, 'KB/s', True)}, history, 0.2, True)
+    assert not bench.report('throughput', target, {'sendfile 4K': (85, 'KB/s', True)}, history, 0.2, False)
+    assert bench.report('throughput', target, {'sendfile 4K': (70, 'KB/s', True)}, history, 0.2, False)
+    assert 'REGRESSION' in capsys.readouterr().out
+    # another target has a baseline of its own.
+    assert not bench.report('throughput', {'port': '/dev/ttyACM0'}, {'sendfile 4K': (1, 'KB/s', True)}, history, 0.2, False)
+    # latencies within the noise are not regressions.
+    assert not bench.report('latency', target, {'ls': (1.0, 'ms', False)}, history, 0.2, True)
+    assert not bench.report('latency', target, {'ls': (2.5, 'ms', False)}, history, 0.2, False)
+    with open(history) as f:
+        assert len(f.readlines()) == 4
+
+
+def test_benchmarks_on_the_simulated_device(tmp_path):
+    history = str(tmp_path / 'history.jsonl')
+    runner = CliRunner()
+    result = runner.invoke(bench.cli, ['throughput', '--sizes', '4K', '--files', '2', '--runs', '1', '--history', history])
+    assert result.exit_code == 0, result.output
+    assert 'recvfile 4K' in result.output
+    result = runner.invoke(bench.cli, ['latency', '--runs', '1', '--history', history])
+    assert result.exit_code == 0, result.output
+    with open(history) as f:
+        assert [json.loads(line)['benchmark'] for line in f] == ['throughput', 'latency']
@@ -0,0 +1,56 @@
+import os
+
+from src import S_IFDIR, S_IFREG
+
+
+def count_executions(tool, monkeypatch):
+    scripts = []
+    execute = tool.execute
+    monkeypatch.setattr(tool, 'execute', lambda cmd: scripts.append(cmd) or execute(cmd))
+    return scripts
+
+
+def test_listings_are_cached(tool, flash, monkeypatch):
+    with open(os.path.join(flash, 'a.txt'), 'w') as f:
+        f.write('abc')
+    with tool.session():
+        assert tool.stat('a.txt') == (S_IFREG, 3)
+        scripts = count_executions(tool, monkeypatch)
+        assert tool.stat('a.txt') == (S_IFREG, 3)
+        assert tool.stat('missing.txt') is None
+        assert ('a.txt', S_IFREG, 3) in tool.listdir()
+        assert scripts == []
+        # a change made behind the back of the tool shows once the listing is refreshed.
+        os.remove(os.path.join(flash, 'a.txt'))
+        assert tool.stat('a.txt') == (S_IFREG, 3)
+        assert ('a.txt', S_IFREG, 3) not in tool.listdir(refresh=True)
+        assert len(scripts) == 1
+
+
+def test_listings_expire(tool, flash, monkeypatch):
+    tool.cache_ttl = 0
+    with tool.session():
+        tool.listdir()
+        scripts = count_executions(tool, monkeypatch)
+        tool.listdir()
+        assert len(scripts) == 1
+
+
+def test_the_cache_follows_the_changes_of_the_tool(tool, flash, monkeypatch):
+    with tool.session():
+        tool.listdir()
+        tool.mkdir('lib')
+        tool.sendfile(__file__, 'lib/test.py')
+        scripts = count_executions(tool, monkeypatch)
+        assert tool.stat('lib') == (S_IFDIR, 0)
+        assert tool.stat('lib/test.py')[0] == S_IFREG
+        assert scripts == []
+        tool.rmfile('lib/test.py')
+        assert tool.stat('lib/test.py') is None
+        assert not os.path.exists(os.path.join(flash, 'lib', 'test.py'))
+
+
+def test_the_cache_is_discarded_with_the_session(tool, flash):
+    with tool.session():
+        tool.listdir()
+    assert tool.listings == {}
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from src import analyze_capture, format_analysis, read_capture
+
+
+@pytest.fixture
+def capture(tool, tmp_path):
+    """A capture of the upload of a file, from the connection to the device onwards."""
+    path = str(tmp_path / 'send.cap')
+    (tmp_path / 'data.bin').write_bytes(os.urandom(5000))
+    tool.start_capture(path, 'send-file')
+    tool.sendfile(str(tmp_path / 'data.bin'), 'data.bin', compress=False)
+    tool.stop_capture()
+    return path
+
+
+def test_capture_records_the_traffic(tool, capture):
+    meta, records = read_capture(capture)
+    assert meta['port'] == tool.port and meta['command'] == 'send-file'
+    assert {kind for kind, _, _, _ in records} == {b'B', b'E', b'W', b'R', b'P'}
+    written = sum(len(data) for kind, _, _, data in records if kind == b'W')
+    assert written == tool.metrics.bytes_written
+
+
+def test_analyze_capture(capture):
+    analysis = analyze_capture(capture, gap=0.001)
+    assert analysis['meta']['command'] == 'send-file'
+    assert {'connect', 'upload', 'transfer'} <= {entry['phase'] for entry in analysis['timeline']}
+    assert analysis['bytes']['payload'] == 5000
+    assert analysis['bytes']['overhead'] == analysis['bytes']['written'] + analysis['bytes']['read'] - 5000
+    assert analysis['stalls']['transfer ack']['count'] > 0
+    report = format_analysis(analysis, top=3)
+    assert report.startswith('Capture of [send-file]')
+
+
+def test_a_truncated_capture_is_read_up_to_the_cut(capture):
+    with open(capture, 'rb') as f:
+        data = f.read()
+    with open(capture, 'wb') as f:
+        f.write(data[:-3])
+    _, records = read_capture(capture)
+    assert records and analyze_capture(capture)['seconds'] > 0
+
+
+def test_not_a_capture(tmp_path):
+    (tmp_path / 'x.cap').write_bytes(b'hello\n')
+    with pytest.raises(RuntimeError, match='not a srltool capture'):
+        read_capture(str(tmp_path / 'x.cap'))
+
+
+def test_analyze_command(srltool, tmp_path):
+    assert srltool('--capture', 'ls.cap', 'ls').returncode == 0
+    result = srltool('analyze', 'ls.cap')
+    assert result.returncode == 0 and result.stdout.startswith('Capture of [ls]')
@@ -0,0 +1,10 @@
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def test_startup_does_not_import_matplotlib():
+    code = "import sys, cli\nsys.argv[1:] = ['ls', '--help']\ntry:\n    cli.main()\nexcept SystemExit:\n    pass\nprint('matplotlib' in sys.modules)"
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    assert out.splitlines()[-1] == 'False'
@@ -0,0 +1,58 @@
+import os
+import signal
+import subprocess
+import sys
+
+import pytest
+
+import cli
+
+
+@pytest.fixture
+def daemon(cli_env, tmp_path):
+    process = subprocess.Popen([sys.executable, '-c', 'import cli; cli.main()', 'daemon'], env=cli_env, cwd=tmp_path,
+                               stdout=subprocess.PIPE, text=True)
+    for line in process.stdout:
+        if line.startswith('Listening on'):
+            break
+    yield process
+    process.send_signal(signal.SIGINT)
+    process.wait(10)
+    process.stdout.close()
+
+
+def test_subcommand():
+    assert cli.subcommand(['ls']) == 'ls'
+    assert cli.subcommand(['--port', '/dev/ttyACM0', '--soft-reset', 'recv-file', 'a.py']) == 'recv-file'
+    assert cli.subcommand(['-p', 'ls', 'tree']) == 'tree'
+    assert cli.subcommand(['--timeout', '5']) is None
+    assert cli.subcommand(['--help']) is None
+    assert cli.subcommand(['fleet', 'stats']) == 'fleet'
+
+
+def test_forward_without_a_daemon(monkeypatch, tmp_path):
+    monkeypatch.setattr(cli, 'SOCKET_PATH', str(tmp_path / 'srltool.sock'))
+    assert cli.forward(['ls']) is None
+
+
+def test_daemon_serves_the_commands(daemon, srltool, flash, cli_env, tmp_path):
+    with open(os.path.join(flash, 'main.py'), 'w') as f:
+        f.write('print(1)\n')
+    result = srltool('ls')
+    assert result.returncode == 0 and 'main.py' in result.stdout
+    assert 'Connection with the [device] established' not in result.stdout
+    result = srltool('recv-file', 'main.py', 'copy.py')
+    assert result.returncode == 0
+    assert (tmp_path / 'copy.py').read_text() == 'print(1)\n'
+    result = srltool('--port', '/dev/elsewhere', 'ls')
+    assert result.returncode == 2 and 'The daemon is connected to' in result.stdout
+    result = srltool('bogus')
+    assert result.returncode == 2 and 'No such command' in result.stdout
+    result = srltool('daemon')
+    assert result.returncode == 1 and 'already listening' in result.stderr
+
+
+def test_the_daemon_removes_its_socket(daemon, cli_env):
+    daemon.send_signal(signal.SIGINT)
+    daemon.wait(10)
+    assert not os.path.exists(cli_env['SRLTOOL_SOCKET'])
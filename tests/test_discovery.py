@@ -0,0 +1,67 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import src
+from src import SerialTool
+
+
+def port(device, serial_number='A1', vid=0xf055, pid=0x9800):
+    return SimpleNamespace(device=device, serial_number=serial_number, vid=vid, pid=pid)
+
+
+class Ports(list):
+    """The ports listed by the enumeration, and the number of times it ran."""
+    calls = 0
+
+
+@pytest.fixture
+def comports(monkeypatch):
+    ports = Ports()
+
+    def enumerate():
+        ports.calls += 1
+        return list(ports)
+    monkeypatch.setattr(src.lp, 'comports', enumerate)
+    monkeypatch.setattr(src, 'identify_port', lambda device: next((p for p in ports if p.device == device), None))
+    return ports
+
+
+def test_the_connection_is_lazy(comports):
+    tool = SerialTool()
+    assert tool.connection is None and comports.calls == 0
+
+
+def test_discovery_caches_the_port(device, comports):
+    comports.extend([port('/dev/ttyS0', vid=0x1234), port(device.port)])
+    tool = SerialTool(timeout=10)
+    try:
+        assert tool.run('print(1 + 1)').strip() == '2'
+        assert tool.port == device.port
+    finally:
+        tool.close()
+    with open(src.PORT_CACHE) as f:
+        assert json.load(f) == {'port': device.port, 'serial_number': 'A1'}
+    # the cached port is checked on its own rather than enumerating the ports again.
+    comports.calls = 0
+    assert SerialTool().discover() == (device.port, 'MicroPython')
+    assert comports.calls == 0
+
+
+def test_the_cached_port_is_checked(comports):
+    comports.append(port('/dev/ttyACM0', 'A1'))
+    SerialTool().discover()
+    comports[:] = [port('/dev/ttyACM0', 'B2', 0x0483, 0x5740)]
+    assert SerialTool(serial_number='B2').discover() == ('/dev/ttyACM0', 'STM32')
+    with pytest.raises(SystemExit, match='No MicroPython/STM32 device'):
+        SerialTool(serial_number='A1').discover()
+
+
+def test_discovery_does_not_guess(comports):
+    with pytest.raises(SystemExit, match='No MicroPython/STM32 device'):
+        SerialTool().discover()
+    comports.extend([port('/dev/ttyACM0', 'A1'), port('/dev/ttyACM1', 'B2')])
+    with pytest.raises(SystemExit, match='--port or --serial-number'):
+        SerialTool().discover()
+    assert SerialTool(serial_number='B2').discover() == ('/dev/ttyACM1', 'MicroPython')
@@ -0,0 +1,35 @@
+import pytest
+
+from src import SerialTool
+
+# longer than a few raw-paste windows (128 bytes on the simulated device), so that the flow control is exercised.
+SCRIPT = ''.join(f'x{i} = {i}\n' for i in range(100)) + "print(sum(v for k, v in globals().items() if k.startswith('x')))\n"
+
+
+def test_raw_paste(tool):
+    assert tool.run(SCRIPT).strip() == str(sum(range(100)))
+    assert tool.use_raw_paste
+
+
+def test_without_raw_paste(make_device):
+    tool = SerialTool(port=make_device(raw_paste=False).port, timeout=10)
+    try:
+        assert tool.run(SCRIPT).strip() == str(sum(range(100)))
+        assert not tool.use_raw_paste
+        assert tool.run('print(1 + 1)').strip() == '2'
+    finally:
+        tool.close()
+
+
+def test_interrupted_raw_paste(tool, monkeypatch):
+    write = tool.write
+
+    def interrupted(data):
+        if b'x50 = 50' in data:
+            raise KeyboardInterrupt
+        return write(data)
+    monkeypatch.setattr(tool, 'write', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        tool.run(SCRIPT)
+    monkeypatch.setattr(tool, 'write', write)
+    assert tool.run('print(1 + 1)').strip() == '2'
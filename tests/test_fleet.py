@@ -0,0 +1,36 @@
+import os
+
+import src
+from src import DeviceError, run_fleet
+
+
+def test_run_fleet(make_device):
+    devices = [make_device(latency=0.001) for _ in range(3)]
+    results = run_fleet(lambda tool: tool.run('import os\nprint(len(os.listdir()))').strip(), [d.port for d in devices], jobs=2)
+    assert [(port, result, error) for port, result, error, _, _ in results] == [(d.port, '0', None) for d in devices]
+    assert all(output.splitlines()[-1] == '0' for _, _, _, output, _ in results)
+
+
+def test_run_fleet_reports_each_failure(make_device):
+    good, bad = make_device(), make_device(readonly=True)
+    results = run_fleet(lambda tool: tool.run("open('x', 'w')"), [good.port, bad.port])
+    assert results[0][2] is None
+    assert isinstance(results[1][2], DeviceError) and 'EROFS' in str(results[1][2])
+    assert os.path.exists(os.path.join(good.root, 'flash', 'x'))
+
+
+def test_run_fleet_uses_the_discovered_devices(make_device, monkeypatch):
+    device = make_device()
+    monkeypatch.setattr(src, 'find_devices', lambda: [type('Port', (), {'device': device.port})])
+    assert [result for _, result, _, _, _ in run_fleet(lambda tool: tool.exec_reply('reply(1)'))] == [1]
+
+
+def test_fleet_command(make_device, srltool):
+    devices = [make_device() for _ in range(2)]
+    result = srltool('fleet', '--ports', ','.join(d.port for d in devices), 'exec', '-c', 'print(6 * 7)')
+    assert result.returncode == 0
+    assert result.stdout.count('    42') == 2
+    assert '2 device(s): 2 ok, 0 failed' in result.stdout
+    result = srltool('fleet', '--ports', devices[0].port, 'exec', '-c', '1 / 0')
+    assert result.returncode == 1
+    assert f'{devices[0].port}: ZeroDivisionError' in result.stdout
@@ -0,0 +1,139 @@
+import os
+
+import pytest
+
+import src
+from src import MIN_FRAME, FrameSizer, SerialTool
+
+DATA = os.urandom(400_000)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(src, 'monotonic', clock)
+    return clock
+
+
+def run(sizer, clock, rate, frames=8):
+    """Sends [frames] frames at [rate] bytes/s through [sizer]."""
+    for _ in range(frames):
+        clock.now += sizer.size / rate
+        sizer.sent(sizer.size)
+
+
+def test_the_frames_grow_while_the_throughput_does(clock):
+    sizer = FrameSizer(512, 4096, 0.1)
+    run(sizer, clock, 10_000)
+    assert sizer.size == 1024 and sizer.growing
+    run(sizer, clock, 20_000)
+    assert sizer.size == 2048 and sizer.growing
+    # no better: it settles on the size before.
+    run(sizer, clock, 20_000)
+    assert sizer.size == 2048 and not sizer.growing
+    run(sizer, clock, 5_000)
+    assert sizer.size == 2048
+
+
+def test_the_frames_go_back_when_the_throughput_drops(clock):
+    sizer = FrameSizer(512, 4096, 0.1)
+    run(sizer, clock, 10_000)
+    run(sizer, clock, 8_000)
+    assert sizer.size == 512 and not sizer.growing
+
+
+def test_the_frames_stop_at_the_limit(clock):
+    sizer = FrameSizer(8192, 4096, 0.1)
+    assert sizer.size == 4096 and not sizer.growing
+    sizer = FrameSizer(512, 1024, 0.1)
+    run(sizer, clock, 10_000)
+    run(sizer, clock, 50_000)
+    assert sizer.size == 1024 and not sizer.growing
+
+
+def test_a_period_needs_8_frames_and_period_seconds(clock):
+    sizer = FrameSizer(512, 4096, 1.0)
+    run(sizer, clock, 10_000, frames=7)
+    assert sizer.size == 512
+    run(sizer, clock, 1_000_000, frames=20)
+    assert sizer.size == 512
+    clock.now += 1
+    sizer.sent(512)
+    assert sizer.size == 1024
+
+
+def test_shrink(clock):
+    sizer = FrameSizer(512, 4096, 0.1)
+    sizer.shrink()
+    assert sizer.size == sizer.limit == 256 and not sizer.growing
+    run(sizer, clock, 1_000_000)
+    assert sizer.size == 256
+    for _ in range(10):
+        sizer.shrink()
+    assert sizer.size == MIN_FRAME
+
+
+def record_sizes(monkeypatch):
+    sizes = []
+    sent = FrameSizer.sent
+
+    def recorded(self, n):
+        sent(self, n)
+        sizes.append(self.size)
+    monkeypatch.setattr(FrameSizer, 'sent', recorded)
+    return sizes
+
+
+@pytest.fixture
+def local(tmp_path):
+    path = tmp_path / 'big.bin'
+    path.write_bytes(DATA)
+    return str(path)
+
+
+def test_the_frames_grow_on_a_slow_link(make_device, local, tmp_path, monkeypatch):
+    device = make_device(latency=0.002, heap=1024 * 1024)
+    tool = SerialTool(port=device.port, timeout=10)
+    sizes = record_sizes(monkeypatch)
+    try:
+        tool.sendfile(local, 'big.bin', forced=True)
+        assert max(sizes) > sizes[0]
+        tool.recvfile('big.bin', str(tmp_path / 'copy.bin'), compress=False)
+    finally:
+        tool.close()
+    with open(os.path.join(device.root, 'flash', 'big.bin'), 'rb') as f:
+        assert f.read() == DATA
+    assert (tmp_path / 'copy.bin').read_bytes() == DATA
+
+
+def test_the_frames_shrink_when_the_device_runs_low_on_memory(make_device, local, tmp_path, monkeypatch):
+    device = make_device(heap=64 * 1024)
+    tool = SerialTool(port=device.port, timeout=10)
+    sizes = record_sizes(monkeypatch)
+    write = SerialTool.write
+    writes = [0]
+
+    def squeezed(self, data):
+        writes[0] += 1
+        if writes[0] == 40:
+            device.heap = 2048
+        return write(self, data)
+    monkeypatch.setattr(SerialTool, 'write', squeezed)
+    try:
+        tool.sendfile(local, 'big.bin', forced=True)
+        assert sizes[-1] < max(sizes)
+        monkeypatch.setattr(SerialTool, 'write', write)
+        tool.recvfile('big.bin', str(tmp_path / 'copy.bin'), compress=False)
+    finally:
+        tool.close()
+    with open(os.path.join(device.root, 'flash', 'big.bin'), 'rb') as f:
+        assert f.read() == DATA
+    assert (tmp_path / 'copy.bin').read_bytes() == DATA
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from src import diff_heap, format_heap, format_heap_diff, parse_heap
+
+DUMP = """stack: 2124 out of 15360\r
+GC: total: 102400, used: 7776, free: 94624\r
+ No. of 1-blocks: 95, 2-blocks: 17, max blk sz: 40, max free sz: 5862\r
+GC memory layout; from 20003e40:\r
+00000: h=ShhBMh=DhDBDDBB=Bh===========h=============================\r
+00400: ======================h====h==========================hhh=T=h.\r
+00800: ..h=....S...............................................h=====\r
+       (87 lines all free)\r
+16c00: ....\r
+"""
+
+
+def heap_of(*rows: str) -> dict:
+    """parse_heap() of a heap of 16-byte blocks laid out in [rows] of 64 blocks."""
+    lines = [f'{i * 0x400:05x}: {row}' for i, row in enumerate(rows)]
+    free = sum(row.count('.') for row in rows) * 16
+    return parse_heap(f'GC: total: {len(rows) * 1024}, used: {len(rows) * 1024 - free}, free: {free}\n'
+                      'GC memory layout; from 3ffe0000:\n' + '\n'.join(lines) + '\n')
+
+
+def test_parse_heap():
+    heap = parse_heap(DUMP)
+    assert (heap['total'], heap['used'], heap['free'], heap['block_size']) == (102400, 7776, 94624, 16)
+    # the folded lines count as free, and runs carry over from one line to the next.
+    assert heap['largest_free'] == (87 * 64 + 4) * 16
+    assert heap['fragmentation'] == pytest.approx(1 - heap['largest_free'] / 94624)
+    assert (heap['free_runs'], heap['allocations']) == (4, 28)
+    assert heap['free_histogram'] == {64: 2, 1024: 1, 131072: 1}
+    assert sum(heap['allocation_histogram'].values()) == 28
+
+
+def test_parse_heap_without_a_block_map():
+    heap = parse_heap('GC: total: 1000, used: 200, free: 800\n max free sz: 20\n')
+    assert heap['largest_free'] == 320 and heap['fragmentation'] == pytest.approx(0.6)
+    assert heap['map'] == '' and heap['free_histogram'] == heap['allocation_histogram'] == {}
+    with pytest.raises(RuntimeError):
+        parse_heap('stack: 2124 out of 15360\n')
+
+
+def test_parse_heap_of_several_areas():
+    text = ('GC: total: 2048, used: 32, free: 2016\n'
+            'GC memory layout; from 3ffe0000:\n00000: h=' + '.' * 62 + '\n'
+            'GC memory layout; from 3fff0000:\n00000: ' + '.' * 64 + '\n')
+    heap = parse_heap(text)
+    assert heap['free_runs'] == 2 and heap['largest_free'] == 64 * 16
+
+
+def test_diff_heap():
+    before = heap_of('h=' + '.' * 62)
+    after = heap_of('h=' + 'h===' + '.' * 10 + 'B=' + '.' * 46)
+    diff = diff_heap(before, after)
+    assert diff['used'] == 96 and diff['free'] == -96
+    assert diff['allocations'] == 2 and diff['free_runs'] == 1
+    assert (diff['new_allocations'], diff['new_allocation_bytes']) == (2, 96)
+    assert diff['allocation_histogram'] == {32: 1, 64: 1}
+    assert diff_heap(after, after)['new_allocations'] == 0
+    report = format_heap_diff(before, after, diff)
+    assert '2 new allocations holding 96 bytes' in report and 'used' in report
+
+
+def test_format_heap():
+    report = format_heap(parse_heap(DUMP))
+    assert report.startswith('Heap: 102400 bytes in blocks of 16; 7776 used, 94624 free.')
+    assert f"Largest free block: {(87 * 64 + 4) * 16} bytes" in report
+    assert '<= 131072' in report
+
+
+def test_heap_of_the_device(tool):
+    heap = tool.heap()
+    assert heap['total'] > 0
+    assert heap['used'] + heap['free'] == heap['total'] and heap['map']
+
+
+def test_heap_diff(tool):
+    result = tool.heap_diff("keep = [bytearray(100) for i in range(10)]\nprint('done')\n")
+    assert result['output'].strip() == 'done' and not result['error']
+    assert set(result['diff']) >= {'used', 'free', 'new_allocations'}
+    result = tool.heap_diff("raise ValueError('x')")
+    assert 'ValueError: x' in result['error']
+    assert tool.run('print(8)').strip() == '8'
+
+
+def test_memstat_detailed(srltool, tmp_path, device):
+    result = srltool('memstat', '--detailed', '--json')
+    assert result.returncode == 0
+    heap = json.loads(result.stdout[result.stdout.index('{'):])
+    assert heap['used'] + heap['free'] == heap['total']
+    (tmp_path / 'leak.py').write_text("keep = [bytearray(100) for i in range(10)]\nprint('done')\n")
+    result = srltool('memstat', '--run', 'leak.py')
+    assert result.returncode == 0
+    assert 'done' in result.stdout and 'Before:' in result.stdout and 'Change:' in result.stdout
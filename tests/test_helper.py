@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from src import HELPER_PATH, HELPER_VERSION, SerialTool, is_helper
+
+
+def count_executions(tool, monkeypatch):
+    scripts = []
+    execute = tool.execute
+    monkeypatch.setattr(tool, 'execute', lambda cmd: scripts.append(cmd) or execute(cmd))
+    return scripts
+
+
+@pytest.fixture
+def helper(flash):
+    return os.path.join(flash, os.path.basename(HELPER_PATH))
+
+
+def test_the_helper_is_installed_once(tool, device, helper, monkeypatch):
+    scripts = count_executions(tool, monkeypatch)
+    tool.listdir()
+    assert tool.helper and os.path.exists(helper)
+    # the failed call, the installation and the call again.
+    assert len(scripts) == 3
+    del scripts[:]
+    tool.memstat()
+    assert len(scripts) == 1
+    # another tool (another srltool process) finds it in place.
+    other = SerialTool(port=device.port, timeout=10)
+    try:
+        scripts = count_executions(other, monkeypatch)
+        other.listdir()
+        assert len(scripts) == 1
+    finally:
+        other.close()
+
+
+def test_an_outdated_helper_is_replaced(tool, device, helper, monkeypatch):
+    tool.listdir()
+    with open(helper) as f:
+        source = f.read()
+    with open(helper, 'w') as f:
+        f.write(source.replace(f'VERSION = {HELPER_VERSION}', 'VERSION = 0'))
+    # the board keeps the imported module until a soft reset.
+    device.shims['sys'].modules.pop('_srl', None)
+    other = SerialTool(port=device.port, timeout=10)
+    try:
+        scripts = count_executions(other, monkeypatch)
+        assert other.stat('missing') is None
+        assert len(scripts) == 3
+    finally:
+        other.close()
+    with open(helper) as f:
+        assert f'VERSION = {HELPER_VERSION}' in f.read()
+
+
+def test_without_a_writable_filesystem(make_device, monkeypatch):
+    device = make_device(readonly=True)
+    tool = SerialTool(port=device.port, timeout=10)
+    try:
+        scripts = count_executions(tool, monkeypatch)
+        assert tool.listdir() == []
+        assert tool.helper is False
+        del scripts[:]
+        tool.listdir(refresh=True)
+        assert len(scripts) == 1
+    finally:
+        tool.close()
+
+
+def test_the_helper_is_kept_out_of_sight(tool, flash, tmp_path, capsys):
+    (tmp_path / 'app').mkdir()
+    (tmp_path / 'app' / 'main.py').write_text('print(1)\n')
+    tool.sync(str(tmp_path / 'app'), '/flash', delete=True)
+    assert os.path.exists(os.path.join(flash, '_srl.py'))
+    capsys.readouterr()
+    tool.ls()
+    tool.tree()
+    tool.du(all=True)
+    assert '_srl' not in capsys.readouterr().out
+    assert is_helper('_srl.py') and is_helper('/flash/_srl.py') and is_helper('./_srl.py')
+    assert not is_helper('lib/_srl.py')
@@ -0,0 +1,93 @@
+import os
+import random
+import types
+
+import pytest
+
+import sim
+import src
+from src import skipped_checks
+
+DATA = os.urandom(100_000)
+TEXT = b''.join(b'line %d of compressible text\n' % i for i in range(6000))
+
+
+@pytest.fixture
+def files(tmp_path):
+    for name, content in (('big.bin', DATA), ('text.txt', TEXT)):
+        (tmp_path / name).write_bytes(content)
+    return tmp_path
+
+
+def corrupting(write, rate=0.1):
+    """Wraps [write] to flip a bit in the middle of about 1 in 10 of the frames it is given, counting them."""
+    rng = random.Random(1)
+
+    def noisy(self, data):
+        if len(data) > 400 and rng.random() < rate:
+            data = bytearray(data)
+            data[len(data) // 2] ^= 0x40
+            noisy.hits += 1
+        return write(self, bytes(data))
+    noisy.hits = 0
+    return noisy
+
+
+@pytest.mark.parametrize('encoding, compress', [('raw', False), ('base64', False), ('raw', True)])
+def test_corrupted_uploads_are_resent(tool, flash, files, monkeypatch, encoding, compress):
+    noisy = corrupting(src.SerialTool.write)
+    monkeypatch.setattr(src.SerialTool, 'write', noisy)
+    for name in ('big.bin', 'text.txt'):
+        tool.sendfile(str(files / name), name, forced=True, encoding=encoding, compress=compress, BUFFER_SIZE=512)
+        with open(os.path.join(flash, name), 'rb') as f:
+            assert f.read() == (files / name).read_bytes()
+    assert noisy.hits
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_corrupted_downloads_are_resent(tool, flash, files, monkeypatch, compress):
+    for name in ('big.bin', 'text.txt'):
+        with open(os.path.join(flash, name), 'wb') as f:
+            f.write((files / name).read_bytes())
+    noisy = corrupting(sim.Device.write)
+    monkeypatch.setattr(sim.Device, 'write', noisy)
+    for name in ('big.bin', 'text.txt'):
+        tool.recvfile(name, str(files / ('copy_' + name)), compress=compress, BUFFER_SIZE=512)
+        assert (files / ('copy_' + name)).read_bytes() == (files / name).read_bytes()
+    assert noisy.hits
+
+
+@pytest.mark.parametrize('missing', [('crc32',), ('sha256',), ('crc32', 'sha256')])
+def test_transfers_without_crc32_or_sha256(make_device, tmp_path, capsys, missing):
+    tree = tmp_path / 'tree'
+    (tree / 'sub').mkdir(parents=True)
+    for i in range(3):
+        (tree / 'sub' / f'f{i}.bin').write_bytes(os.urandom(3000))
+    device = make_device()
+    device.shims = device._modules()
+    if 'crc32' in missing:
+        del device.shims['binascii'].crc32
+    if 'sha256' in missing:
+        for name in ('hashlib', 'uhashlib'):
+            device.shims[name] = types.ModuleType(name)
+    tool = src.SerialTool(port=device.port, timeout=10)
+    try:
+        tool.senddir(str(tree), '/flash/tree')
+        tool.recvfile('/flash/tree', str(tmp_path / 'back'), check_exist=False)
+    finally:
+        tool.close()
+    for i in range(3):
+        assert (tmp_path / 'back' / 'sub' / f'f{i}.bin').read_bytes() == (tree / 'sub' / f'f{i}.bin').read_bytes()
+    out = capsys.readouterr().out
+    skipped = skipped_checks('crc32' not in missing, 'sha256' not in missing)
+    totals = [line for line in out.splitlines() if line.startswith(('5 entries', '3 files'))]
+    assert len(totals) == 2 and all(line.endswith(f'; {skipped} not checked)') for line in totals)
+    assert ('the frames are written unchecked' in out) == ('the frames are received unchecked' in out) == ('crc32' in missing)
+    assert ('the files written are not verified' in out) == ('the files received are not verified' in out) == ('sha256' in missing)
+
+
+def test_skipped_checks():
+    assert skipped_checks(True, True) == ''
+    assert skipped_checks(False, True) == 'CRC32'
+    assert skipped_checks(True, False) == 'sha256'
+    assert skipped_checks(False, False) == 'CRC32 and sha256'
@@ -0,0 +1,35 @@
+import json
+import os
+
+
+def test_metrics_of_a_transfer(tool, tmp_path):
+    (tmp_path / 'data.bin').write_bytes(os.urandom(10000))
+    tool.metrics.reset()
+    tool.sendfile(str(tmp_path / 'data.bin'), 'data.bin', compress=False)
+    metrics = tool.metrics.as_dict()
+    assert {'connect', 'raw_repl', 'upload', 'execution', 'transfer', 'other'} <= set(metrics['phases'])
+    assert metrics['payload_bytes'] == 10000
+    assert metrics['bytes_written'] > 10000 and metrics['bytes_read'] > 0
+    total = sum(phase['seconds'] for phase in metrics['phases'].values())
+    assert abs(total - metrics['wall_seconds']) < 0.01
+    assert tool.metrics.summary('send-file').startswith('Stats for [send-file] in ')
+
+
+def test_prometheus(tool, tmp_path):
+    tool.run('print(1)')
+    path = str(tmp_path / 'srltool.prom')
+    tool.metrics.write_prometheus(path, 'exec')
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert 'srltool_phase_seconds{command="exec",phase="execution"}' in [line.split(' ')[0] for line in lines]
+    assert any(line.startswith('srltool_bytes_written{command="exec"} ') for line in lines)
+    assert not os.path.exists(path + '.tmp')
+
+
+def test_stats_options(srltool, flash, tmp_path):
+    result = srltool('--stats', '--stats-json', 'stats.json', 'ls')
+    assert result.returncode == 0
+    assert 'Stats for [ls]' in result.stdout
+    with open(tmp_path / 'stats.json') as f:
+        stats = json.load(f)
+    assert stats['command'] == 'ls' and stats['bytes_read'] > 0
@@ -0,0 +1,98 @@
+import _thread
+import csv
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from cli import ClientStream
+from src import TELEMETRY_HEADER, TELEMETRY_MAGIC, TELEMETRY_RECORD, Telemetry
+
+
+def test_samples(tool, tmp_path):
+    csv_path, mmap_path = tmp_path / 'm.csv', tmp_path / 'm.map'
+    telemetry = tool.monitor(rate=200, duration=1.0, history=100, csv_path=str(csv_path), mmap_path=str(mmap_path))
+    assert telemetry.count > 100 and len(telemetry.samples) == 100
+    assert 100 < telemetry.rate < 300
+    with open(csv_path, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['t', 'free', 'alloc', 'flash_free'] and len(rows) == telemetry.count + 1
+    data = mmap_path.read_bytes()
+    magic, size, written = TELEMETRY_HEADER.unpack_from(data)
+    assert (magic, size, written) == (TELEMETRY_MAGIC, 100, telemetry.count)
+    last = TELEMETRY_RECORD.unpack_from(data, TELEMETRY_HEADER.size + (written - 1) % size * TELEMETRY_RECORD.size)
+    assert last[1:] == telemetry.samples[-1][1:]
+    assert tool.monitor(rate=50, samples=20).count == 20
+    assert tool.run('print(5)').strip() == '5'
+
+
+def test_the_slope_of_a_leak(tool, device):
+    def leak():
+        for _ in range(10):
+            time.sleep(0.1)
+            device.heap -= 1000
+    threading.Thread(target=leak).start()
+    free = tool.monitor(rate=100, duration=1.2).stats()['free']
+    # the monitor starts a little after the leak does.
+    assert free['max'] - free['min'] >= 3000
+    assert free['slope'] < -1000
+
+
+def test_ctrl_c_stops_the_monitor(tool, capsys):
+    threading.Timer(1.0, _thread.interrupt_main).start()
+    telemetry = tool.monitor(rate=500)
+    assert telemetry.count > 100
+    assert f'{telemetry.count} samples in' in capsys.readouterr().out
+    assert tool.run('print(6)').strip() == '6'
+
+
+def test_telemetry():
+    telemetry = Telemetry(4)
+    assert telemetry.stats() == {} and telemetry.rate == 0.0
+    for i in range(6):
+        telemetry.add(i * 0.5, 1000 - 100 * i, 100 * i, 5000)
+    assert telemetry.count == 6 and len(telemetry.samples) == 4
+    assert telemetry.rate == pytest.approx(2.0)
+    stats = telemetry.stats()
+    assert stats['free'] == {'last': 500, 'min': 500, 'max': 800, 'slope': pytest.approx(-200)}
+    assert stats['flash_free']['slope'] == 0
+    assert telemetry.status().startswith('6 samples at 2.0 Hz; free 500 (-200 B/s)')
+
+
+def test_the_monitor_stops_when_the_client_has_gone(tool, monkeypatch):
+    ours, theirs = socket.socketpair()
+    monkeypatch.setattr(tool, 'output', ClientStream(ours))
+    threading.Timer(1.0, theirs.close).start()
+    start = time.monotonic()
+    telemetry = tool.monitor(rate=100)
+    assert time.monotonic() - start < 5 and telemetry.count > 0
+    ours.close()
+    monkeypatch.undo()
+    assert tool.run('print(9)').strip() == '9'
+
+
+def test_a_killed_monitor_client_does_not_wedge_the_daemon(flash, cli_env, srltool, tmp_path):
+    with open(os.path.join(flash, 'main.py'), 'w') as f:
+        f.write('print(1)\n')
+    daemon = subprocess.Popen([sys.executable, '-c', 'import cli; cli.main()', 'daemon'], env=cli_env, cwd=tmp_path,
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        for line in daemon.stdout:
+            if line.startswith('Listening on'):
+                break
+        client = subprocess.Popen([sys.executable, '-c', 'import cli; cli.main()', 'monitor'], env=cli_env, cwd=tmp_path,
+                                  stdout=subprocess.DEVNULL)
+        time.sleep(1.5)
+        client.kill()
+        client.wait()
+        result = srltool('ls', timeout=20)
+        assert result.returncode == 0 and 'main.py' in result.stdout
+    finally:
+        daemon.send_signal(signal.SIGINT)
+        daemon.wait(10)
+        daemon.stdout.close()
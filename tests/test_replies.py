@@ -0,0 +1,43 @@
+import asyncio
+from textwrap import dedent
+
+import pytest
+
+from aio import AsyncSerialTool
+from src import DeviceError
+
+# print()s whose text starts like a reply frame ('J'/'I' followed by four bytes) around the replies.
+MIXED = dedent("""
+    print('Just an Info line')
+    reply([1, 2])
+    print('Ints: I', 12345)
+    reply_ints([3, -4])
+    print('JJJJ IIII')
+    reply({'done': True})
+    """)
+
+
+def test_replies_mixed_with_prints(tool):
+    assert list(tool.exec_replies(MIXED)) == [[1, 2], [3, -4], {'done': True}]
+    assert tool.exec_reply("print('Just an Info line')\nreply([1,2])") == [1, 2]
+
+
+def test_replies_are_data(tool):
+    assert tool.exec_reply("reply(\"__import__('os').remove('main.py')\")") == "__import__('os').remove('main.py')"
+    assert tool.exec_reply("print('no reply')") is None
+    big = list(range(20000))
+    assert tool.exec_reply('reply_ints(list(range(20000)))') == big
+    assert tool.exec_reply("reply({'a': [1.5, None, 'x' * 1000]})") == {'a': [1.5, None, 'x' * 1000]}
+
+
+def test_failed_command(tool):
+    with pytest.raises(DeviceError, match='ZeroDivisionError'):
+        tool.exec_reply('reply([1])\n1 / 0')
+    assert tool.exec_reply('reply([2])') == [2]
+
+
+def test_async_replies_mixed_with_prints(device):
+    async def main():
+        async with AsyncSerialTool(device.port, timeout=10) as tool:
+            return [reply async for reply in tool.exec_replies(MIXED)]
+    assert asyncio.run(main()) == [[1, 2], [3, -4], {'done': True}]
@@ -0,0 +1,129 @@
+import os
+import time
+
+import pytest
+
+import src
+from src import read_journal, write_journal
+
+DATA = os.urandom(300_000)
+
+
+@pytest.fixture
+def local(tmp_path):
+    path = tmp_path / 'big.bin'
+    path.write_bytes(DATA)
+    return str(path)
+
+
+def interrupt(monkeypatch, tool, method, after):
+    """Raises KeyboardInterrupt on the [after]th call of tool.[method], as a Ctrl-C in the middle of a transfer would."""
+    original = getattr(tool, method)
+    calls = [0]
+
+    def interrupted(*args):
+        calls[0] += 1
+        if calls[0] == after:
+            raise KeyboardInterrupt
+        return original(*args)
+    monkeypatch.setattr(tool, method, interrupted)
+    return lambda: monkeypatch.setattr(tool, method, original)
+
+
+def wait_for_ctrl_c(device, seconds=5):
+    """Waits for the device to enable Ctrl-C again, as it does once its transfer loop has stopped."""
+    end = time.monotonic() + seconds
+    while device._intr != 3 and time.monotonic() < end:
+        time.sleep(0.05)
+    return device._intr == 3
+
+
+def test_resume_an_upload(tool, device, flash, local, monkeypatch, capsys):
+    with tool.session():
+        tool.listdir()
+        restore = interrupt(monkeypatch, tool, 'write', 60)
+        with pytest.raises(KeyboardInterrupt):
+            tool.sendfile(local, 'big.bin', compress=False, BUFFER_SIZE=512)
+        restore()
+    # the loop of the device was stopped, with Ctrl-C enabled again, and the journal was left behind.
+    assert wait_for_ctrl_c(device)
+    assert read_journal('upload', local, '/flash/big.bin')['remote'] == '/flash/big.bin'
+    held = os.path.getsize(os.path.join(flash, 'big.bin'))
+    assert 0 < held < len(DATA)
+    capsys.readouterr()
+    tool.sendfile(local, './big.bin', resume=True)
+    assert f'Resuming [{local}] from byte {held}.' in capsys.readouterr().out
+    with open(os.path.join(flash, 'big.bin'), 'rb') as f:
+        assert f.read() == DATA
+    assert read_journal('upload', local, 'big.bin') is None
+
+
+def test_resume_a_download(tool, device, flash, tmp_path, monkeypatch, capsys):
+    with open(os.path.join(flash, 'big.bin'), 'wb') as f:
+        f.write(DATA)
+    copy = str(tmp_path / 'copy.bin')
+    tool.listdir()
+    restore = interrupt(monkeypatch, tool, 'readinto', 30)
+    with pytest.raises(KeyboardInterrupt):
+        tool.recvfile('big.bin', copy, compress=False, BUFFER_SIZE=512)
+    restore()
+    # the frames already in flight are drained until the device sees the abort.
+    end = time.monotonic() + 3
+    while device._intr != 3 and time.monotonic() < end:
+        tool.serial.read(tool.serial.in_waiting or 1)
+    assert device._intr == 3
+    held = os.path.getsize(copy)
+    assert 0 < held < len(DATA)
+    capsys.readouterr()
+    tool.recvfile('/flash/big.bin', copy, resume=True)
+    assert f'Resuming [/flash/big.bin] from byte {held}.' in capsys.readouterr().out
+    with open(copy, 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_resume_starts_over_when_the_files_differ(tool, flash, local, tmp_path, capsys):
+    write_journal('upload', local, 'big.bin')
+    with open(os.path.join(flash, 'big.bin'), 'wb') as f:
+        f.write(b'zz' + DATA[2:1000])
+    tool.sendfile(local, 'big.bin', resume=True)
+    assert "doesn't match the first 1000 bytes" in capsys.readouterr().out
+    write_journal('upload', local, 'gone.bin')
+    tool.sendfile(local, 'gone.bin', resume=True)
+    assert 'no longer on the device' in capsys.readouterr().out
+    copy = tmp_path / 'copy.bin'
+    copy.write_bytes(DATA + b'extra')
+    write_journal('download', str(copy), 'big.bin')
+    tool.recvfile('big.bin', str(copy), resume=True)
+    assert 'is larger than the whole file' in capsys.readouterr().out
+    for name in ('big.bin', 'gone.bin'):
+        with open(os.path.join(flash, name), 'rb') as f:
+            assert f.read() == DATA
+    assert copy.read_bytes() == DATA
+
+
+def test_resume_without_a_journal(tool, flash, local, capsys):
+    tool.sendfile(local, 'big.bin', resume=True)
+    assert 'No interrupted transfer of this file was found' in capsys.readouterr().out
+
+
+def test_the_device_gives_up_on_a_vanished_host(tool, device, local):
+    tool.timeout = 1
+    steps = tool.upload_tree_steps([(local, '/flash/big.bin')], 512, 'raw', False)
+    request = next(steps)
+    for _ in range(30):
+        request = steps.send(getattr(tool, request[0])(*request[1:]))
+    steps.close()
+    assert device._intr == -1
+    assert wait_for_ctrl_c(device)
+    tool.in_raw_repl = False
+    assert tool.run('print(6)').strip() == '6'
+
+
+def test_journals_are_keyed_on_the_absolute_paths(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_journal('upload', 'big.bin', 'big.bin')
+    assert read_journal('upload', str(tmp_path / 'big.bin'), '/flash/big.bin') is not None
+    assert read_journal('upload', 'big.bin', '/flash//lib/../big.bin') is not None
+    assert read_journal('download', 'big.bin', 'big.bin') is None
+    assert read_journal('upload', 'big.bin', '/big.bin') is None
+    assert os.path.dirname(src.JOURNAL_DIR) == str(tmp_path / 'cache')
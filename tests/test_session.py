@@ -0,0 +1,38 @@
+import pytest
+
+from src import DeviceError
+
+
+def count_handshakes(tool, monkeypatch):
+    writes = []
+    write = tool.write
+    monkeypatch.setattr(tool, 'write', lambda data: writes.append(bytes(data)) or write(data))
+    return lambda: writes.count(b'\r\x01')
+
+
+def test_session_enters_the_raw_repl_once(tool, monkeypatch):
+    handshakes = count_handshakes(tool, monkeypatch)
+    with tool.session():
+        tool.run('a = 5')
+        assert tool.in_raw_repl
+        with tool.session():
+            assert tool.run('print(a)').strip() == '5'
+        assert tool.in_raw_repl
+        tool.ls(show=False)
+    assert not tool.in_raw_repl
+    assert handshakes() == 1
+
+
+def test_commands_outside_a_session_enter_the_raw_repl_each_time(tool, monkeypatch):
+    handshakes = count_handshakes(tool, monkeypatch)
+    tool.run('a = 5')
+    tool.run('print(a)')
+    assert not tool.in_raw_repl
+    assert handshakes() == 2
+
+
+def test_session_reset(tool):
+    with tool.session(reset=True):
+        tool.run('a = 5')
+    with pytest.raises(DeviceError, match='NameError'):
+        tool.run('print(a)')
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / 'app'
+    (root / 'lib' / 'drivers').mkdir(parents=True)
+    (root / 'main.py').write_text('import lib.utils\n')
+    (root / 'lib' / 'utils.py').write_text('VALUE = 1\n')
+    (root / 'lib' / 'drivers' / 'blob.bin').write_bytes(bytes(range(256)) * 8)
+    return root
+
+
+def remote(flash, path):
+    with open(os.path.join(flash, path), 'rb') as f:
+        return f.read()
+
+
+def test_sync_sends_only_the_changed_files(tool, flash, tree, capsys):
+    tool.sync(str(tree), 'app')
+    assert '3 file(s) sent, 0 unchanged' in capsys.readouterr().out
+    assert remote(flash, 'app/lib/drivers/blob.bin') == bytes(range(256)) * 8
+    tool.sync(str(tree), 'app')
+    assert '0 file(s) sent, 3 unchanged' in capsys.readouterr().out
+    (tree / 'lib' / 'utils.py').write_text('VALUE = 2\n')
+    tool.sync(str(tree), 'app')
+    assert '1 file(s) sent, 2 unchanged' in capsys.readouterr().out
+    assert remote(flash, 'app/lib/utils.py') == b'VALUE = 2\n'
+
+
+def test_sync_delete(tool, flash, tree, capsys):
+    tool.sync(str(tree), 'app')
+    os.remove(tree / 'lib' / 'drivers' / 'blob.bin')
+    os.rmdir(tree / 'lib' / 'drivers')
+    os.remove(tree / 'main.py')
+    tool.sync(str(tree), 'app')
+    assert os.path.exists(os.path.join(flash, 'app', 'main.py'))
+    capsys.readouterr()
+    tool.sync(str(tree), 'app', delete=True)
+    assert '0 file(s) sent, 1 unchanged, 2 removed' in capsys.readouterr().out
+    assert sorted(os.listdir(os.path.join(flash, 'app'))) == ['lib']
+    assert os.listdir(os.path.join(flash, 'app', 'lib')) == ['utils.py']
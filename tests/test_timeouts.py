@@ -0,0 +1,40 @@
+import os
+from time import monotonic
+
+import pytest
+
+from src import DEFAULT_TIMEOUT, DeviceTimeout, SerialTool
+
+
+def test_a_stalled_command_times_out(tool):
+    tool.timeout = 0.5
+    start = monotonic()
+    with pytest.raises(DeviceTimeout, match='the output of the command'):
+        tool.run('import time\ntime.sleep(5)')
+    assert monotonic() - start < 2
+    assert tool.run('print(3)').strip() == '3'
+
+
+def test_no_timeout(tool):
+    tool.timeout = 0
+    assert tool.run('import time\ntime.sleep(0.3)\nprint(4)').strip() == '4'
+    assert tool.deadline is None and tool.remaining() is None
+    assert tool.host_timeout_ms() == -1
+    tool.timeout = None
+    assert tool.host_timeout_ms() == DEFAULT_TIMEOUT * 1000
+
+
+def test_each_step_of_a_transfer_has_its_own_deadline(make_device, tmp_path):
+    """A transfer that takes longer than the timeout as a whole completes, as long as every frame arrives in time."""
+    data = os.urandom(150_000)
+    (tmp_path / 'data.bin').write_bytes(data)
+    device = make_device(baudrate=1_000_000)
+    tool = SerialTool(port=device.port, timeout=1)
+    try:
+        start = monotonic()
+        tool.sendfile(str(tmp_path / 'data.bin'), 'data.bin', compress=False)
+        assert monotonic() - start > 1
+        tool.recvfile('data.bin', str(tmp_path / 'copy.bin'), compress=False)
+    finally:
+        tool.close()
+    assert (tmp_path / 'copy.bin').read_bytes() == data
@@ -0,0 +1,108 @@
+import os
+
+import pytest
+
+from src import SerialTool
+
+DATA = bytes(range(256)) * 40 + b'\r\n\x04\x03tail'
+
+
+@pytest.fixture
+def local(tmp_path):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(DATA)
+    return str(path)
+
+
+@pytest.mark.parametrize('frame_size', [None, 64, 1000])
+def test_upload(tool, flash, local, frame_size):
+    tool.sendfile(local, 'data.bin', BUFFER_SIZE=frame_size)
+    with open(os.path.join(flash, 'data.bin'), 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_upload_keeps_an_existing_file_unless_forced(tool, flash, local, capsys):
+    with open(os.path.join(flash, 'data.bin'), 'wb') as f:
+        f.write(b'old')
+    tool.sendfile(local, 'data.bin')
+    assert 'File exists' in capsys.readouterr().out
+    with open(os.path.join(flash, 'data.bin'), 'rb') as f:
+        assert f.read() == b'old'
+    tool.sendfile(local, 'data.bin', forced=True)
+    with open(os.path.join(flash, 'data.bin'), 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_upload_to_a_missing_directory_saves_to_root(tool, flash, local, capsys):
+    tool.sendfile(local, 'missing/data.bin')
+    assert 'Saving to root' in capsys.readouterr().out
+    with open(os.path.join(flash, 'data.bin'), 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_upload_an_empty_file(tool, flash, tmp_path):
+    (tmp_path / 'empty').write_bytes(b'')
+    tool.sendfile(str(tmp_path / 'empty'), 'empty')
+    assert os.path.getsize(os.path.join(flash, 'empty')) == 0
+
+
+@pytest.mark.parametrize('frame_size', [None, 64, 1000])
+def test_download(tool, flash, tmp_path, frame_size):
+    with open(os.path.join(flash, 'data.bin'), 'wb') as f:
+        f.write(DATA)
+    tool.recvfile('data.bin', str(tmp_path / 'copy.bin'), BUFFER_SIZE=frame_size)
+    assert (tmp_path / 'copy.bin').read_bytes() == DATA
+
+
+def test_download_a_path_with_quotes(tool, flash, tmp_path):
+    with open(os.path.join(flash, "it's.bin"), 'wb') as f:
+        f.write(DATA)
+    tool.recvfile("it's.bin", str(tmp_path / 'copy.bin'))
+    assert (tmp_path / 'copy.bin').read_bytes() == DATA
+
+
+def test_download_a_missing_file(tool, tmp_path, capsys):
+    tool.recvfile('missing.bin', str(tmp_path / 'copy.bin'))
+    assert "File doesn't exist" in capsys.readouterr().out
+    assert not (tmp_path / 'copy.bin').exists()
+
+
+@pytest.fixture
+def text(tmp_path):
+    path = tmp_path / 'text.txt'
+    path.write_bytes(b''.join(b'line %d of a log that compresses well\n' % (i % 50) for i in range(4000)))
+    return str(path)
+
+
+def test_upload_compressed(tool, flash, text):
+    tool.sendfile(text, 'text.txt', compress=True)
+    with open(os.path.join(flash, 'text.txt'), 'rb') as f:
+        assert f.read() == open(text, 'rb').read()
+    assert tool.metrics.bytes_written < os.path.getsize(text) / 2
+
+
+def test_upload_base64(tool, flash, local):
+    tool.sendfile(local, 'data.bin', encoding='base64')
+    with open(os.path.join(flash, 'data.bin'), 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_download_compressed(tool, flash, text, tmp_path):
+    tool.sendfile(text, 'text.txt', compress=False)
+    tool.metrics.reset()
+    tool.recvfile('text.txt', str(tmp_path / 'copy.txt'), compress=True)
+    assert (tmp_path / 'copy.txt').read_bytes() == open(text, 'rb').read()
+    assert tool.metrics.bytes_read < os.path.getsize(text) / 2
+
+
+def test_transfers_without_the_codecs(make_device, text, tmp_path):
+    device = make_device(deflate=False, compress=False)
+    tool = SerialTool(port=device.port, timeout=10)
+    try:
+        tool.sendfile(text, 'text.txt')
+        tool.recvfile('text.txt', str(tmp_path / 'copy.txt'))
+    finally:
+        tool.close()
+    with open(os.path.join(device.root, 'flash', 'text.txt'), 'rb') as f:
+        assert f.read() == open(text, 'rb').read()
+    assert (tmp_path / 'copy.txt').read_bytes() == open(text, 'rb').read()
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / 'app'
+    (root / 'lib' / 'empty').mkdir(parents=True)
+    (root / 'main.py').write_text('import lib.utils\n')
+    (root / 'lib' / 'utils.py').write_text('VALUE = 1\n')
+    (root / 'lib' / 'blob.bin').write_bytes(bytes(range(256)) * 40)
+    return root
+
+
+def files(root):
+    found = {}
+    for path, dirs, names in os.walk(root):
+        rel = os.path.relpath(path, root)
+        found[rel] = sorted(dirs)
+        for name in names:
+            with open(os.path.join(path, name), 'rb') as f:
+                found[os.path.join(rel, name)] = f.read()
+    return found
+
+
+def test_senddir_and_recvdir(tool, flash, tree, tmp_path):
+    tool.senddir(str(tree), 'app')
+    assert files(os.path.join(flash, 'app')) == files(tree)
+    tool.recvdir('app', str(tmp_path / 'copy'))
+    assert files(tmp_path / 'copy') == files(tree)
+
+
+def test_senddir_keeps_the_existing_files_unless_forced(tool, flash, tree, capsys):
+    tool.senddir(str(tree), 'app')
+    (tree / 'main.py').write_text('print(2)\n')
+    tool.senddir(str(tree), 'app')
+    assert 'File exists [app/main.py]' in capsys.readouterr().out
+    with open(os.path.join(flash, 'app', 'main.py')) as f:
+        assert f.read() == 'import lib.utils\n'
+    tool.senddir(str(tree), 'app', forced=True)
+    with open(os.path.join(flash, 'app', 'main.py')) as f:
+        assert f.read() == 'print(2)\n'
+
+
+def test_recvdir_of_a_missing_directory(tool, tmp_path, capsys):
+    tool.recvdir('missing', str(tmp_path / 'copy'))
+    assert "Directory doesn't exist" in capsys.readouterr().out
+    assert not (tmp_path / 'copy').exists()
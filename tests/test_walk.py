@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+from src import S_IFDIR, S_IFREG
+
+
+@pytest.fixture
+def board(flash):
+    os.makedirs(os.path.join(flash, 'lib', 'drivers'))
+    os.makedirs(os.path.join(flash, '.hidden'))
+    for path, size in [('main.py', 10), ('lib/utils.py', 100), ('lib/drivers/uart.py', 1000), ('.hidden/x', 1)]:
+        with open(os.path.join(flash, *path.split('/')), 'wb') as f:
+            f.write(b'x' * size)
+    return flash
+
+
+def test_walk(tool, board, monkeypatch):
+    tool.walk()
+    scripts = []
+    execute = tool.execute
+    monkeypatch.setattr(tool, 'execute', lambda cmd: scripts.append(cmd) or execute(cmd))
+    assert sorted(tool.walk()) == [
+        ('.hidden', S_IFDIR, 0), ('.hidden/x', S_IFREG, 1), ('lib', S_IFDIR, 0), ('lib/drivers', S_IFDIR, 0),
+        ('lib/drivers/uart.py', S_IFREG, 1000), ('lib/utils.py', S_IFREG, 100), ('main.py', S_IFREG, 10)]
+    assert len(scripts) == 1
+    assert sorted(tool.walk('lib', show_hidden=False, dir_only=True)) == [('drivers', S_IFDIR, 0)]
+    assert [rel for rel, _, _ in tool.walk(show_hidden=False)].count('.hidden') == 0
+    assert tool.walk('missing') is None
+
+
+def test_du(tool, board, capsys):
+    assert tool.du() == 1111
+    assert tool.du('lib') == 1100
+    assert tool.du(show_hidden=False) == 1110
+    out = capsys.readouterr().out.splitlines()
+    assert out[-3:] == ['      1000  ./lib/drivers', '      1100  ./lib', '      1110  .']
+
+
+def test_tree(tool, board, capsys):
+    assert tool.tree(show_hidden=False) == (2, 3)
+    assert capsys.readouterr().out.splitlines()[-6:] == [
+        'lib (dir)', '     ├───drivers (dir)', '     │   └───uart.py', '     └───utils.py', 'main.py', '2 folder(s), 3 files.']
+    assert tool.tree('lib', dir_only=True) == (1, 0)
+
+
+def test_ls_recursive(tool, board, capsys):
+    tool.listdir()
+    capsys.readouterr()
+    tool.ls_recursive('lib')
+    assert capsys.readouterr().out.split('\n\n')[:2] == [
+        'lib:\n[d]          drivers\n[f]         utils.py        100', 'lib/drivers:\n[f]          uart.py       1000']